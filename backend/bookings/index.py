@@ -1,22 +1,595 @@
 """API для управления бронированиями с полной информацией о клиенте, услугах и финансах"""
 
+import base64
+import contextvars
+import csv
+import gzip
+import hashlib
+import io
 import json
 import os
+import re
+import threading
+import time
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor, execute_values
 
 SCHEMA = 't_p81623955_crm_system_creation'
 
+# Имя функции: подпись в логах трассировки и имя серверного курсора экспорта
+FUNCTION_NAME = 'bookings'
+
+# Быстрая сериализация: orjson, если установлен, иначе стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_default(value):
+    """Типы из psycopg2, которых нет в JSON: Decimal, date/datetime/time и прочее"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def dumps(data) -> str:
+    """Сериализация ответа; строки RealDictRow идут в JSON напрямую, без копии в dict"""
+    started = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    else:
+        body = json.dumps(data, default=json_default, ensure_ascii=False)
+    trace = _trace.get()
+    if trace is not None:
+        trace.serialize_ms += (time.perf_counter() - started) * 1000
+    return body
+
+# Сжатие ответов по Accept-Encoding: brotli, если установлен, иначе gzip.
+# Ответы меньше порога не сжимаются - выигрыш съедают base64 и CPU
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '2048'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+def accepted_encoding(event: dict) -> Optional[str]:
+    """Лучшая кодировка из Accept-Encoding клиента: br, затем gzip; None - без сжатия"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    accepted = set()
+    for item in (headers.get('accept-encoding') or '').split(','):
+        name, _, param = item.partition(';')
+        param = param.strip().lower()
+        if param.startswith('q='):
+            try:
+                if float(param[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress_response(event: dict, response: dict) -> dict:
+    """Сжимает текстовый ответ выше порога; тело уходит в base64 по контракту шлюза"""
+    body = response.get('body')
+    headers = response.get('headers') or {}
+    if response.get('isBase64Encoded') or not isinstance(body, str) or 'Content-Encoding' in headers:
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return response
+    # Ответ такого размера зависит от Accept-Encoding, даже если клиент сжатие не принял
+    headers = {**headers, 'Vary': 'Accept-Encoding'}
+    response['headers'] = headers
+    encoding = accepted_encoding(event)
+    if encoding is None:
+        return response
+    started = time.perf_counter()
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    trace = _trace.get()
+    if trace is not None:
+        trace.compress_ms += (time.perf_counter() - started) * 1000
+        trace.encoding = encoding
+    if len(compressed) >= len(raw):
+        return response
+    headers['Content-Encoding'] = encoding
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+# Пул соединений живёт на уровне модуля и переиспользуется тёплыми вызовами функции
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+POOL_HEALTHCHECK_AFTER = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30'))
+
+_pool: List[list] = []
+_pool_lock = threading.Lock()
+pool_stats = {'hits': 0, 'misses': 0, 'evicted': 0}
+
+def _close_quietly(conn) -> None:
+    """Закрывает соединение, игнорируя ошибки уже разорванного сокета"""
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _is_healthy(conn, idle_for: float) -> bool:
+    """Проверяет, что соединение из пула ещё живо"""
+    if conn.closed:
+        return False
+    if idle_for < POOL_HEALTHCHECK_AFTER:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_db_connection():
-    """Создает подключение к базе данных"""
+    """Берёт соединение из пула или создаёт новое"""
+    now = time.monotonic()
+    with _pool_lock:
+        while _pool:
+            conn, last_used = _pool.pop()
+            idle_for = now - last_used
+            if idle_for > POOL_IDLE_TIMEOUT or not _is_healthy(conn, idle_for):
+                _close_quietly(conn)
+                pool_stats['evicted'] += 1
+                continue
+            pool_stats['hits'] += 1
+            _record_connect('hit', now)
+            return conn
+        pool_stats['misses'] += 1
     dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn, cursor_factory=RealDictCursor, options=f'-c search_path={SCHEMA}')
+    conn = psycopg2.connect(dsn, connection_factory=PooledConnection, cursor_factory=TimedCursor, options=f'-c search_path={SCHEMA}')
+    _record_connect('miss', now)
+    return conn
+
+def _record_connect(pool_result: str, started: float) -> None:
+    trace = _trace.get()
+    if trace is not None:
+        trace.pool = pool_result
+        trace.connect_ms = (time.monotonic() - started) * 1000
+
+def release_db_connection(conn) -> None:
+    """Возвращает соединение в пул (лишние и сломанные закрываются)"""
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        _close_quietly(conn)
+        return
+    now = time.monotonic()
+    with _pool_lock:
+        for entry in [e for e in _pool if now - e[1] > POOL_IDLE_TIMEOUT]:
+            _pool.remove(entry)
+            _close_quietly(entry[0])
+            pool_stats['evicted'] += 1
+        if len(_pool) < POOL_MAX_SIZE:
+            _pool.append([conn, now])
+            return
+    _close_quietly(conn)
+
+def get_pool_stats() -> dict:
+    """Счётчики пула соединений текущего инстанса"""
+    with _pool_lock:
+        return {**pool_stats, 'idle': len(_pool), 'max_size': POOL_MAX_SIZE}
+
+# Подготовленные запросы: горячие SQL разбираются и планируются один раз на соединение пула,
+# дальше выполняются через EXECUTE по имени. За pgbouncer в режиме transaction нужно DB_PREPARED_STATEMENTS=0
+PREPARED_STATEMENTS_ENABLED = os.environ.get('DB_PREPARED_STATEMENTS', '1') == '1'
+PREPARED_PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+_statements: Dict[str, 'PreparedStatement'] = {}
+_statements_lock = threading.Lock()
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Соединение пула; помнит, какие запросы на нём уже подготовлены"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+class PreparedStatement:
+    """Запрос с именованными параметрами %(name)s; PREPARE выполняется при первом вызове на соединении"""
+
+    def __init__(self, name: str, sql: str):
+        params = list(dict.fromkeys(PREPARED_PARAM_RE.findall(sql)))
+        self.name = name
+        self.sql = sql
+        self.prepare_sql = f'PREPARE {name} AS ' + PREPARED_PARAM_RE.sub(
+            lambda match: f'${params.index(match.group(1)) + 1}', sql
+        )
+        self.execute_sql = f'EXECUTE {name}' + (f" ({', '.join(f'%({param})s' for param in params)})" if params else '')
+        self.stats = {'prepared': 0, 'executed': 0}
+        with _statements_lock:
+            _statements[name] = self
+
+    def execute(self, cursor, params: Optional[dict] = None) -> None:
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared', None)
+        if not PREPARED_STATEMENTS_ENABLED or prepared is None:
+            cursor.execute(self.sql, params)
+            return
+        if self.name not in prepared:
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+            with _statements_lock:
+                self.stats['prepared'] += 1
+        try:
+            cursor.execute(self.execute_sql, params)
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported):
+            # Запрос пропал на сервере или миграция поменяла колонки результата: соединение в пул не вернётся
+            _close_quietly(conn)
+            raise
+        with _statements_lock:
+            self.stats['executed'] += 1
+
+def get_statement_stats() -> dict:
+    """Счётчики подготовленных запросов: reused - выполнения без повторного разбора и планирования"""
+    with _statements_lock:
+        return {
+            'enabled': PREPARED_STATEMENTS_ENABLED,
+            'statements': {
+                name: {**statement.stats, 'reused': statement.stats['executed'] - statement.stats['prepared']}
+                for name, statement in _statements.items()
+            }
+        }
+
+# Кэш справочника автопарка на уровне модуля: тёплые вызовы берут fleet из памяти.
+# После FLEET_CACHE_TTL версия таблицы сверяется одним дешёвым запросом, данные перечитываются только при изменении
+FLEET_CACHE_TTL = float(os.environ.get('FLEET_CACHE_TTL', '60'))
+FLEET_CACHE_COLUMNS = 'id, model, license_plate, status, current_location, next_service_date, is_active'
+
+_FLEET_CACHE_EMPTY = {'rows': None, 'by_id': {}, 'token': None, 'checked_at': 0.0}
+_fleet_cache: dict = _FLEET_CACHE_EMPTY
+_fleet_cache_lock = threading.Lock()
+fleet_cache_stats = {'hits': 0, 'revalidated': 0, 'loads': 0, 'invalidations': 0}
+
+def get_fleet(cursor, token: Optional[str] = None) -> dict:
+    """Автопарк из кэша: rows (по модели и номеру), by_id и token версии; снимок кэша не меняется на месте.
+
+    token - уже прочитанная версия fleet (например, для ETag): снимок сверяется с ней без учёта TTL,
+    чтобы данные ответа не были старше его ETag
+    """
+    global _fleet_cache
+    with _fleet_cache_lock:
+        cache = _fleet_cache
+        if cache['rows'] is not None and (
+            cache['token'] == token if token is not None
+            else time.monotonic() - cache['checked_at'] < FLEET_CACHE_TTL
+        ):
+            fleet_cache_stats['hits'] += 1
+            return cache
+    
+    if token is None:
+        token = get_version_token(cursor, ['fleet'])
+    if cache['rows'] is not None and cache['token'] == token:
+        cache = {**cache, 'checked_at': time.monotonic()}
+        with _fleet_cache_lock:
+            _fleet_cache = cache
+            fleet_cache_stats['revalidated'] += 1
+        return cache
+    
+    FLEET_CACHE_LOAD.execute(cursor)
+    rows = [dict(row) for row in cursor.fetchall()]
+    cache = {'rows': rows, 'by_id': {row['id']: row for row in rows}, 'token': token, 'checked_at': time.monotonic()}
+    with _fleet_cache_lock:
+        _fleet_cache = cache
+        fleet_cache_stats['loads'] += 1
+    return cache
+
+def invalidate_fleet_cache() -> None:
+    """Сбрасывает кэш автопарка после записи в fleet"""
+    global _fleet_cache
+    with _fleet_cache_lock:
+        _fleet_cache = _FLEET_CACHE_EMPTY
+        fleet_cache_stats['invalidations'] += 1
+
+def get_fleet_cache_stats() -> dict:
+    with _fleet_cache_lock:
+        return {**fleet_cache_stats, 'size': len(_fleet_cache['by_id']), 'ttl': FLEET_CACHE_TTL}
+
+# Инструментация вызова: время подключения, каждого SQL-запроса, сериализации и размер ответа
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') == '1'
+TRACE_SERVER_TIMING = os.environ.get('TRACE_SERVER_TIMING', '0') == '1'
+TRACE_SQL_PREVIEW = 120
+
+_trace: contextvars.ContextVar = contextvars.ContextVar('trace', default=None)
+
+class RequestTrace:
+    """Замеры одного вызова функции"""
+
+    def __init__(self, method: str, action: Optional[str]):
+        self.started = time.perf_counter()
+        self.method = method
+        self.action = action
+        self.connect_ms = 0.0
+        self.pool = None
+        self.queries: List[dict] = []
+        self.serialize_ms = 0.0
+        self.compress_ms = 0.0
+        self.encoding = None
+
+    def add_query(self, sql, elapsed_ms: float, rows: int) -> None:
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', 'replace')
+        self.queries.append({
+            'sql': ' '.join(str(sql).split())[:TRACE_SQL_PREVIEW],
+            'ms': round(elapsed_ms, 3),
+            'rows': rows
+        })
+
+    def db_ms(self) -> float:
+        return sum(q['ms'] for q in self.queries)
+
+class TimedCursorMixin:
+    """Засекает время и число строк каждого execute"""
+
+    def execute(self, query, vars=None):
+        trace = _trace.get()
+        if trace is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace.add_query(query, (time.perf_counter() - started) * 1000, self.rowcount)
+
+class TimedCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+class TimedTupleCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+def start_trace(event: dict) -> RequestTrace:
+    params = event.get('queryStringParameters') or {}
+    trace = RequestTrace(event.get('httpMethod', 'GET'), params.get('action'))
+    _trace.set(trace)
+    return trace
+
+def finish_trace(trace: RequestTrace, response: dict) -> dict:
+    """Пишет структурированный лог вызова и, если включено, заголовок Server-Timing"""
+    _trace.set(None)
+    total_ms = (time.perf_counter() - trace.started) * 1000
+    body = response.get('body') or ''
+    if TRACE_SERVER_TIMING:
+        response.setdefault('headers', {}).update({
+            'Server-Timing': ', '.join([
+                f'connect;dur={trace.connect_ms:.2f}',
+                f'db;dur={trace.db_ms():.2f}',
+                f'serialize;dur={trace.serialize_ms:.2f}',
+                f'compress;dur={trace.compress_ms:.2f}',
+                f'total;dur={total_ms:.2f}'
+            ]),
+            'Timing-Allow-Origin': '*'
+        })
+    if TRACE_LOG:
+        print(json.dumps({
+            'event': 'request',
+            'function': FUNCTION_NAME,
+            'method': trace.method,
+            'action': trace.action,
+            'status': response.get('statusCode'),
+            'total_ms': round(total_ms, 3),
+            'connect_ms': round(trace.connect_ms, 3),
+            'pool': trace.pool,
+            'db_ms': round(trace.db_ms(), 3),
+            'queries': trace.queries,
+            'serialize_ms': round(trace.serialize_ms, 3),
+            'compress_ms': round(trace.compress_ms, 3),
+            'encoding': trace.encoding,
+            'response_bytes': len(body.encode('utf-8')) if isinstance(body, str) else len(body)
+        }, ensure_ascii=False))
+    return response
+
+# Граница мусорных дат: всё, что позже, считается ошибкой ввода
+MAX_VALID_DATE = '2100-01-01'
+
+# Постраничная выдача списка броней (keyset по created_at, id)
+MAX_PAGE_SIZE = 500
+
+BOOKING_COLUMNS = {
+    'id', 'client_name', 'client_phone', 'client_email', 'client_birth_date',
+    'client_passport_series', 'client_passport_number', 'client_passport_issued_by',
+    'client_passport_issued_date', 'client_passport_registration',
+    'client_driver_license_series', 'client_driver_license_number',
+    'client_driver_license_issued_date', 'client_driver_license_expiry_date',
+    'client_driver_license_issued_by', 'client_is_foreign', 'client_id',
+    'vehicle_id', 'vehicle_model', 'vehicle_license_plate',
+    'start_date', 'end_date', 'days', 'pickup_location', 'dropoff_location',
+    'route_type', 'is_international', 'planned_km_total', 'actual_km_total',
+    'status', 'booking_type', 'total_price', 'paid_amount', 'deposit_amount',
+    'deposit_status', 'deposit_paid_date', 'deposit_returned_date', 'deposit_hold_method',
+    'services', 'rental_days', 'rental_km', 'rental_price_per_day', 'rental_price_per_km',
+    'has_child_seat', 'child_seat_count', 'has_gps', 'has_winter_tires', 'has_roof_rack',
+    'has_additional_driver', 'additional_driver_name', 'additional_driver_license',
+    'insurance_type', 'insurance_cost', 'insurance_deductible',
+    'fuel_level_pickup', 'fuel_level_return', 'fuel_policy',
+    'vehicle_condition_pickup', 'vehicle_condition_return',
+    'damages_on_pickup', 'damages_on_return',
+    'contract_number', 'contract_signed_date', 'contract_pdf_url', 'documents',
+    'assigned_manager', 'pickup_confirmed', 'return_confirmed',
+    'pickup_actual_date', 'return_actual_date',
+    'communication_channel', 'source', 'client_rating', 'client_review',
+    'notes', 'custom_fields', 'payments', 'internal_notes',
+    'google_calendar_event_id', 'external_id', 'created_by', 'created_at', 'updated_at'
+}
+
+# Паспорт, права и контакты клиента в броне - снимок на момент оформления для договора.
+# В список броней они не входят: клиент подтягивается по client_id с include=client
+BOOKING_CLIENT_DETAIL_FIELDS = (
+    'client_email', 'client_birth_date',
+    'client_passport_series', 'client_passport_number', 'client_passport_issued_by',
+    'client_passport_issued_date', 'client_passport_registration',
+    'client_driver_license_series', 'client_driver_license_number',
+    'client_driver_license_issued_date', 'client_driver_license_expiry_date',
+    'client_driver_license_issued_by', 'client_is_foreign'
+)
+BOOKING_LIST_FIELDS = sorted(BOOKING_COLUMNS - set(BOOKING_CLIENT_DETAIL_FIELDS))
+
+# Клиент брони для include=client (JOIN с clients по client_id)
+CLIENT_INCLUDE_COLUMNS = (
+    'id', 'name', 'phone', 'email', 'birth_date',
+    'passport_series', 'passport_number', 'passport_issued_by', 'passport_issued_date', 'address',
+    'driver_license_series', 'driver_license_number', 'driver_license_issued_date', 'is_blacklist'
+)
+CLIENT_INCLUDE_SELECT = "CASE WHEN c.id IS NULL THEN NULL ELSE json_build_object(" + ', '.join(
+    f"'{column}', c.{column}" for column in CLIENT_INCLUDE_COLUMNS
+) + ") END AS client"
+
+# Параметры, от которых зависит ответ списка броней; только они входят в ETag
+# (фронтенд добавляет к каждому запросу t=<время> против кэша браузера)
+BOOKING_ETAG_PARAMS = ('id', 'status', 'vehicle_id', 'date_from', 'date_to', 'fields', 'limit', 'after', 'count', 'include')
+
+# Поля автомобиля, подтягиваемые JOIN-ом с fleet
+FLEET_JOIN_FIELDS = {
+    'vehicle_model_full': 'f.model',
+    'vehicle_plate_full': 'f.license_plate'
+}
+
+# Те же поля в строках кэша автопарка (get_fleet)
+FLEET_CACHE_FIELDS = {
+    'vehicle_model_full': 'model',
+    'vehicle_plate_full': 'license_plate'
+}
+
+# Статусы, при которых бронь не занимает автомобиль
+NON_BLOCKING_STATUSES = ('Отменено', 'Черновик', 'Вишлист', 'Завершено')
+
+# Выгрузка: размер порции серверного курсора и блока кодирования
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BLOCK_SIZE = 64 * 1024
+
+# Колонки INSERT брони и значения по умолчанию для отсутствующих полей
+BOOKING_INSERT_FIELDS = [
+    ('client_name', None), ('client_phone', None), ('client_email', None), ('client_birth_date', None),
+    ('client_passport_series', None), ('client_passport_number', None), ('client_passport_issued_by', None),
+    ('client_passport_issued_date', None), ('client_passport_registration', None),
+    ('client_driver_license_series', None), ('client_driver_license_number', None),
+    ('client_driver_license_issued_date', None), ('client_driver_license_issued_by', None),
+    ('client_is_foreign', False), ('client_id', None),
+    ('vehicle_id', None), ('vehicle_model', None), ('vehicle_license_plate', None),
+    ('start_date', None), ('end_date', None), ('days', 1),
+    ('pickup_location', None), ('dropoff_location', None),
+    ('route_type', None), ('is_international', False), ('planned_km_total', None),
+    ('status', 'Бронь'), ('booking_type', 'rent'), ('total_price', 0), ('paid_amount', 0), ('deposit_amount', 0),
+    ('deposit_status', 'pending'), ('deposit_hold_method', None),
+    ('services', []), ('rental_days', None), ('rental_km', None),
+    ('rental_price_per_day', None), ('rental_price_per_km', None),
+    ('has_child_seat', False), ('child_seat_count', 0), ('has_gps', False), ('has_winter_tires', False),
+    ('has_roof_rack', False), ('has_additional_driver', False), ('additional_driver_name', None),
+    ('insurance_type', None), ('insurance_cost', 0), ('fuel_policy', 'full-to-full'),
+    ('communication_channel', None), ('source', None),
+    ('notes', None), ('custom_fields', []), ('payments', []), ('internal_notes', None),
+    ('created_by', None), ('assigned_manager', None)
+]
+BOOKING_JSON_FIELDS = {'services', 'custom_fields', 'payments'}
+BOOKING_REQUIRED_FIELDS = ['client_name', 'client_phone', 'start_date', 'end_date']
+
+BOOKING_INSERT_COLUMNS = ', '.join(field for field, _ in BOOKING_INSERT_FIELDS)
+BOOKING_INSERT_TEMPLATE = '(' + ', '.join(
+    '%s::jsonb' if field in BOOKING_JSON_FIELDS else '%s' for field, _ in BOOKING_INSERT_FIELDS
+) + ')'
+
+# При создании одной брони модель и номер берутся из fleet прямо в INSERT, если автомобиль найден,
+# Клиента по нормализованному телефону подставляет триггер link_booking_client (V0027); новых клиентов бронь
+# не заводит: мастер брони сам создаёт клиента со всеми данными при оформлении, и триггер
+# link_client_bookings привязывает к нему уже сохранённые брони
+BOOKING_FLEET_FIELDS = {'vehicle_model': 'model', 'vehicle_license_plate': 'license_plate'}
+BOOKING_CREATE_TEMPLATE = '(' + ', '.join(
+    f'COALESCE((SELECT {BOOKING_FLEET_FIELDS[field]} FROM fleet WHERE id = %(vehicle_id)s), %({field})s)'
+    if field in BOOKING_FLEET_FIELDS
+    else f'%({field})s::jsonb' if field in BOOKING_JSON_FIELDS else f'%({field})s'
+    for field, _ in BOOKING_INSERT_FIELDS
+) + ')'
+
+# Разрезы финансовой сводки по агрегатам finance_daily / finance_daily_totals (V0023): ключ группировки и подпись строки
+FINANCE_GROUPS = {
+    'day': ('fd.day', 'fd.day'),
+    'month': ("date_trunc('month', fd.day)::date", "date_trunc('month', fd.day)::date"),
+    'vehicle': ('fd.vehicle_id', "NULLIF(fd.vehicle_id, 0)"),
+    'manager': ('fd.manager', "NULLIF(fd.manager, '')")
+}
+
+# Ограничение размера одной пачки импорта
+IMPORT_MAX_ROWS = 10000
+IMPORT_PAGE_SIZE = 1000
+
+# Брошенные черновики мастера бронирования удаляет внешний таймер (POST ?action=cleanup_drafts):
+# черновик считается брошенным, если его не сохраняли дольше DRAFT_MAX_AGE
+DRAFT_MAX_AGE = '1 hour'
+
+# Счётчики карточек дашборда одним запросом. Брони читаются одним index-only проходом по
+# idx_bookings_end_date_status (V0028): все текущие и будущие, события дня считаются по ним же.
+# Долг - из итогов дня V0023, должники - из баланса клиентов V0022.
+# Отменённые брони, черновики и вишлист арендой не считаются
+DASHBOARD_SUMMARY = PreparedStatement('dashboard_summary', f"""
+    WITH current_bookings AS (
+        SELECT start_date, end_date, status, vehicle_id,
+               status NOT IN ('Отменено', 'Черновик', 'Вишлист') AS is_rental
+        FROM bookings
+        WHERE end_date >= CURRENT_DATE
+          AND end_date < '{MAX_VALID_DATE}'
+    ), booking_counts AS (
+        SELECT COUNT(*) FILTER (WHERE is_rental AND start_date <= LOCALTIMESTAMP AND end_date > LOCALTIMESTAMP) AS active_rentals,
+               COUNT(DISTINCT vehicle_id) FILTER (WHERE is_rental AND start_date <= LOCALTIMESTAMP AND end_date > LOCALTIMESTAMP) AS vehicles_busy,
+               COUNT(*) FILTER (WHERE is_rental AND start_date >= CURRENT_DATE AND start_date < CURRENT_DATE + 1) AS pickups_today,
+               COUNT(*) FILTER (WHERE is_rental AND end_date < CURRENT_DATE + 1) AS returns_today,
+               COUNT(*) FILTER (WHERE status = 'Бронь') AS reserved,
+               COUNT(*) FILTER (WHERE status = 'В аренде') AS on_rent,
+               COUNT(*) FILTER (WHERE status = 'Вишлист') AS wishlist,
+               COUNT(*) FILTER (WHERE status = 'Черновик') AS drafts
+        FROM current_bookings
+    ), fleet_counts AS (
+        SELECT COUNT(*) AS vehicles_total,
+               COUNT(*) FILTER (WHERE status = 'Свободен') AS vehicles_free,
+               COUNT(*) FILTER (WHERE next_service_date < CURRENT_DATE OR current_km >= next_service_km) AS service_overdue
+        FROM fleet
+        WHERE is_active = true
+    ), debts AS (
+        SELECT (SELECT COALESCE(SUM(revenue - paid), 0)::float8 FROM finance_daily_totals) AS debt_total,
+               (SELECT COUNT(*) FROM clients WHERE balance < 0) AS debtors
+    )
+    SELECT * FROM booking_counts, fleet_counts, debts
+""")
+DASHBOARD_SECTIONS = {
+    'bookings': ('active_rentals', 'pickups_today', 'returns_today', 'reserved', 'on_rent', 'wishlist', 'drafts'),
+    'fleet': ('vehicles_total', 'vehicles_free', 'vehicles_busy', 'service_overdue'),
+    'finance': ('debt_total', 'debtors')
+}
+
+# Сводка кэшируется на инстансе: открытие CRM несколькими менеджерами подряд - один запрос к базе
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', '5'))
+
+_dashboard_cache: dict = {'summary': None, 'loaded_at': 0.0}
+_dashboard_cache_lock = threading.Lock()
 
 def handler(event: dict, context) -> dict:
-    """API для управления бронированиями"""
-    print(f"Bookings API called: {event.get('httpMethod', 'GET')}")
+    """API для управления бронированиями: маршрутизация запроса под замером времени"""
+    trace = start_trace(event)
+    response = compress_response(event, handle_request(event, context))
+    return finish_trace(trace, response)
+
+def handle_request(event: dict, context) -> dict:
     method = event.get('httpMethod', 'GET') 
     
     # CORS preflight
@@ -26,18 +599,46 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, If-None-Match'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    params = event.get('queryStringParameters') or {}
+    if method == 'GET' and params.get('action') == 'pool_stats':
+        return success_response({
+            'pool': get_pool_stats(),
+            'fleet_cache': get_fleet_cache_stats(),
+            'prepared': get_statement_stats()
+        })
+    
+    # Сводка дашборда из кэша инстанса отдаётся без соединения с базой
+    if method == 'GET' and params.get('action') == 'dashboard':
+        summary = get_cached_dashboard_summary()
+        if summary is not None:
+            return success_response(summary)
+    
     conn = None
     try:
         conn = get_db_connection()
         
-        if method == 'GET':
+        if method == 'GET' and params.get('action') == 'availability':
+            return get_availability(conn, event)
+        elif method == 'GET' and params.get('action') == 'finance_summary':
+            return get_finance_summary(conn, event)
+        elif method == 'GET' and params.get('action') == 'dashboard':
+            return success_response(load_dashboard_summary(conn))
+        elif method == 'GET' and params.get('since'):
+            return get_booking_changes(conn, event)
+        elif method == 'GET' and params.get('action') == 'export':
+            return export_bookings(conn, event)
+        elif method == 'GET':
             return get_bookings(conn, event)
+        elif method == 'POST' and params.get('action') == 'import':
+            return import_bookings(conn, event)
+        elif method == 'POST' and params.get('action') == 'cleanup_drafts':
+            return success_response({'deleted': cleanup_abandoned_drafts(conn)})
         elif method == 'POST':
             return create_booking(conn, event)
         elif method == 'PUT':
@@ -51,76 +652,529 @@ def handler(event: dict, context) -> dict:
         return error_response(500, str(e))
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
-def get_bookings(conn, event: dict) -> dict:
-    """Получить список бронирований с фильтрацией"""
-    print("Fetching bookings...")
-    params = event.get('queryStringParameters', {}) or {}
-    booking_id = params.get('id')
+def encode_cursor(created_at: Optional[datetime], booking_id: int) -> str:
+    """Кодирует позицию последней брони страницы в непрозрачный курсор"""
+    raw = json.dumps([created_at.isoformat() if created_at else None, booking_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor_value: str) -> tuple:
+    """Разбирает курсор `after` обратно в пару (created_at, id)"""
+    padded = cursor_value + '=' * (-len(cursor_value) % 4)
+    created_at, booking_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return datetime.fromisoformat(created_at), int(booking_id)
+
+def parse_fields(fields_param: Optional[str]) -> Optional[List[str]]:
+    """Разбирает проекцию `fields=` по белому списку колонок"""
+    if not fields_param:
+        return None
+    fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in BOOKING_COLUMNS and f not in FLEET_JOIN_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # id и created_at нужны для курсора следующей страницы
+    for required in ('created_at', 'id'):
+        if required not in fields:
+            fields.insert(0, required)
+    return fields
+
+def build_select_list(fields: Optional[List[str]]) -> str:
+    """Список колонок SELECT с учётом проекции"""
+    if fields is None:
+        return "b.*, " + ", ".join(f"{expr} as {alias}" for alias, expr in FLEET_JOIN_FIELDS.items())
+    return ", ".join(
+        f"{FLEET_JOIN_FIELDS[f]} as {f}" if f in FLEET_JOIN_FIELDS else f"b.{f}"
+        for f in fields
+    )
+
+# Горячие запросы броней, подготовленные на соединении (см. PreparedStatement)
+BOOKING_BY_ID = PreparedStatement('booking_by_id', "SELECT b.* FROM bookings b WHERE b.id = %(id)s")
+FLEET_ROW_LOCK = PreparedStatement('fleet_row_lock', "SELECT id FROM fleet WHERE id = %(id)s FOR UPDATE")
+FLEET_CACHE_LOAD = PreparedStatement(
+    'fleet_cache_load', f"SELECT {FLEET_CACHE_COLUMNS} FROM fleet ORDER BY model, license_plate"
+)
+BOOKING_CONFLICTS = PreparedStatement('booking_conflicts', f"""
+    SELECT id, client_name, start_date, end_date, status
+    FROM bookings
+    WHERE vehicle_id = %(vehicle_id)s
+      AND tsrange(start_date, end_date, '[)') && tsrange(%(start_date)s, %(end_date)s, '[)')
+      AND status NOT IN ({', '.join(f"'{status}'" for status in NON_BLOCKING_STATUSES)})
+      AND (%(exclude_id)s::integer IS NULL OR id <> %(exclude_id)s)
+    ORDER BY start_date
+""")
+# Пересечения строк импорта с броньми в базе одним запросом; бронь с тем же external_id
+# (её обновляет сама строка) пересечением не считается
+IMPORT_CONFLICTS = PreparedStatement('import_conflicts', f"""
+    SELECT r.idx, b.id, b.client_name, b.start_date, b.end_date, b.status
+    FROM unnest(%(idx)s::integer[], %(vehicle_id)s::integer[], %(start_date)s::timestamp[],
+                %(end_date)s::timestamp[], %(external_id)s::varchar[])
+         AS r(idx, vehicle_id, start_date, end_date, external_id)
+    JOIN bookings b ON b.vehicle_id = r.vehicle_id
+     AND tsrange(b.start_date, b.end_date, '[)') && tsrange(r.start_date, r.end_date, '[)')
+     AND b.status NOT IN ({', '.join(f"'{status}'" for status in NON_BLOCKING_STATUSES)})
+     AND (r.external_id IS NULL OR b.external_id IS DISTINCT FROM r.external_id)
+    ORDER BY r.idx, b.start_date
+""")
+BOOKING_CREATE = PreparedStatement('booking_create', f"""
+    WITH b AS (
+        INSERT INTO bookings ({BOOKING_INSERT_COLUMNS}) VALUES {BOOKING_CREATE_TEMPLATE}
+        RETURNING *
+    ), o AS (
+        INSERT INTO booking_outbox (booking_id, event) SELECT id, 'created' FROM b
+    )
+    SELECT {build_select_list(None)}
+    FROM b
+    LEFT JOIN fleet f ON b.vehicle_id = f.id
+""")
+
+def build_bookings_filter(params: dict) -> tuple:
+    """Построение WHERE для списка броней по параметрам запроса"""
     status = params.get('status')
     vehicle_id = params.get('vehicle_id')
     date_from = params.get('date_from')
     date_to = params.get('date_to')
     
+    # Отсекаем старые брони с мусорными датами (см. V0018) условием, которое использует индексы
+    where = """
+        WHERE b.end_date < %s
+    """
+    query_params: List[Any] = [MAX_VALID_DATE]
+    
+    if status:
+        where += " AND b.status = %s"
+        query_params.append(status)
+    
+    if vehicle_id:
+        where += " AND b.vehicle_id = %s"
+        query_params.append(int(vehicle_id))
+    
+    # Пересечение периода брони с [date_from, date_to] через GiST-индекс idx_bookings_period:
+    # пара условий end_date >= X AND start_date <= Y по B-tree отсекает лишь половину таблицы
+    # Перевёрнутый период tsrange не принимает, поэтому он отсекается заранее (ValueError -> 400)
+    period = [datetime.fromisoformat(value) for value in (date_from, date_to) if value]
+    if date_from and date_to and period[1] < period[0]:
+        raise ValueError('date_to must not be earlier than date_from')
+    if date_from or date_to:
+        where += " AND tsrange(b.start_date, b.end_date, '[)') && tsrange(%s, %s, '[]')"
+        query_params.extend([date_from or None, date_to or None])
+    
+    return where, query_params
+
+# Колонка версии для синхронизации и ETag, если это не updated_at (см. clients)
+VERSION_COLUMNS: Dict[str, str] = {}
+
+# Инкрементальная синхронизация: максимум строк за вызов и запас на ещё не закоммиченные транзакции
+SYNC_MAX_ROWS = 5000
+SYNC_SAFETY_MARGIN_SECONDS = 5
+
+def parse_since(params: dict) -> tuple:
+    """Разбирает since (ISO-время) и after_id из параметров синхронизации.
+    Смещение часового пояса (Z, +03:00) отбрасывается: updated_at хранится в TIMESTAMP без зоны"""
+    return datetime.fromisoformat(params['since']).replace(tzinfo=None), int(params.get('after_id') or 0)
+
+def fetch_changes(cursor, table: str, select_sql: str, since: datetime, after_id: int) -> dict:
+    """Строки таблицы (алиас t), изменённые после (since, after_id), и id удалённых записей"""
+    column = VERSION_COLUMNS.get(table, 'updated_at')
+    cursor.execute(
+        "SELECT LOCALTIMESTAMP - %s * INTERVAL '1 second' AS sync_point",
+        (SYNC_SAFETY_MARGIN_SECONDS,)
+    )
+    sync_point = cursor.fetchone()['sync_point']
+    
+    cursor.execute(f"""
+        {select_sql}
+        WHERE (t.{column}, t.id) > (%s, %s)
+        ORDER BY t.{column}, t.id
+        LIMIT %s
+    """, (since, after_id, SYNC_MAX_ROWS + 1))
+    rows = cursor.fetchall()
+    
+    has_more = len(rows) > SYNC_MAX_ROWS
+    rows = rows[:SYNC_MAX_ROWS]
+    if has_more:
+        next_since, next_after_id = rows[-1][column], rows[-1]['id']
+    else:
+        next_since, next_after_id = max(sync_point, since), 0
+    
+    cursor.execute(
+        "SELECT record_id FROM deleted_records WHERE table_name = %s AND deleted_at > %s ORDER BY deleted_at",
+        (table, since)
+    )
+    
+    return {
+        'rows': rows,
+        'deleted': [row['record_id'] for row in cursor.fetchall()],
+        'next_since': next_since.isoformat(),
+        'next_after_id': next_after_id,
+        'has_more': has_more
+    }
+
+def get_booking_changes(conn, event: dict) -> dict:
+    """Брони, изменённые с момента since (включая отменённые), и удалённые id"""
+    params = event.get('queryStringParameters', {}) or {}
+    try:
+        since, after_id = parse_since(params)
+    except (ValueError, TypeError) as e:
+        return error_response(400, f'Invalid since: {e}')
+    
+    changes = fetch_changes(conn.cursor(), 'bookings', """
+        SELECT t.*,
+               f.model as vehicle_model_full,
+               f.license_plate as vehicle_plate_full
+        FROM bookings t
+        LEFT JOIN fleet f ON t.vehicle_id = f.id
+    """, since, after_id)
+    
+    bookings = changes.pop('rows')
+    return success_response({
+        'bookings': bookings,
+        'cancelled': [b['id'] for b in bookings if b['status'] == 'Отменено'],
+        **changes
+    })
+
+def get_bookings(conn, event: dict) -> dict:
+    """Получить список бронирований с фильтрацией и постраничной выдачей"""
+    print("Fetching bookings...")
+    params = event.get('queryStringParameters', {}) or {}
+    booking_id = params.get('id')
+    
     cursor = conn.cursor()
+    include_client = 'client' in (params.get('include') or '').split(',')
+    
+    # Если брони и автопарк (и клиенты для include=client) не менялись, клиенту достаточно 304.
+    # Версия автопарка читается отдельно: по ней же сверяется кэш, из которого берутся модель и номер
+    tables = ['bookings', 'clients'] if include_client else ['bookings']
+    fleet_token = get_version_token(cursor, ['fleet'])
+    etag = make_etag(get_version_token(cursor, tables), fleet_token,
+                     [(key, params.get(key)) for key in BOOKING_ETAG_PARAMS])
+    if is_not_modified(event, etag):
+        return not_modified_response(etag)
     
     # Если запрашивается конкретная бронь
     if booking_id:
-        cursor.execute("""
-            SELECT b.*, 
-                   f.model as vehicle_model_full,
-                   f.license_plate as vehicle_plate_full
-            FROM bookings b
-            LEFT JOIN fleet f ON b.vehicle_id = f.id
-            WHERE b.id = %s
-        """, (booking_id,))
+        BOOKING_BY_ID.execute(cursor, {'id': booking_id})
         booking = cursor.fetchone()
         
         if not booking:
             return error_response(404, 'Booking not found')
         
-        return success_response({'booking': dict(booking)})
+        attach_fleet_fields(cursor, [booking], list(FLEET_JOIN_FIELDS), fleet_token)
+        return success_response({'booking': booking}, etag=etag)
     
-    # Построение динамического запроса с фильтрами
-    query = """
-        SELECT b.*,
-               f.model as vehicle_model_full,
-               f.license_plate as vehicle_plate_full
-        FROM bookings b
-        LEFT JOIN fleet f ON b.vehicle_id = f.id
-        WHERE 1=1
-        AND EXTRACT(YEAR FROM b.start_date) < 2100
-        AND EXTRACT(YEAR FROM b.end_date) < 2100
-    """
-    query_params = []
+    try:
+        fields = parse_fields(params.get('fields'))
+        limit = int(params['limit']) if params.get('limit') else None
+        after = decode_cursor(params['after']) if params.get('after') else None
+    except (ValueError, TypeError) as e:
+        return error_response(400, f'Invalid pagination parameters: {e}')
     
-    if status:
-        query += " AND b.status = %s"
-        query_params.append(status)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
     
-    if vehicle_id:
-        query += " AND b.vehicle_id = %s"
-        query_params.append(int(vehicle_id))
+    # Поля автомобиля подставляются из кэша автопарка вместо JOIN с fleet;
+    # без fields= отдаётся облегчённая бронь без паспортных данных клиента (BOOKING_LIST_FIELDS)
+    fleet_fields = list(FLEET_JOIN_FIELDS) if fields is None else [f for f in fields if f in FLEET_JOIN_FIELDS]
+    booking_fields = list(BOOKING_LIST_FIELDS) if fields is None else [f for f in fields if f not in FLEET_JOIN_FIELDS]
+    drop_vehicle_id = bool(fleet_fields) and 'vehicle_id' not in booking_fields
+    if drop_vehicle_id:
+        booking_fields.append('vehicle_id')
+    
+    try:
+        where, query_params = build_bookings_filter(params)
+    except ValueError as e:
+        return error_response(400, f'Invalid filter: {e}')
     
-    if date_from:
-        query += " AND b.end_date >= %s"
-        query_params.append(date_from)
+    total_count = None
+    count_mode = params.get('count')
+    if count_mode == 'estimate':
+        cursor.execute("SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = 'bookings'::regclass")
+        total_count = max(int(cursor.fetchone()['estimate']), 0)
+    elif count_mode in ('true', 'exact'):
+        cursor.execute(f"SELECT COUNT(*) AS total FROM bookings b {where}", query_params)
+        total_count = cursor.fetchone()['total']
     
-    if date_to:
-        query += " AND b.start_date <= %s"
-        query_params.append(date_to)
+    page_where = where
+    page_params = list(query_params)
+    if after:
+        page_where += " AND (b.created_at, b.id) < (%s, %s)"
+        page_params.extend(after)
     
-    query += " ORDER BY b.created_at DESC"
+    select_list = build_select_list(booking_fields)
+    from_clause = "bookings b"
+    if include_client:
+        select_list += ", " + CLIENT_INCLUDE_SELECT
+        from_clause += " LEFT JOIN clients c ON c.id = b.client_id"
+    query = f"SELECT {select_list} FROM {from_clause}" + page_where + " ORDER BY b.created_at DESC, b.id DESC"
     
-    cursor.execute(query, query_params)
+    if limit is not None:
+        # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+        query += " LIMIT %s"
+        page_params.append(limit + 1)
+    
+    cursor.execute(query, page_params)
     bookings = cursor.fetchall()
     
+    next_cursor = None
+    if limit is not None and len(bookings) > limit:
+        bookings = bookings[:limit]
+        last = bookings[-1]
+        next_cursor = encode_cursor(last['created_at'], last['id'])
+    
+    if fleet_fields:
+        attach_fleet_fields(cursor, bookings, fleet_fields, fleet_token)
+        if drop_vehicle_id:
+            for booking in bookings:
+                del booking['vehicle_id']
+    
+    result = {
+        'bookings': bookings,
+        'total': len(bookings),
+        'next_cursor': next_cursor
+    }
+    if total_count is not None:
+        result['total_count'] = total_count
+    
+    return success_response(result, etag=etag)
+
+def attach_fleet_fields(cursor, bookings: list, fleet_fields: List[str], fleet_token: Optional[str] = None) -> None:
+    """Дописывает в брони поля автомобиля (vehicle_model_full, vehicle_plate_full) из кэша автопарка"""
+    vehicles = get_fleet(cursor, fleet_token)['by_id']
+    for booking in bookings:
+        vehicle = vehicles.get(booking['vehicle_id'])
+        for field in fleet_fields:
+            booking[field] = vehicle[FLEET_CACHE_FIELDS[field]] if vehicle else None
+
+def stream_rows(conn, query: str, query_params: list):
+    """Серверный курсор: строки читаются порциями, первой выдаётся шапка колонок"""
+    with conn.cursor(name=f'{FUNCTION_NAME}_export', cursor_factory=TimedTupleCursor) as cursor:
+        cursor.itersize = EXPORT_CHUNK_SIZE
+        cursor.execute(query, query_params)
+        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+        yield [column.name for column in cursor.description]
+        while rows:
+            yield from rows
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+
+def encode_csv(rows) -> Iterator[str]:
+    """Кодирует поток строк в CSV блоками"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(rows))
+    for row in rows:
+        writer.writerow([
+            json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+            for value in row
+        ])
+        if buffer.tell() >= EXPORT_BLOCK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def encode_ndjson(rows) -> Iterator[str]:
+    """Кодирует поток строк в NDJSON (одна запись на строку)"""
+    columns = next(rows)
+    for row in rows:
+        yield dumps(dict(zip(columns, row))) + '\n'
+
+def export_response(chunks: Iterator[str], export_format: str, compress: bool, filename: str) -> dict:
+    """Собирает выгрузку из потока блоков, при необходимости сжимая на лету"""
+    headers = {
+        'Content-Type': 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="{filename}.{export_format}"',
+        'Access-Control-Allow-Origin': '*'
+    }
+    if compress:
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as gz:
+            for chunk in chunks:
+                gz.write(chunk.encode('utf-8'))
+        headers['Content-Encoding'] = 'gzip'
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': base64.b64encode(buffer.getvalue()).decode('ascii'),
+            'isBase64Encoded': True
+        }
+    
+    body = io.StringIO()
+    for chunk in chunks:
+        body.write(chunk)
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body.getvalue(),
+        'isBase64Encoded': False
+    }
+
+def export_bookings(conn, event: dict) -> dict:
+    """Выгрузка броней в CSV/NDJSON без материализации всего списка"""
+    params = event.get('queryStringParameters', {}) or {}
+    export_format = params.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return error_response(400, 'format must be csv or ndjson')
+    
+    try:
+        fields = parse_fields(params.get('fields'))
+    except ValueError as e:
+        return error_response(400, str(e))
+    
+    try:
+        where, query_params = build_bookings_filter(params)
+    except ValueError as e:
+        return error_response(400, f'Invalid filter: {e}')
+    query = f"SELECT {build_select_list(fields)} FROM bookings b"
+    if fields is None or any(f in FLEET_JOIN_FIELDS for f in fields):
+        query += " LEFT JOIN fleet f ON b.vehicle_id = f.id"
+    query += where + " ORDER BY b.created_at DESC, b.id DESC"
+    
+    rows = stream_rows(conn, query, query_params)
+    chunks = encode_csv(rows) if export_format == 'csv' else encode_ndjson(rows)
+    return export_response(chunks, export_format, params.get('gzip') in ('1', 'true'), 'bookings')
+
+def find_conflicts(cursor, vehicle_id, start_date, end_date, exclude_id=None) -> List[dict]:
+    """Найти брони автомобиля, пересекающиеся с периодом (через GiST-индекс idx_bookings_period)"""
+    BOOKING_CONFLICTS.execute(cursor, {
+        'vehicle_id': vehicle_id,
+        'start_date': start_date,
+        'end_date': end_date,
+        'exclude_id': exclude_id
+    })
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_availability(conn, event: dict) -> dict:
+    """Свободные и занятые автомобили автопарка за период одним запросом"""
+    params = event.get('queryStringParameters', {}) or {}
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    
+    if not date_from or not date_to:
+        return error_response(400, 'date_from and date_to are required')
+    try:
+        if datetime.fromisoformat(date_to) < datetime.fromisoformat(date_from):
+            return error_response(400, 'date_to must not be earlier than date_from')
+    except ValueError as e:
+        return error_response(400, f'Invalid date range: {e}')
+    
+    query = """
+        SELECT f.id, f.model, f.license_plate, f.status,
+               COALESCE(
+                   json_agg(json_build_object(
+                       'id', b.id,
+                       'start_date', b.start_date,
+                       'end_date', b.end_date,
+                       'status', b.status
+                   ) ORDER BY b.start_date) FILTER (WHERE b.id IS NOT NULL),
+                   '[]'::json
+               ) AS busy
+        FROM fleet f
+        LEFT JOIN bookings b ON b.vehicle_id = f.id
+             AND tsrange(b.start_date, b.end_date, '[)') && tsrange(%s, %s, '[]')
+             AND b.status NOT IN %s
+        WHERE f.is_active = true
+    """
+    query_params = [date_from, date_to, NON_BLOCKING_STATUSES]
+    
+    if params.get('vehicle_id'):
+        query += " AND f.id = %s"
+        query_params.append(int(params['vehicle_id']))
+    
+    query += " GROUP BY f.id ORDER BY f.model, f.license_plate"
+    
+    cursor = conn.cursor()
+    cursor.execute(query, query_params)
+    
+    vehicles = []
+    for row in cursor.fetchall():
+        vehicle = dict(row)
+        vehicle['is_free'] = not vehicle['busy']
+        vehicles.append(vehicle)
+    
     return success_response({
-        'bookings': [dict(b) for b in bookings],
-        'total': len(bookings)
+        'vehicles': vehicles,
+        'free_vehicle_ids': [v['id'] for v in vehicles if v['is_free']],
+        'total': len(vehicles)
     })
 
+def get_finance_summary(conn, event: dict) -> dict:
+    """Выручка, оплаты, долг и расходы по дням, месяцам, автомобилям или менеджерам из агрегатов V0023"""
+    params = event.get('queryStringParameters', {}) or {}
+    group = params.get('group', 'month')
+    if group not in FINANCE_GROUPS:
+        return error_response(400, f"group must be one of: {', '.join(FINANCE_GROUPS)}")
+    group_expr, label_expr = FINANCE_GROUPS[group]
+    
+    where = "WHERE true"
+    query_params: List[Any] = []
+    if params.get('date_from'):
+        where += " AND fd.day >= %s"
+        query_params.append(params['date_from'])
+    if params.get('date_to'):
+        where += " AND fd.day <= %s"
+        query_params.append(params['date_to'])
+    if params.get('vehicle_id'):
+        where += " AND fd.vehicle_id = %s"
+        query_params.append(int(params['vehicle_id']))
+    if params.get('manager'):
+        where += " AND fd.manager = %s"
+        query_params.append(params['manager'])
+    
+    # Временной ряд без фильтров по автомобилю и менеджеру читается из итогов дня - строка на день
+    source = "finance_daily fd"
+    if group in ('day', 'month') and not params.get('vehicle_id') and not params.get('manager'):
+        source = "finance_daily_totals fd"
+    
+    vehicle_columns = ", f.model, f.license_plate" if group == 'vehicle' else ""
+    vehicle_join = "LEFT JOIN fleet f ON f.id = s.key" if group == 'vehicle' else ""
+    
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        WITH s AS (
+            SELECT {group_expr} AS key, MIN({label_expr}) AS period,
+                   SUM(fd.bookings_count)::int AS bookings_count,
+                   SUM(fd.revenue)::float8 AS revenue,
+                   SUM(fd.paid)::float8 AS paid,
+                   SUM(fd.revenue - fd.paid)::float8 AS debt,
+                   SUM(fd.expense)::float8 AS expense,
+                   SUM(fd.paid - fd.expense)::float8 AS profit
+            FROM {source}
+            {where}
+            GROUP BY {group_expr}
+        )
+        SELECT s.period AS {group}{vehicle_columns}, s.bookings_count, s.revenue, s.paid, s.debt, s.expense, s.profit
+        FROM s
+        {vehicle_join}
+        ORDER BY s.key
+    """, query_params)
+    rows = cursor.fetchall()
+    
+    totals = {
+        key: sum(row[key] for row in rows)
+        for key in ('bookings_count', 'revenue', 'paid', 'debt', 'expense', 'profit')
+    }
+    return success_response({'group': group, 'rows': rows, 'totals': totals})
+
+def get_cached_dashboard_summary() -> Optional[dict]:
+    with _dashboard_cache_lock:
+        cache = _dashboard_cache
+    if cache['summary'] is not None and time.monotonic() - cache['loaded_at'] < DASHBOARD_CACHE_TTL:
+        return cache['summary']
+    return None
+
+def load_dashboard_summary(conn) -> dict:
+    """Счётчики дашборда: брони сегодня, автопарк, долги; результат кладётся в кэш инстанса"""
+    global _dashboard_cache
+    cursor = conn.cursor()
+    DASHBOARD_SUMMARY.execute(cursor)
+    row = cursor.fetchone()
+    summary = {section: {key: row[key] for key in keys} for section, keys in DASHBOARD_SECTIONS.items()}
+    summary['generated_at'] = datetime.now().isoformat()
+    summary['ttl'] = DASHBOARD_CACHE_TTL
+    with _dashboard_cache_lock:
+        _dashboard_cache = {'summary': summary, 'loaded_at': time.monotonic()}
+    return summary
+
 def create_booking(conn, event: dict) -> dict:
     """Создать новое бронирование"""
     try:
@@ -129,153 +1183,249 @@ def create_booking(conn, event: dict) -> dict:
         return error_response(400, 'Invalid JSON')
     
     # Обязательные поля
-    required = ['client_name', 'client_phone', 'start_date', 'end_date']
-    for field in required:
+    for field in BOOKING_REQUIRED_FIELDS:
         if field not in data:
             return error_response(400, f'Missing required field: {field}')
     
     cursor = conn.cursor()
     
-    # Очистка старых черновиков этого клиента (более 1 часа)
-    if data.get('status') == 'Черновик':
-        cursor.execute("""
-            DELETE FROM bookings 
-            WHERE client_phone = %s 
-            AND status = 'Черновик' 
-            AND created_at < NOW() - INTERVAL '1 hour'
-        """, (data['client_phone'],))
+    # Блокировка строки автомобиля сериализует параллельные брони одной машины.
+    # Проверка пересечений идёт отдельным запросом: снимок одного оператора сделан до ожидания блокировки
+    # и не увидел бы брони, закоммиченные конкурентом за это время
+    if data.get('vehicle_id') and data.get('status', 'Бронь') not in NON_BLOCKING_STATUSES and not data.get('allow_overlap'):
+        FLEET_ROW_LOCK.execute(cursor, {'id': data['vehicle_id']})
+        conflicts = find_conflicts(cursor, data['vehicle_id'], data['start_date'], data['end_date'])
+        if conflicts:
+            conn.rollback()
+            return error_response(409, 'Vehicle is already booked for these dates', {'conflicts': conflicts})
+    
+    # Вставка и выборка с данными автомобиля за один запрос
+    BOOKING_CREATE.execute(cursor, booking_create_values(data))
+    booking = cursor.fetchone()
+    conn.commit()
+    
+    return success_response({
+        'booking': booking,
+        'message': 'Booking created successfully'
+    }, status_code=201)
+
+def booking_create_values(data: dict) -> dict:
+    """Именованные значения для BOOKING_CREATE_TEMPLATE"""
+    return dict(zip(
+        (field for field, _ in BOOKING_INSERT_FIELDS),
+        booking_insert_values(data, data.get('vehicle_model'), data.get('vehicle_license_plate'))
+    ))
+
+def booking_insert_values(data: dict, vehicle_model=None, vehicle_plate=None) -> tuple:
+    """Значения для INSERT брони в порядке BOOKING_INSERT_FIELDS"""
+    overrides = {'vehicle_model': vehicle_model, 'vehicle_license_plate': vehicle_plate}
+    values = []
+    for field, default in BOOKING_INSERT_FIELDS:
+        if field in overrides:
+            value = overrides[field]
+        else:
+            value = data.get(field, default)
+        if field in BOOKING_JSON_FIELDS:
+            value = json.dumps(value)
+        values.append(value)
+    return tuple(values)
+
+def parse_import_body(event: dict) -> List[Any]:
+    """Разбирает тело импорта: JSON-массив, {"bookings": [...]} или NDJSON"""
+    body = event.get('body') or ''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if 'ndjson' in headers.get('content-type', ''):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    data = json.loads(body or '[]')
+    if isinstance(data, dict):
+        data = data.get('bookings', [])
+    if not isinstance(data, list):
+        raise ValueError('Expected an array of bookings')
+    return data
+
+def parse_import_date(value) -> datetime:
+    """Дата строки импорта; смещение часового пояса отбрасывается, как при записи в TIMESTAMP"""
+    if not isinstance(value, str):
+        raise ValueError(f'expected ISO date string, got {value!r}')
+    return datetime.fromisoformat(value).replace(tzinfo=None)
+
+def validate_import_row(row) -> Optional[str]:
+    """Проверки строки импорта до записи; ошибка - текст для результата строки"""
+    if not isinstance(row, dict):
+        return 'Row must be an object'
+    missing = [field for field in BOOKING_REQUIRED_FIELDS if not row.get(field)]
+    if missing:
+        return f"Missing required field: {', '.join(missing)}"
+    if row.get('id'):
+        return 'id is not accepted, use external_id to update imported bookings'
+    try:
+        start_date = parse_import_date(row['start_date'])
+        end_date = parse_import_date(row['end_date'])
+    except ValueError as e:
+        return f'Invalid date: {e}'
+    if end_date < start_date:
+        return 'end_date must not be earlier than start_date'
+    if end_date >= datetime.fromisoformat(MAX_VALID_DATE):
+        return f'end_date must be before {MAX_VALID_DATE}'
+    if row.get('vehicle_id') is not None and not isinstance(row['vehicle_id'], int):
+        return 'vehicle_id must be an integer'
+    return None
+
+def find_import_conflicts(cursor, rows: list) -> Dict[int, List[dict]]:
+    """Пересечения блокирующих строк импорта с базой и друг с другом: индекс строки -> брони"""
+    candidates = [
+        (i, row) for i, row in rows
+        if row.get('vehicle_id') and row.get('status', 'Бронь') not in NON_BLOCKING_STATUSES
+        and not row.get('allow_overlap')
+    ]
+    conflicts: Dict[int, List[dict]] = {}
+    if not candidates:
+        return conflicts
+    
+    periods = {i: (parse_import_date(row['start_date']), parse_import_date(row['end_date'])) for i, row in candidates}
+    IMPORT_CONFLICTS.execute(cursor, {
+        'idx': [i for i, _ in candidates],
+        'vehicle_id': [row['vehicle_id'] for _, row in candidates],
+        'start_date': [periods[i][0] for i, _ in candidates],
+        'end_date': [periods[i][1] for i, _ in candidates],
+        'external_id': [row.get('external_id') for _, row in candidates]
+    })
+    for conflict in cursor.fetchall():
+        conflict = dict(conflict)
+        conflicts.setdefault(conflict.pop('idx'), []).append(conflict)
+    
+    # Внутри пачки строка уступает более ранней строке того же автомобиля
+    accepted: Dict[int, List[int]] = {}
+    for i, row in candidates:
+        if i in conflicts:
+            continue
+        start_date, end_date = periods[i]
+        earlier = [j for j in accepted.get(row['vehicle_id'], [])
+                   if periods[j][0] < end_date and start_date < periods[j][1]]
+        if earlier:
+            conflicts[i] = [{'index': j, 'start_date': periods[j][0], 'end_date': periods[j][1]} for j in earlier]
+            continue
+        accepted.setdefault(row['vehicle_id'], []).append(i)
+    return conflicts
+
+def write_import_rows(cursor, query: str, template: str, batch: list, results: list, status_of) -> None:
+    """Пишет строки страницами под savepoint; страница с ошибкой повторяется построчно,
+    чтобы ошибка базы досталась своей строке, а остальные строки сохранились"""
+    for start in range(0, len(batch), IMPORT_PAGE_SIZE):
+        page = batch[start:start + IMPORT_PAGE_SIZE]
+        cursor.execute("SAVEPOINT import_page")
+        try:
+            returned = execute_values(cursor, query, [values for _, values in page],
+                                      template=template, page_size=len(page), fetch=True)
+            cursor.execute("RELEASE SAVEPOINT import_page")
+            for (i, _), ret in zip(page, returned):
+                results[i].update(status=status_of(ret), id=ret['id'])
+            continue
+        except psycopg2.Error:
+            cursor.execute("ROLLBACK TO SAVEPOINT import_page")
+            cursor.execute("RELEASE SAVEPOINT import_page")
+        
+        for i, values in page:
+            cursor.execute("SAVEPOINT import_row")
+            try:
+                ret = execute_values(cursor, query, [values], template=template, fetch=True)[0]
+                cursor.execute("RELEASE SAVEPOINT import_row")
+                results[i].update(status=status_of(ret), id=ret['id'])
+            except psycopg2.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT import_row")
+                cursor.execute("RELEASE SAVEPOINT import_row")
+                results[i].update(status='error', error=e.diag.message_primary or str(e).strip())
+
+def import_bookings(conn, event: dict) -> dict:
+    """Пакетный импорт броней.
+    
+    Строки с external_id обновляются целиком по этому ключу (upsert), остальные вставляются.
+    Ошибочные и пересекающиеся строки пропускаются, остальные сохраняются одной транзакцией.
+    Результат возвращается по каждой строке в порядке входа.
+    """
+    try:
+        rows = parse_import_body(event)
+    except ValueError as e:
+        return error_response(400, f'Invalid import body: {e}')
+    
+    if len(rows) > IMPORT_MAX_ROWS:
+        return error_response(413, f'Too many rows, maximum is {IMPORT_MAX_ROWS}')
+    
+    results: List[Dict[str, Any]] = [{'index': i} for i in range(len(rows))]
+    valid = []
+    for i, row in enumerate(rows):
+        error = validate_import_row(row)
+        if error:
+            results[i].update(status='error', error=error)
+            continue
+        valid.append((i, row))
     
-    # Получение данных об автомобиле если указан vehicle_id
-    vehicle_model = data.get('vehicle_model')
-    vehicle_plate = data.get('vehicle_license_plate')
+    cursor = conn.cursor()
     
-    if data.get('vehicle_id'):
+    # Все автомобили пачки одним запросом; блокировка строк, как в create_booking,
+    # сериализует импорт с параллельными бронями тех же машин
+    vehicle_ids = sorted({row['vehicle_id'] for _, row in valid if row.get('vehicle_id')})
+    vehicles = {}
+    if vehicle_ids:
         cursor.execute(
-            "SELECT model, license_plate FROM fleet WHERE id = %s",
-            (data['vehicle_id'],)
+            "SELECT id, model, license_plate FROM fleet WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+            (vehicle_ids,)
         )
-        vehicle = cursor.fetchone()
-        if vehicle:
-            vehicle_model = vehicle['model']
-            vehicle_plate = vehicle['license_plate']
+        vehicles = {v['id']: v for v in cursor.fetchall()}
     
-    # Вставка брони с расширенными полями
-    cursor.execute("""
-        INSERT INTO bookings (
-            client_name, client_phone, client_email, client_birth_date,
-            client_passport_series, client_passport_number, client_passport_issued_by, 
-            client_passport_issued_date, client_passport_registration,
-            client_driver_license_series, client_driver_license_number,
-            client_driver_license_issued_date, client_driver_license_issued_by,
-            client_is_foreign,
-            vehicle_id, vehicle_model, vehicle_license_plate,
-            start_date, end_date, days, 
-            pickup_location, dropoff_location,
-            route_type, is_international, planned_km_total,
-            status, booking_type, total_price, paid_amount, deposit_amount,
-            deposit_status, deposit_hold_method,
-            services, rental_days, rental_km, rental_price_per_day, rental_price_per_km,
-            has_child_seat, child_seat_count, has_gps, has_winter_tires, 
-            has_roof_rack, has_additional_driver, additional_driver_name,
-            insurance_type, insurance_cost, fuel_policy,
-            communication_channel, source,
-            notes, custom_fields, payments, internal_notes,
-            created_by, assigned_manager
-        ) VALUES (
-            %s, %s, %s, %s,
-            %s, %s, %s, %s, %s,
-            %s, %s, %s, %s,
-            %s,
-            %s, %s, %s,
-            %s, %s, %s,
-            %s, %s,
-            %s, %s, %s,
-            %s, %s, %s, %s, %s,
-            %s, %s,
-            %s::jsonb, %s, %s, %s, %s,
-            %s, %s, %s, %s,
-            %s, %s, %s,
-            %s, %s, %s,
-            %s, %s,
-            %s, %s::jsonb, %s::jsonb, %s,
-            %s, %s
-        ) RETURNING id
-    """, (
-        data['client_name'],
-        data['client_phone'],
-        data.get('client_email'),
-        data.get('client_birth_date'),
-        data.get('client_passport_series'),
-        data.get('client_passport_number'),
-        data.get('client_passport_issued_by'),
-        data.get('client_passport_issued_date'),
-        data.get('client_passport_registration'),
-        data.get('client_driver_license_series'),
-        data.get('client_driver_license_number'),
-        data.get('client_driver_license_issued_date'),
-        data.get('client_driver_license_issued_by'),
-        data.get('client_is_foreign', False),
-        data.get('vehicle_id'),
-        vehicle_model,
-        vehicle_plate,
-        data['start_date'],
-        data['end_date'],
-        data.get('days', 1),
-        data.get('pickup_location'),
-        data.get('dropoff_location'),
-        data.get('route_type'),
-        data.get('is_international', False),
-        data.get('planned_km_total'),
-        data.get('status', 'Бронь'),
-        data.get('booking_type', 'rent'),
-        data.get('total_price', 0),
-        data.get('paid_amount', 0),
-        data.get('deposit_amount', 0),
-        data.get('deposit_status', 'pending'),
-        data.get('deposit_hold_method'),
-        json.dumps(data.get('services', [])),
-        data.get('rental_days'),
-        data.get('rental_km'),
-        data.get('rental_price_per_day'),
-        data.get('rental_price_per_km'),
-        data.get('has_child_seat', False),
-        data.get('child_seat_count', 0),
-        data.get('has_gps', False),
-        data.get('has_winter_tires', False),
-        data.get('has_roof_rack', False),
-        data.get('has_additional_driver', False),
-        data.get('additional_driver_name'),
-        data.get('insurance_type'),
-        data.get('insurance_cost', 0),
-        data.get('fuel_policy', 'full-to-full'),
-        data.get('communication_channel'),
-        data.get('source'),
-        data.get('notes'),
-        json.dumps(data.get('custom_fields', [])),
-        json.dumps(data.get('payments', [])),
-        data.get('internal_notes'),
-        data.get('created_by'),
-        data.get('assigned_manager')
-    ))
+    conflicts = find_import_conflicts(cursor, valid)
+    for i, rows_in_conflict in conflicts.items():
+        results[i].update(status='error', error='Vehicle is already booked for these dates',
+                          conflicts=rows_in_conflict)
+    valid = [(i, row) for i, row in valid if i not in conflicts]
     
-    booking_id = cursor.fetchone()['id']
-    conn.commit()
+    def values_for(row: dict) -> tuple:
+        vehicle = vehicles.get(row.get('vehicle_id'))
+        if vehicle:
+            return booking_insert_values(row, vehicle['model'], vehicle['license_plate'])
+        return booking_insert_values(row, row.get('vehicle_model'), row.get('vehicle_license_plate'))
     
-    # Получаем полную информацию о созданной брони
-    cursor.execute("""
-        SELECT b.*, 
-               f.model as vehicle_model_full,
-               f.license_plate as vehicle_plate_full
-        FROM bookings b
-        LEFT JOIN fleet f ON b.vehicle_id = f.id
-        WHERE b.id = %s
-    """, (booking_id,))
-    booking = cursor.fetchone()
+    inserts = [(i, values_for(row)) for i, row in valid if not row.get('external_id')]
+    upserts = [(i, (str(row['external_id']),) + values_for(row)) for i, row in valid if row.get('external_id')]
+    
+    try:
+        if inserts:
+            write_import_rows(
+                cursor,
+                f"INSERT INTO bookings ({BOOKING_INSERT_COLUMNS}) VALUES %s RETURNING id",
+                BOOKING_INSERT_TEMPLATE, inserts, results, lambda ret: 'created'
+            )
+        
+        if upserts:
+            update_set = ', '.join(f"{field} = EXCLUDED.{field}" for field, _ in BOOKING_INSERT_FIELDS)
+            write_import_rows(
+                cursor,
+                f"""INSERT INTO bookings (external_id, {BOOKING_INSERT_COLUMNS}) VALUES %s
+                    ON CONFLICT (external_id) WHERE external_id IS NOT NULL
+                    DO UPDATE SET {update_set}, updated_at = CURRENT_TIMESTAMP
+                    RETURNING id, (xmax = 0) AS inserted""",
+                '(%s, ' + BOOKING_INSERT_TEMPLATE[1:], upserts, results,
+                lambda ret: 'created' if ret['inserted'] else 'updated'
+            )
+        
+        imported = [r for r in results if r.get('status') in ('created', 'updated')]
+        if imported:
+            cursor.execute(
+                "INSERT INTO booking_outbox (booking_id, event) SELECT * FROM unnest(%s::integer[], %s::varchar[])",
+                ([r['id'] for r in imported], [r['status'] for r in imported])
+            )
+        
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        return error_response(400, f'Import failed, nothing was saved: {e}')
     
     return success_response({
-        'booking': dict(booking) if booking else {'id': booking_id},
-        'message': 'Booking created successfully'
-    }, status_code=201)
+        'results': results,
+        'created': sum(1 for r in results if r.get('status') == 'created'),
+        'updated': sum(1 for r in results if r.get('status') == 'updated'),
+        'failed': sum(1 for r in results if r.get('status') == 'error')
+    })
 
 def update_booking(conn, event: dict) -> dict:
     """Обновить бронирование"""
@@ -293,17 +1443,37 @@ def update_booking(conn, event: dict) -> dict:
     
     cursor = conn.cursor()
     
-    # Проверка существования брони
-    cursor.execute("SELECT id FROM bookings WHERE id = %s", (booking_id,))
-    if not cursor.fetchone():
-        return error_response(404, 'Booking not found')
+    # Проверка пересечений, если меняется автомобиль, период или статус;
+    # для правок без них (оплаты, цена, заметки) остаётся один запрос UPDATE
+    if any(field in data for field in ('vehicle_id', 'start_date', 'end_date', 'status')):
+        cursor.execute(
+            "SELECT id, vehicle_id, start_date, end_date, status FROM bookings WHERE id = %s",
+            (booking_id,)
+        )
+        current = cursor.fetchone()
+        if not current:
+            return error_response(404, 'Booking not found')
+        
+        vehicle_id = data.get('vehicle_id', current['vehicle_id'])
+        status = data.get('status', current['status'])
+        if vehicle_id and status not in NON_BLOCKING_STATUSES and not data.get('allow_overlap'):
+            FLEET_ROW_LOCK.execute(cursor, {'id': vehicle_id})
+            conflicts = find_conflicts(
+                cursor, vehicle_id,
+                data.get('start_date', current['start_date']),
+                data.get('end_date', current['end_date']),
+                exclude_id=current['id']
+            )
+            if conflicts:
+                conn.rollback()
+                return error_response(409, 'Vehicle is already booked for these dates', {'conflicts': conflicts})
     
     # Динамическое построение UPDATE запроса
     update_fields = []
     values = []
     
     simple_fields = [
-        'client_name', 'client_phone', 'vehicle_id', 'vehicle_model', 'vehicle_license_plate',
+        'client_name', 'client_phone', 'client_id', 'vehicle_id', 'vehicle_model', 'vehicle_license_plate',
         'start_date', 'end_date', 'days', 'pickup_location', 'dropoff_location',
         'status', 'total_price', 'paid_amount', 'deposit_amount',
         'rental_days', 'rental_km', 'rental_price_per_day', 'rental_price_per_km',
@@ -325,25 +1495,29 @@ def update_booking(conn, event: dict) -> dict:
     if not update_fields:
         return error_response(400, 'No fields to update')
     
+    update_fields.append("updated_at = CURRENT_TIMESTAMP")
     values.append(booking_id)
-    query = f"UPDATE bookings SET {', '.join(update_fields)} WHERE id = %s"
-    
-    cursor.execute(query, values)
-    conn.commit()
     
-    # Получаем обновлённую бронь
-    cursor.execute("""
-        SELECT b.*, 
-               f.model as vehicle_model_full,
-               f.license_plate as vehicle_plate_full
-        FROM bookings b
+    # Обновление, событие в outbox и выборка с данными автомобиля за один запрос
+    cursor.execute(f"""
+        WITH b AS (
+            UPDATE bookings SET {', '.join(update_fields)} WHERE id = %s
+            RETURNING *
+        ), o AS (
+            INSERT INTO booking_outbox (booking_id, event) SELECT id, 'updated' FROM b
+        )
+        SELECT {build_select_list(None)}
+        FROM b
         LEFT JOIN fleet f ON b.vehicle_id = f.id
-        WHERE b.id = %s
-    """, (booking_id,))
+    """, values)
     booking = cursor.fetchone()
+    if not booking:
+        conn.rollback()
+        return error_response(404, 'Booking not found')
+    conn.commit()
     
     return success_response({
-        'booking': dict(booking) if booking else {'id': booking_id},
+        'booking': booking,
         'message': 'Booking updated successfully'
     })
 
@@ -358,10 +1532,15 @@ def delete_booking(conn, event: dict) -> dict:
     cursor = conn.cursor()
     
     # Мягкое удаление - меняем статус на "Отменено"
-    cursor.execute(
-        "UPDATE bookings SET status = 'Отменено' WHERE id = %s RETURNING id",
-        (booking_id,)
-    )
+    cursor.execute("""
+        WITH b AS (
+            UPDATE bookings SET status = 'Отменено', updated_at = CURRENT_TIMESTAMP WHERE id = %s
+            RETURNING id
+        ), o AS (
+            INSERT INTO booking_outbox (booking_id, event) SELECT id, 'cancelled' FROM b
+        )
+        SELECT id FROM b
+    """, (booking_id,))
     
     result = cursor.fetchone()
     if not result:
@@ -371,19 +1550,92 @@ def delete_booking(conn, event: dict) -> dict:
     
     return success_response({'message': 'Booking cancelled successfully'})
 
-def success_response(data: dict, status_code: int = 200) -> dict:
-    """Успешный ответ"""
+def cleanup_abandoned_drafts(conn) -> int:
+    """Удаляет черновики, не сохранявшиеся дольше DRAFT_MAX_AGE (индекс idx_bookings_drafts_updated_at).
+    Приёмники outbox получают deleted, чтобы убрать черновик у себя"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        WITH deleted AS (
+            DELETE FROM bookings
+            WHERE status = 'Черновик'
+              AND updated_at < NOW() - INTERVAL '{DRAFT_MAX_AGE}'
+            RETURNING id
+        )
+        INSERT INTO booking_outbox (booking_id, event)
+        SELECT id, 'deleted' FROM deleted
+    """)
+    deleted = cursor.rowcount
+    conn.commit()
+    return deleted
+
+def get_version_token(cursor, tables: List[str]) -> str:
+    """Дешёвый токен версии таблиц: последнее изменение и последнее удаление (оба по индексам).
+    updated_at - время начала транзакции, и транзакция, закоммиченная позже более новой, MAX не сдвигает.
+    Поэтому, пока последнее изменение моложе SYNC_SAFETY_MARGIN_SECONDS (тот же запас, что у ?since=),
+    в токен добавляется текущее время: ETag меняется на каждом запросе и 304 не отдаётся"""
+    parts = [
+        expr
+        for table in tables
+        for expr in (f"(SELECT MAX({VERSION_COLUMNS.get(table, 'updated_at')}) FROM {table})",
+                     f"(SELECT MAX(deleted_at) FROM deleted_records WHERE table_name = '{table}')")
+    ]
+    columns = ', '.join(f'v{i}' for i in range(len(parts)))
+    name = 'version_token_' + '_'.join(tables)
+    statement = _statements.get(name) or PreparedStatement(name, f"""
+        SELECT concat_ws('|', {columns},
+                         CASE WHEN GREATEST({columns}) > LOCALTIMESTAMP - {SYNC_SAFETY_MARGIN_SECONDS} * INTERVAL '1 second'
+                              THEN clock_timestamp()::text END) AS token
+        FROM (SELECT {', '.join(f'{expr} AS v{i}' for i, expr in enumerate(parts))}) v
+    """)
+    statement.execute(cursor)
+    return cursor.fetchone()['token']
+
+def make_etag(*parts) -> str:
+    """Слабый ETag из версии данных и параметров запроса"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+def is_not_modified(event: dict, etag: str) -> bool:
+    """Совпадает ли If-None-Match клиента с текущим ETag"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    header = headers.get('if-none-match')
+    if not header:
+        return False
+    tags = [tag.strip().replace('W/', '', 1) for tag in header.split(',')]
+    return '*' in tags or etag.replace('W/', '', 1) in tags
+
+def not_modified_response(etag: str) -> dict:
+    """304 без тела: данные у клиента актуальны"""
     return {
-        'statusCode': status_code,
+        'statusCode': 304,
         'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
+            'ETag': etag,
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
         },
-        'body': json.dumps(data, default=str),
+        'body': '',
         'isBase64Encoded': False
     }
 
-def error_response(status_code: int, message: str) -> dict:
+def success_response(data: dict, status_code: int = 200, etag: Optional[str] = None) -> dict:
+    """Успешный ответ"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*'
+    }
+    if etag:
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+        headers['Access-Control-Expose-Headers'] = 'ETag'
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': dumps(data),
+        'isBase64Encoded': False
+    }
+
+
+def error_response(status_code: int, message: str, details: Optional[dict] = None) -> dict:
     """Ответ с ошибкой"""
     return {
         'statusCode': status_code,
@@ -391,6 +1643,6 @@ def error_response(status_code: int, message: str) -> dict:
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps({'error': message}),
+        'body': dumps({'error': message, **(details or {})}),
         'isBase64Encoded': False
     }
\ No newline at end of file
@@ -1,18 +1,590 @@
 """API для управления клиентами: получение списка, создание, обновление и удаление клиентов"""
+import base64
+import contextvars
+import csv
+import gzip
+import hashlib
+import io
 import json
 import os
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
+from decimal import Decimal
 
 SCHEMA = 't_p81623955_crm_system_creation'
 
+# Имя функции: подпись в логах трассировки и имя серверного курсора экспорта
+FUNCTION_NAME = 'clients'
+
+# Быстрая сериализация: orjson, если установлен, иначе стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_default(value):
+    """Типы из psycopg2, которых нет в JSON: Decimal, date/datetime/time и прочее"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def dumps(data) -> str:
+    """Сериализация ответа; строки RealDictRow идут в JSON напрямую, без копии в dict"""
+    started = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    else:
+        body = json.dumps(data, default=json_default, ensure_ascii=False)
+    trace = _trace.get()
+    if trace is not None:
+        trace.serialize_ms += (time.perf_counter() - started) * 1000
+    return body
+
+# Сжатие ответов по Accept-Encoding: brotli, если установлен, иначе gzip.
+# Ответы меньше порога не сжимаются - выигрыш съедают base64 и CPU
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '2048'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+def accepted_encoding(event: dict) -> Optional[str]:
+    """Лучшая кодировка из Accept-Encoding клиента: br, затем gzip; None - без сжатия"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    accepted = set()
+    for item in (headers.get('accept-encoding') or '').split(','):
+        name, _, param = item.partition(';')
+        param = param.strip().lower()
+        if param.startswith('q='):
+            try:
+                if float(param[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress_response(event: dict, response: dict) -> dict:
+    """Сжимает текстовый ответ выше порога; тело уходит в base64 по контракту шлюза"""
+    body = response.get('body')
+    headers = response.get('headers') or {}
+    if response.get('isBase64Encoded') or not isinstance(body, str) or 'Content-Encoding' in headers:
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return response
+    # Ответ такого размера зависит от Accept-Encoding, даже если клиент сжатие не принял
+    headers = {**headers, 'Vary': 'Accept-Encoding'}
+    response['headers'] = headers
+    encoding = accepted_encoding(event)
+    if encoding is None:
+        return response
+    started = time.perf_counter()
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    trace = _trace.get()
+    if trace is not None:
+        trace.compress_ms += (time.perf_counter() - started) * 1000
+        trace.encoding = encoding
+    if len(compressed) >= len(raw):
+        return response
+    headers['Content-Encoding'] = encoding
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+# Пул соединений живёт на уровне модуля и переиспользуется тёплыми вызовами функции
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+POOL_HEALTHCHECK_AFTER = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30'))
+
+_pool: List[list] = []
+_pool_lock = threading.Lock()
+pool_stats = {'hits': 0, 'misses': 0, 'evicted': 0}
+
+def _close_quietly(conn) -> None:
+    """Закрывает соединение, игнорируя ошибки уже разорванного сокета"""
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _is_healthy(conn, idle_for: float) -> bool:
+    """Проверяет, что соединение из пула ещё живо"""
+    if conn.closed:
+        return False
+    if idle_for < POOL_HEALTHCHECK_AFTER:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_db_connection():
-    """Создает подключение к базе данных"""
+    """Берёт соединение из пула или создаёт новое"""
+    now = time.monotonic()
+    with _pool_lock:
+        while _pool:
+            conn, last_used = _pool.pop()
+            idle_for = now - last_used
+            if idle_for > POOL_IDLE_TIMEOUT or not _is_healthy(conn, idle_for):
+                _close_quietly(conn)
+                pool_stats['evicted'] += 1
+                continue
+            pool_stats['hits'] += 1
+            _record_connect('hit', now)
+            return conn
+        pool_stats['misses'] += 1
     dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn, cursor_factory=RealDictCursor, options=f'-c search_path={SCHEMA}')
+    conn = psycopg2.connect(dsn, connection_factory=PooledConnection, cursor_factory=TimedCursor, options=f'-c search_path={SCHEMA}')
+    _record_connect('miss', now)
+    return conn
+
+def _record_connect(pool_result: str, started: float) -> None:
+    trace = _trace.get()
+    if trace is not None:
+        trace.pool = pool_result
+        trace.connect_ms = (time.monotonic() - started) * 1000
+
+def release_db_connection(conn) -> None:
+    """Возвращает соединение в пул (лишние и сломанные закрываются)"""
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        _close_quietly(conn)
+        return
+    now = time.monotonic()
+    with _pool_lock:
+        for entry in [e for e in _pool if now - e[1] > POOL_IDLE_TIMEOUT]:
+            _pool.remove(entry)
+            _close_quietly(entry[0])
+            pool_stats['evicted'] += 1
+        if len(_pool) < POOL_MAX_SIZE:
+            _pool.append([conn, now])
+            return
+    _close_quietly(conn)
+
+def get_pool_stats() -> dict:
+    """Счётчики пула соединений текущего инстанса"""
+    with _pool_lock:
+        return {**pool_stats, 'idle': len(_pool), 'max_size': POOL_MAX_SIZE}
+
+# Подготовленные запросы: горячие SQL разбираются и планируются один раз на соединение пула,
+# дальше выполняются через EXECUTE по имени. За pgbouncer в режиме transaction нужно DB_PREPARED_STATEMENTS=0
+PREPARED_STATEMENTS_ENABLED = os.environ.get('DB_PREPARED_STATEMENTS', '1') == '1'
+PREPARED_PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+_statements: Dict[str, 'PreparedStatement'] = {}
+_statements_lock = threading.Lock()
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Соединение пула; помнит, какие запросы на нём уже подготовлены"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+class PreparedStatement:
+    """Запрос с именованными параметрами %(name)s; PREPARE выполняется при первом вызове на соединении"""
+
+    def __init__(self, name: str, sql: str):
+        params = list(dict.fromkeys(PREPARED_PARAM_RE.findall(sql)))
+        self.name = name
+        self.sql = sql
+        self.prepare_sql = f'PREPARE {name} AS ' + PREPARED_PARAM_RE.sub(
+            lambda match: f'${params.index(match.group(1)) + 1}', sql
+        )
+        self.execute_sql = f'EXECUTE {name}' + (f" ({', '.join(f'%({param})s' for param in params)})" if params else '')
+        self.stats = {'prepared': 0, 'executed': 0}
+        with _statements_lock:
+            _statements[name] = self
+
+    def execute(self, cursor, params: Optional[dict] = None) -> None:
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared', None)
+        if not PREPARED_STATEMENTS_ENABLED or prepared is None:
+            cursor.execute(self.sql, params)
+            return
+        if self.name not in prepared:
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+            with _statements_lock:
+                self.stats['prepared'] += 1
+        try:
+            cursor.execute(self.execute_sql, params)
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported):
+            # Запрос пропал на сервере или миграция поменяла колонки результата: соединение в пул не вернётся
+            _close_quietly(conn)
+            raise
+        with _statements_lock:
+            self.stats['executed'] += 1
+
+def get_statement_stats() -> dict:
+    """Счётчики подготовленных запросов: reused - выполнения без повторного разбора и планирования"""
+    with _statements_lock:
+        return {
+            'enabled': PREPARED_STATEMENTS_ENABLED,
+            'statements': {
+                name: {**statement.stats, 'reused': statement.stats['executed'] - statement.stats['prepared']}
+                for name, statement in _statements.items()
+            }
+        }
+
+# Инструментация вызова: время подключения, каждого SQL-запроса, сериализации и размер ответа
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') == '1'
+TRACE_SERVER_TIMING = os.environ.get('TRACE_SERVER_TIMING', '0') == '1'
+TRACE_SQL_PREVIEW = 120
+
+_trace: contextvars.ContextVar = contextvars.ContextVar('trace', default=None)
+
+class RequestTrace:
+    """Замеры одного вызова функции"""
+
+    def __init__(self, method: str, action: Optional[str]):
+        self.started = time.perf_counter()
+        self.method = method
+        self.action = action
+        self.connect_ms = 0.0
+        self.pool = None
+        self.queries: List[dict] = []
+        self.serialize_ms = 0.0
+        self.compress_ms = 0.0
+        self.encoding = None
+
+    def add_query(self, sql, elapsed_ms: float, rows: int) -> None:
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', 'replace')
+        self.queries.append({
+            'sql': ' '.join(str(sql).split())[:TRACE_SQL_PREVIEW],
+            'ms': round(elapsed_ms, 3),
+            'rows': rows
+        })
+
+    def db_ms(self) -> float:
+        return sum(q['ms'] for q in self.queries)
+
+class TimedCursorMixin:
+    """Засекает время и число строк каждого execute"""
+
+    def execute(self, query, vars=None):
+        trace = _trace.get()
+        if trace is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace.add_query(query, (time.perf_counter() - started) * 1000, self.rowcount)
+
+class TimedCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+class TimedTupleCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+def start_trace(event: dict) -> RequestTrace:
+    params = event.get('queryStringParameters') or {}
+    trace = RequestTrace(event.get('httpMethod', 'GET'), params.get('action'))
+    _trace.set(trace)
+    return trace
+
+def finish_trace(trace: RequestTrace, response: dict) -> dict:
+    """Пишет структурированный лог вызова и, если включено, заголовок Server-Timing"""
+    _trace.set(None)
+    total_ms = (time.perf_counter() - trace.started) * 1000
+    body = response.get('body') or ''
+    if TRACE_SERVER_TIMING:
+        response.setdefault('headers', {}).update({
+            'Server-Timing': ', '.join([
+                f'connect;dur={trace.connect_ms:.2f}',
+                f'db;dur={trace.db_ms():.2f}',
+                f'serialize;dur={trace.serialize_ms:.2f}',
+                f'compress;dur={trace.compress_ms:.2f}',
+                f'total;dur={total_ms:.2f}'
+            ]),
+            'Timing-Allow-Origin': '*'
+        })
+    if TRACE_LOG:
+        print(json.dumps({
+            'event': 'request',
+            'function': FUNCTION_NAME,
+            'method': trace.method,
+            'action': trace.action,
+            'status': response.get('statusCode'),
+            'total_ms': round(total_ms, 3),
+            'connect_ms': round(trace.connect_ms, 3),
+            'pool': trace.pool,
+            'db_ms': round(trace.db_ms(), 3),
+            'queries': trace.queries,
+            'serialize_ms': round(trace.serialize_ms, 3),
+            'compress_ms': round(trace.compress_ms, 3),
+            'encoding': trace.encoding,
+            'response_bytes': len(body.encode('utf-8')) if isinstance(body, str) else len(body)
+        }, ensure_ascii=False))
+    return response
+
+# Колонки списка клиентов; приведение типов и значения по умолчанию делаются в SQL,
+# чтобы строки сериализовались как есть, без ручной сборки словаря
+CLIENT_LIST_COLUMNS = """id, name, phone, email, company, telegram, whatsapp, city,
+                       COALESCE(balance, 0)::float8 AS balance,
+                       COALESCE(total_spent, 0)::float8 AS total_spent,
+                       COALESCE(orders_count, 0) AS orders_count,
+                       COALESCE(NULLIF(rating, 0), 5.0)::float8 AS rating,
+                       source, COALESCE(is_blacklist, false) AS is_blacklist, notes, created_at, updated_at, birth_date,
+                       passport_series, passport_number, passport_issued_by, passport_issued_date,
+                       address, driver_license_series, driver_license_number, driver_license_issued_date"""
+
+# Полный список клиентов - самый частый запрос, готовится на соединении (см. PreparedStatement)
+CLIENT_LIST = PreparedStatement('client_list', f"""
+    SELECT {CLIENT_LIST_COLUMNS}
+    FROM clients
+    ORDER BY created_at DESC
+""")
+
+# Поля клиента, которые можно менять через PATCH (статистика ведётся триггерами, см. V0022)
+CLIENT_UPDATABLE_FIELDS = (
+    'name', 'phone', 'email', 'company', 'telegram', 'whatsapp', 'city', 'notes', 'source',
+    'is_blacklist', 'birth_date', 'passport_series', 'passport_number', 'passport_issued_by',
+    'passport_issued_date', 'address', 'driver_license_series', 'driver_license_number',
+    'driver_license_issued_date'
+)
+
+# Выгрузка: размер порции серверного курсора и блока кодирования
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BLOCK_SIZE = 64 * 1024
+
+def stream_rows(conn, query: str, query_params: list):
+    """Серверный курсор: строки читаются порциями, первой выдаётся шапка колонок"""
+    with conn.cursor(name=f'{FUNCTION_NAME}_export', cursor_factory=TimedTupleCursor) as cursor:
+        cursor.itersize = EXPORT_CHUNK_SIZE
+        cursor.execute(query, query_params)
+        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+        yield [column.name for column in cursor.description]
+        while rows:
+            yield from rows
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+
+def encode_csv(rows) -> Iterator[str]:
+    """Кодирует поток строк в CSV блоками"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(rows))
+    for row in rows:
+        writer.writerow([
+            json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+            for value in row
+        ])
+        if buffer.tell() >= EXPORT_BLOCK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def encode_ndjson(rows) -> Iterator[str]:
+    """Кодирует поток строк в NDJSON (одна запись на строку)"""
+    columns = next(rows)
+    for row in rows:
+        yield dumps(dict(zip(columns, row))) + '\n'
+
+def export_clients(conn, query_params: dict) -> dict:
+    """Выгрузка клиентов в CSV/NDJSON без материализации всего списка"""
+    export_format = query_params.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return error_response(400, 'format must be csv or ndjson')
+    
+    rows = stream_rows(conn, f"SELECT {CLIENT_LIST_COLUMNS} FROM clients ORDER BY created_at DESC", [])
+    chunks = encode_csv(rows) if export_format == 'csv' else encode_ndjson(rows)
+    headers = {
+        'Content-Type': 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="clients.{export_format}"',
+        'Access-Control-Allow-Origin': '*'
+    }
+    
+    if query_params.get('gzip') in ('1', 'true'):
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as gz:
+            for chunk in chunks:
+                gz.write(chunk.encode('utf-8'))
+        headers['Content-Encoding'] = 'gzip'
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': base64.b64encode(buffer.getvalue()).decode('ascii'),
+            'isBase64Encoded': True
+        }
+    
+    body = io.StringIO()
+    for chunk in chunks:
+        body.write(chunk)
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body.getvalue(),
+        'isBase64Encoded': False
+    }
+
+# Поиск: минимальная длина запроса и максимум результатов
+SEARCH_MIN_LENGTH = 2
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+def normalize_phone(value: str) -> str:
+    """Цифры телефона, ведущая 8 российского номера заменяется на 7 (как phone_digits в БД)"""
+    digits = re.sub(r'\D', '', value)
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    return digits
+
+# Колонка версии для синхронизации и ETag: у клиентов это changed_at (V0031) - правка карточки
+# или пересчёт статистики; updated_at остаётся версией правки для PATCH
+VERSION_COLUMNS = {'clients': 'changed_at'}
+
+# Инкрементальная синхронизация: максимум строк за вызов и запас на ещё не закоммиченные транзакции
+SYNC_MAX_ROWS = 5000
+SYNC_SAFETY_MARGIN_SECONDS = 5
+
+def parse_since(params: dict) -> tuple:
+    """Разбирает since (ISO-время) и after_id из параметров синхронизации.
+    Смещение часового пояса (Z, +03:00) отбрасывается: updated_at хранится в TIMESTAMP без зоны"""
+    return datetime.fromisoformat(params['since']).replace(tzinfo=None), int(params.get('after_id') or 0)
+
+def fetch_changes(cursor, table: str, select_sql: str, since: datetime, after_id: int) -> dict:
+    """Строки таблицы (алиас t), изменённые после (since, after_id), и id удалённых записей"""
+    column = VERSION_COLUMNS.get(table, 'updated_at')
+    cursor.execute(
+        "SELECT LOCALTIMESTAMP - %s * INTERVAL '1 second' AS sync_point",
+        (SYNC_SAFETY_MARGIN_SECONDS,)
+    )
+    sync_point = cursor.fetchone()['sync_point']
+    
+    cursor.execute(f"""
+        {select_sql}
+        WHERE (t.{column}, t.id) > (%s, %s)
+        ORDER BY t.{column}, t.id
+        LIMIT %s
+    """, (since, after_id, SYNC_MAX_ROWS + 1))
+    rows = cursor.fetchall()
+    
+    has_more = len(rows) > SYNC_MAX_ROWS
+    rows = rows[:SYNC_MAX_ROWS]
+    if has_more:
+        next_since, next_after_id = rows[-1][column], rows[-1]['id']
+    else:
+        next_since, next_after_id = max(sync_point, since), 0
+    
+    cursor.execute(
+        "SELECT record_id FROM deleted_records WHERE table_name = %s AND deleted_at > %s ORDER BY deleted_at",
+        (table, since)
+    )
+    
+    return {
+        'rows': rows,
+        'deleted': [row['record_id'] for row in cursor.fetchall()],
+        'next_since': next_since.isoformat(),
+        'next_after_id': next_after_id,
+        'has_more': has_more
+    }
+
+def get_client_changes(conn, query_params: dict) -> dict:
+    """Клиенты, изменённые с момента since, и id удалённых"""
+    try:
+        since, after_id = parse_since(query_params)
+    except (ValueError, TypeError) as e:
+        return error_response(400, f'Invalid since: {e}')
+    
+    changes = fetch_changes(
+        conn.cursor(), 'clients',
+        f"SELECT {CLIENT_LIST_COLUMNS}, changed_at FROM clients t",
+        since, after_id
+    )
+    return success_response({'clients': changes.pop('rows'), **changes})
+
+def search_clients(conn, query_params: dict) -> dict:
+    """Поиск клиентов по имени (префикс и нечёткий), телефону и номерам документов"""
+    q = (query_params.get('q') or '').strip()
+    if len(q) < SEARCH_MIN_LENGTH:
+        return error_response(400, f'Query must be at least {SEARCH_MIN_LENGTH} characters')
+    
+    try:
+        limit = max(1, min(int(query_params.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT))
+    except ValueError:
+        limit = SEARCH_DEFAULT_LIMIT
+    
+    params = {
+        'q': q,
+        'prefix': q.replace('%', '').replace('_', '') + '%',
+        'document': q.replace(' ', ''),
+        'limit': limit
+    }
+    conditions = [
+        "name ILIKE %(prefix)s",
+        "name %% %(q)s",
+        "passport_number = %(document)s",
+        "driver_license_number = %(document)s"
+    ]
+    phone_rank = "0"
+    
+    digits = normalize_phone(q)
+    if len(digits) >= 4:
+        params['digits'] = '%' + digits + '%'
+        conditions.append("phone_digits LIKE %(digits)s")
+        phone_rank = "CASE WHEN phone_digits LIKE %(digits)s THEN 0.9 ELSE 0 END"
+    
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT id, name, phone, email, city, passport_series, passport_number,
+               driver_license_number, is_blacklist,
+               GREATEST(
+                   CASE WHEN passport_number = %(document)s OR driver_license_number = %(document)s THEN 1.0 ELSE 0 END,
+                   {phone_rank},
+                   CASE WHEN name ILIKE %(prefix)s THEN 0.8 + similarity(name, %(q)s) * 0.1 ELSE 0 END,
+                   similarity(name, %(q)s)
+               ) AS score
+        FROM clients
+        WHERE {' OR '.join(conditions)}
+        ORDER BY score DESC, name
+        LIMIT %(limit)s
+    """, params)
+    
+    clients = []
+    for row in cursor.fetchall():
+        client = dict(row)
+        client['score'] = round(float(client['score']), 3)
+        client['is_blacklist'] = client['is_blacklist'] or False
+        clients.append(client)
+    
+    return success_response({'clients': clients, 'total': len(clients)})
 
 def handler(event: dict, context) -> dict:
+    """API для управления клиентами: маршрутизация запроса под замером времени"""
+    trace = start_trace(event)
+    response = compress_response(event, handle_request(event, context))
+    return finish_trace(trace, response)
+
+def handle_request(event: dict, context) -> dict:
     method = event.get('httpMethod', 'GET') 
     
     # CORS preflight
@@ -21,74 +593,53 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token'
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, If-None-Match'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    query_params = event.get('queryStringParameters') or {}
+    if method == 'GET' and query_params.get('action') == 'pool_stats':
+        return success_response({'pool': get_pool_stats(), 'prepared': get_statement_stats()})
+    
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        # GET ?action=export - выгрузка клиентов в CSV/NDJSON
+        if method == 'GET' and query_params.get('action') == 'export':
+            return export_clients(conn, query_params)
+        
+        # GET ?since= - изменения с указанного момента
+        elif method == 'GET' and query_params.get('since'):
+            return get_client_changes(conn, query_params)
+        
+        # GET ?action=search&q= - поиск клиентов
+        elif method == 'GET' and query_params.get('action') == 'search':
+            return search_clients(conn, query_params)
+        
         # GET - получить всех клиентов
-        if method == 'GET':
-            cursor.execute("""
-                SELECT id, name, phone, email, company, telegram, whatsapp, 
-                       city, balance, total_spent, orders_count, rating, 
-                       source, is_blacklist, notes, created_at, birth_date,
-                       passport_series, passport_number, passport_issued_by, passport_issued_date,
-                       address, driver_license_series, driver_license_number, driver_license_issued_date
-                FROM clients
-                WHERE (created_at IS NULL OR EXTRACT(YEAR FROM created_at) < 2100)
-                  AND (birth_date IS NULL OR EXTRACT(YEAR FROM birth_date) < 2100)
-                  AND (passport_issued_date IS NULL OR EXTRACT(YEAR FROM passport_issued_date) < 2100)
-                  AND (driver_license_issued_date IS NULL OR EXTRACT(YEAR FROM driver_license_issued_date) < 2100)
-                ORDER BY created_at DESC
-            """)
+        elif method == 'GET':
+            etag = make_etag(get_version_token(cursor, ['clients']))
+            if is_not_modified(event, etag):
+                return not_modified_response(etag)
             
-            clients = []
-            for row in cursor.fetchall():
-                clients.append({
-                    'id': row['id'],
-                    'name': row['name'],
-                    'phone': row['phone'],
-                    'email': row['email'],
-                    'company': row['company'],
-                    'telegram': row['telegram'],
-                    'whatsapp': row['whatsapp'],
-                    'city': row['city'],
-                    'balance': float(row['balance']) if row['balance'] else 0,
-                    'total_spent': float(row['total_spent']) if row['total_spent'] else 0,
-                    'orders_count': row['orders_count'] or 0,
-                    'rating': float(row['rating']) if row['rating'] else 5.0,
-                    'source': row['source'],
-                    'is_blacklist': row['is_blacklist'] or False,
-                    'notes': row['notes'],
-                    'created_at': row['created_at'].isoformat() if row['created_at'] else None,
-                    'birth_date': row['birth_date'].isoformat() if row['birth_date'] else None,
-                    'passport_series': row['passport_series'],
-                    'passport_number': row['passport_number'],
-                    'passport_issued_by': row['passport_issued_by'],
-                    'passport_issued_date': row['passport_issued_date'].isoformat() if row['passport_issued_date'] else None,
-                    'address': row['address'],
-                    'driver_license_series': row['driver_license_series'],
-                    'driver_license_number': row['driver_license_number'],
-                    'driver_license_issued_date': row['driver_license_issued_date'].isoformat() if row['driver_license_issued_date'] else None
-                })
+            CLIENT_LIST.execute(cursor)
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'clients': clients}),
-                'isBase64Encoded': False
-            }
-        
+            clients = cursor.fetchall()
+            
+            return success_response({'clients': clients}, etag=etag)
+
+        # POST ?action=rebuild_stats - полный пересчёт статистики клиентов по броням (см. V0022)
+        elif method == 'POST' and query_params.get('action') == 'rebuild_stats':
+            cursor.execute("SELECT rebuild_client_stats() AS updated")
+            updated = cursor.fetchone()['updated']
+            conn.commit()
+            return success_response({'updated': updated})
+
         # POST - создать нового клиента
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -138,15 +689,7 @@ def handler(event: dict, context) -> dict:
                 'birth_date': row['birth_date'].isoformat() if row['birth_date'] else None
             }
             
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'client': new_client}),
-                'isBase64Encoded': False
-            }
+            return success_response({'client': new_client}, status_code=201)
         
         # PUT - обновить клиента
         elif method == 'PUT':
@@ -189,12 +732,7 @@ def handler(event: dict, context) -> dict:
             conn.commit()
             row = cursor.fetchone()
             if not row:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Client not found'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(404, 'Client not found')
             
             updated_client = {
                 'id': row['id'],
@@ -211,15 +749,16 @@ def handler(event: dict, context) -> dict:
                 'birth_date': row['birth_date'].isoformat() if row['birth_date'] else None
             }
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'client': updated_client}),
-                'isBase64Encoded': False
-            }
+            return success_response({'client': updated_client})
+        
+        # PATCH - частичное обновление: пишутся только переданные поля, без предварительного чтения
+        elif method == 'PATCH':
+            body = json.loads(event.get('body', '{}'))
+            client_id = body.get('id')
+            if not client_id:
+                return error_response(400, 'Missing client id')
+            
+            return update_record(conn, 'clients', 'client', client_id, body, CLIENT_UPDATABLE_FIELDS, CLIENT_LIST_COLUMNS)
         
         # DELETE - удалить клиента
         elif method == 'DELETE':
@@ -227,12 +766,7 @@ def handler(event: dict, context) -> dict:
             client_id = query_params.get('id')
             
             if not client_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing client id'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(400, 'Missing client id')
             
             cursor.execute("""
                 DELETE FROM clients
@@ -243,41 +777,128 @@ def handler(event: dict, context) -> dict:
             conn.commit()
             row = cursor.fetchone()
             if not row:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Client not found'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(404, 'Client not found')
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'message': f'Client {row["name"]} deleted successfully'}),
-                'isBase64Encoded': False
-            }
+            return success_response({'message': f'Client {row["name"]} deleted successfully'})
         
         else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
+            return error_response(405, 'Method not allowed')
             
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return error_response(500, str(e))
     finally:
         if conn:
-            conn.close()
\ No newline at end of file
+            release_db_connection(conn)
+
+def update_record(conn, table: str, key: str, record_id, data: dict, fields, returning: str,
+                  check_version: bool = True, extra: Optional[dict] = None) -> dict:
+    """Частичное обновление: пишутся только переданные поля.
+    При check_version и updated_at в теле запись меняется только при совпадении версии, иначе 409 с текущей записью.
+    extra - дополнительные поля успешного ответа (совместимость со старыми ответами)"""
+    assignments = [f'{field} = %s' for field in fields if field in data]
+    values = [data[field] for field in fields if field in data]
+    if not assignments:
+        return error_response(400, 'No fields to update')
+    
+    where = 'id = %s'
+    values.append(record_id)
+    if check_version and data.get('updated_at'):
+        where += ' AND updated_at = %s'
+        values.append(data['updated_at'])
+    
+    cur = conn.cursor()
+    cur.execute(f'''
+        UPDATE {table}
+        SET {', '.join(assignments)}, updated_at = CURRENT_TIMESTAMP
+        WHERE {where}
+        RETURNING {returning}
+    ''', values)
+    row = cur.fetchone()
+    if row:
+        conn.commit()
+        return success_response({**(extra or {}), key: row})
+    
+    conn.rollback()
+    cur.execute(f'SELECT {returning} FROM {table} WHERE id = %s', (record_id,))
+    current = cur.fetchone()
+    if not current:
+        return error_response(404, 'Record not found')
+    return error_response(409, 'Record was modified by someone else', {key: current})
+
+def get_version_token(cursor, tables: List[str]) -> str:
+    """Дешёвый токен версии таблиц: последнее изменение и последнее удаление (оба по индексам).
+    updated_at - время начала транзакции, и транзакция, закоммиченная позже более новой, MAX не сдвигает.
+    Поэтому, пока последнее изменение моложе SYNC_SAFETY_MARGIN_SECONDS (тот же запас, что у ?since=),
+    в токен добавляется текущее время: ETag меняется на каждом запросе и 304 не отдаётся"""
+    parts = [
+        expr
+        for table in tables
+        for expr in (f"(SELECT MAX({VERSION_COLUMNS.get(table, 'updated_at')}) FROM {table})",
+                     f"(SELECT MAX(deleted_at) FROM deleted_records WHERE table_name = '{table}')")
+    ]
+    columns = ', '.join(f'v{i}' for i in range(len(parts)))
+    name = 'version_token_' + '_'.join(tables)
+    statement = _statements.get(name) or PreparedStatement(name, f"""
+        SELECT concat_ws('|', {columns},
+                         CASE WHEN GREATEST({columns}) > LOCALTIMESTAMP - {SYNC_SAFETY_MARGIN_SECONDS} * INTERVAL '1 second'
+                              THEN clock_timestamp()::text END) AS token
+        FROM (SELECT {', '.join(f'{expr} AS v{i}' for i, expr in enumerate(parts))}) v
+    """)
+    statement.execute(cursor)
+    return cursor.fetchone()['token']
+
+def make_etag(*parts) -> str:
+    """Слабый ETag из версии данных и параметров запроса"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+def is_not_modified(event: dict, etag: str) -> bool:
+    """Совпадает ли If-None-Match клиента с текущим ETag"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    header = headers.get('if-none-match')
+    if not header:
+        return False
+    tags = [tag.strip().replace('W/', '', 1) for tag in header.split(',')]
+    return '*' in tags or etag.replace('W/', '', 1) in tags
+
+def not_modified_response(etag: str) -> dict:
+    """304 без тела: данные у клиента актуальны"""
+    return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+def success_response(data: dict, status_code: int = 200, etag: Optional[str] = None) -> dict:
+    """Успешный ответ"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*'
+    }
+    if etag:
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+        headers['Access-Control-Expose-Headers'] = 'ETag'
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': dumps(data),
+        'isBase64Encoded': False
+    }
+
+def error_response(status_code: int, message: str, details: Optional[dict] = None) -> dict:
+    """Ответ с ошибкой"""
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': dumps({'error': message, **(details or {})}),
+        'isBase64Encoded': False
+    }
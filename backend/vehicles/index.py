@@ -3,21 +3,593 @@ API для управления автопарком
 Добавление, редактирование, удаление и получение информации об автомобилях
 """
 
+import base64
+import contextvars
+import gzip
+import hashlib
 import json
 import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from datetime import date, datetime
+from decimal import Decimal
 
 SCHEMA = 't_p81623955_crm_system_creation'
 
+# Имя функции: подпись в логах трассировки и имя серверного курсора экспорта
+FUNCTION_NAME = 'vehicles'
+
+# Быстрая сериализация: orjson, если установлен, иначе стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_default(value):
+    """Типы из psycopg2, которых нет в JSON: Decimal, date/datetime/time и прочее"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def dumps(data) -> str:
+    """Сериализация ответа; строки RealDictRow идут в JSON напрямую, без копии в dict"""
+    started = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    else:
+        body = json.dumps(data, default=json_default, ensure_ascii=False)
+    trace = _trace.get()
+    if trace is not None:
+        trace.serialize_ms += (time.perf_counter() - started) * 1000
+    return body
+
+# Сжатие ответов по Accept-Encoding: brotli, если установлен, иначе gzip.
+# Ответы меньше порога не сжимаются - выигрыш съедают base64 и CPU
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '2048'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+def accepted_encoding(event: dict) -> Optional[str]:
+    """Лучшая кодировка из Accept-Encoding клиента: br, затем gzip; None - без сжатия"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    accepted = set()
+    for item in (headers.get('accept-encoding') or '').split(','):
+        name, _, param = item.partition(';')
+        param = param.strip().lower()
+        if param.startswith('q='):
+            try:
+                if float(param[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress_response(event: dict, response: dict) -> dict:
+    """Сжимает текстовый ответ выше порога; тело уходит в base64 по контракту шлюза"""
+    body = response.get('body')
+    headers = response.get('headers') or {}
+    if response.get('isBase64Encoded') or not isinstance(body, str) or 'Content-Encoding' in headers:
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return response
+    # Ответ такого размера зависит от Accept-Encoding, даже если клиент сжатие не принял
+    headers = {**headers, 'Vary': 'Accept-Encoding'}
+    response['headers'] = headers
+    encoding = accepted_encoding(event)
+    if encoding is None:
+        return response
+    started = time.perf_counter()
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    trace = _trace.get()
+    if trace is not None:
+        trace.compress_ms += (time.perf_counter() - started) * 1000
+        trace.encoding = encoding
+    if len(compressed) >= len(raw):
+        return response
+    headers['Content-Encoding'] = encoding
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+# Пул соединений живёт на уровне модуля и переиспользуется тёплыми вызовами функции
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+POOL_HEALTHCHECK_AFTER = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30'))
+
+_pool: List[list] = []
+_pool_lock = threading.Lock()
+pool_stats = {'hits': 0, 'misses': 0, 'evicted': 0}
+
+def _close_quietly(conn) -> None:
+    """Закрывает соединение, игнорируя ошибки уже разорванного сокета"""
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _is_healthy(conn, idle_for: float) -> bool:
+    """Проверяет, что соединение из пула ещё живо"""
+    if conn.closed:
+        return False
+    if idle_for < POOL_HEALTHCHECK_AFTER:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_db_connection():
-    """Создает подключение к базе данных"""
+    """Берёт соединение из пула или создаёт новое"""
+    now = time.monotonic()
+    with _pool_lock:
+        while _pool:
+            conn, last_used = _pool.pop()
+            idle_for = now - last_used
+            if idle_for > POOL_IDLE_TIMEOUT or not _is_healthy(conn, idle_for):
+                _close_quietly(conn)
+                pool_stats['evicted'] += 1
+                continue
+            pool_stats['hits'] += 1
+            _record_connect('hit', now)
+            return conn
+        pool_stats['misses'] += 1
     dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn, cursor_factory=RealDictCursor, options=f'-c search_path={SCHEMA}')
+    conn = psycopg2.connect(dsn, connection_factory=PooledConnection, cursor_factory=TimedCursor, options=f'-c search_path={SCHEMA}')
+    _record_connect('miss', now)
+    return conn
+
+def _record_connect(pool_result: str, started: float) -> None:
+    trace = _trace.get()
+    if trace is not None:
+        trace.pool = pool_result
+        trace.connect_ms = (time.monotonic() - started) * 1000
+
+def release_db_connection(conn) -> None:
+    """Возвращает соединение в пул (лишние и сломанные закрываются)"""
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        _close_quietly(conn)
+        return
+    now = time.monotonic()
+    with _pool_lock:
+        for entry in [e for e in _pool if now - e[1] > POOL_IDLE_TIMEOUT]:
+            _pool.remove(entry)
+            _close_quietly(entry[0])
+            pool_stats['evicted'] += 1
+        if len(_pool) < POOL_MAX_SIZE:
+            _pool.append([conn, now])
+            return
+    _close_quietly(conn)
+
+def get_pool_stats() -> dict:
+    """Счётчики пула соединений текущего инстанса"""
+    with _pool_lock:
+        return {**pool_stats, 'idle': len(_pool), 'max_size': POOL_MAX_SIZE}
+
+# Подготовленные запросы: горячие SQL разбираются и планируются один раз на соединение пула,
+# дальше выполняются через EXECUTE по имени. За pgbouncer в режиме transaction нужно DB_PREPARED_STATEMENTS=0
+PREPARED_STATEMENTS_ENABLED = os.environ.get('DB_PREPARED_STATEMENTS', '1') == '1'
+PREPARED_PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+_statements: Dict[str, 'PreparedStatement'] = {}
+_statements_lock = threading.Lock()
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Соединение пула; помнит, какие запросы на нём уже подготовлены"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+class PreparedStatement:
+    """Запрос с именованными параметрами %(name)s; PREPARE выполняется при первом вызове на соединении"""
+
+    def __init__(self, name: str, sql: str):
+        params = list(dict.fromkeys(PREPARED_PARAM_RE.findall(sql)))
+        self.name = name
+        self.sql = sql
+        self.prepare_sql = f'PREPARE {name} AS ' + PREPARED_PARAM_RE.sub(
+            lambda match: f'${params.index(match.group(1)) + 1}', sql
+        )
+        self.execute_sql = f'EXECUTE {name}' + (f" ({', '.join(f'%({param})s' for param in params)})" if params else '')
+        self.stats = {'prepared': 0, 'executed': 0}
+        with _statements_lock:
+            _statements[name] = self
+
+    def execute(self, cursor, params: Optional[dict] = None) -> None:
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared', None)
+        if not PREPARED_STATEMENTS_ENABLED or prepared is None:
+            cursor.execute(self.sql, params)
+            return
+        if self.name not in prepared:
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+            with _statements_lock:
+                self.stats['prepared'] += 1
+        try:
+            cursor.execute(self.execute_sql, params)
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported):
+            # Запрос пропал на сервере или миграция поменяла колонки результата: соединение в пул не вернётся
+            _close_quietly(conn)
+            raise
+        with _statements_lock:
+            self.stats['executed'] += 1
+
+def get_statement_stats() -> dict:
+    """Счётчики подготовленных запросов: reused - выполнения без повторного разбора и планирования"""
+    with _statements_lock:
+        return {
+            'enabled': PREPARED_STATEMENTS_ENABLED,
+            'statements': {
+                name: {**statement.stats, 'reused': statement.stats['executed'] - statement.stats['prepared']}
+                for name, statement in _statements.items()
+            }
+        }
+
+# Кэш справочника автопарка на уровне модуля: тёплые вызовы берут fleet из памяти.
+# После FLEET_CACHE_TTL версия таблицы сверяется одним дешёвым запросом, данные перечитываются только при изменении
+FLEET_CACHE_TTL = float(os.environ.get('FLEET_CACHE_TTL', '60'))
+FLEET_CACHE_COLUMNS = 'id, model, license_plate, status, current_location, next_service_date, is_active'
+
+_FLEET_CACHE_EMPTY = {'rows': None, 'by_id': {}, 'token': None, 'checked_at': 0.0}
+_fleet_cache: dict = _FLEET_CACHE_EMPTY
+_fleet_cache_lock = threading.Lock()
+fleet_cache_stats = {'hits': 0, 'revalidated': 0, 'loads': 0, 'invalidations': 0}
+
+def get_fleet(cursor, token: Optional[str] = None) -> dict:
+    """Автопарк из кэша: rows (по модели и номеру), by_id и token версии; снимок кэша не меняется на месте.
+
+    token - уже прочитанная версия fleet (например, для ETag): снимок сверяется с ней без учёта TTL,
+    чтобы данные ответа не были старше его ETag
+    """
+    global _fleet_cache
+    with _fleet_cache_lock:
+        cache = _fleet_cache
+        if cache['rows'] is not None and (
+            cache['token'] == token if token is not None
+            else time.monotonic() - cache['checked_at'] < FLEET_CACHE_TTL
+        ):
+            fleet_cache_stats['hits'] += 1
+            return cache
+    
+    if token is None:
+        token = get_version_token(cursor, ['fleet'])
+    if cache['rows'] is not None and cache['token'] == token:
+        cache = {**cache, 'checked_at': time.monotonic()}
+        with _fleet_cache_lock:
+            _fleet_cache = cache
+            fleet_cache_stats['revalidated'] += 1
+        return cache
+    
+    FLEET_CACHE_LOAD.execute(cursor)
+    rows = [dict(row) for row in cursor.fetchall()]
+    cache = {'rows': rows, 'by_id': {row['id']: row for row in rows}, 'token': token, 'checked_at': time.monotonic()}
+    with _fleet_cache_lock:
+        _fleet_cache = cache
+        fleet_cache_stats['loads'] += 1
+    return cache
+
+def invalidate_fleet_cache() -> None:
+    """Сбрасывает кэш автопарка после записи в fleet"""
+    global _fleet_cache
+    with _fleet_cache_lock:
+        _fleet_cache = _FLEET_CACHE_EMPTY
+        fleet_cache_stats['invalidations'] += 1
+
+def get_fleet_cache_stats() -> dict:
+    with _fleet_cache_lock:
+        return {**fleet_cache_stats, 'size': len(_fleet_cache['by_id']), 'ttl': FLEET_CACHE_TTL}
+
+# Инструментация вызова: время подключения, каждого SQL-запроса, сериализации и размер ответа
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') == '1'
+TRACE_SERVER_TIMING = os.environ.get('TRACE_SERVER_TIMING', '0') == '1'
+TRACE_SQL_PREVIEW = 120
+
+_trace: contextvars.ContextVar = contextvars.ContextVar('trace', default=None)
+
+class RequestTrace:
+    """Замеры одного вызова функции"""
+
+    def __init__(self, method: str, action: Optional[str]):
+        self.started = time.perf_counter()
+        self.method = method
+        self.action = action
+        self.connect_ms = 0.0
+        self.pool = None
+        self.queries: List[dict] = []
+        self.serialize_ms = 0.0
+        self.compress_ms = 0.0
+        self.encoding = None
+
+    def add_query(self, sql, elapsed_ms: float, rows: int) -> None:
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', 'replace')
+        self.queries.append({
+            'sql': ' '.join(str(sql).split())[:TRACE_SQL_PREVIEW],
+            'ms': round(elapsed_ms, 3),
+            'rows': rows
+        })
+
+    def db_ms(self) -> float:
+        return sum(q['ms'] for q in self.queries)
+
+class TimedCursorMixin:
+    """Засекает время и число строк каждого execute"""
+
+    def execute(self, query, vars=None):
+        trace = _trace.get()
+        if trace is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace.add_query(query, (time.perf_counter() - started) * 1000, self.rowcount)
+
+class TimedCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+class TimedTupleCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+def start_trace(event: dict) -> RequestTrace:
+    params = event.get('queryStringParameters') or {}
+    trace = RequestTrace(event.get('httpMethod', 'GET'), params.get('action'))
+    _trace.set(trace)
+    return trace
+
+def finish_trace(trace: RequestTrace, response: dict) -> dict:
+    """Пишет структурированный лог вызова и, если включено, заголовок Server-Timing"""
+    _trace.set(None)
+    total_ms = (time.perf_counter() - trace.started) * 1000
+    body = response.get('body') or ''
+    if TRACE_SERVER_TIMING:
+        response.setdefault('headers', {}).update({
+            'Server-Timing': ', '.join([
+                f'connect;dur={trace.connect_ms:.2f}',
+                f'db;dur={trace.db_ms():.2f}',
+                f'serialize;dur={trace.serialize_ms:.2f}',
+                f'compress;dur={trace.compress_ms:.2f}',
+                f'total;dur={total_ms:.2f}'
+            ]),
+            'Timing-Allow-Origin': '*'
+        })
+    if TRACE_LOG:
+        print(json.dumps({
+            'event': 'request',
+            'function': FUNCTION_NAME,
+            'method': trace.method,
+            'action': trace.action,
+            'status': response.get('statusCode'),
+            'total_ms': round(total_ms, 3),
+            'connect_ms': round(trace.connect_ms, 3),
+            'pool': trace.pool,
+            'db_ms': round(trace.db_ms(), 3),
+            'queries': trace.queries,
+            'serialize_ms': round(trace.serialize_ms, 3),
+            'compress_ms': round(trace.compress_ms, 3),
+            'encoding': trace.encoding,
+            'response_bytes': len(body.encode('utf-8')) if isinstance(body, str) else len(body)
+        }, ensure_ascii=False))
+    return response
+
+# Колонка версии для синхронизации и ETag, если это не updated_at (см. clients)
+VERSION_COLUMNS: Dict[str, str] = {}
+
+# Инкрементальная синхронизация: максимум строк за вызов и запас на ещё не закоммиченные транзакции
+SYNC_MAX_ROWS = 5000
+SYNC_SAFETY_MARGIN_SECONDS = 5
+
+def parse_since(params: dict) -> tuple:
+    """Разбирает since (ISO-время) и after_id из параметров синхронизации.
+    Смещение часового пояса (Z, +03:00) отбрасывается: updated_at хранится в TIMESTAMP без зоны"""
+    return datetime.fromisoformat(params['since']).replace(tzinfo=None), int(params.get('after_id') or 0)
+
+def fetch_changes(cursor, table: str, select_sql: str, since: datetime, after_id: int) -> dict:
+    """Строки таблицы (алиас t), изменённые после (since, after_id), и id удалённых записей"""
+    column = VERSION_COLUMNS.get(table, 'updated_at')
+    cursor.execute(
+        "SELECT LOCALTIMESTAMP - %s * INTERVAL '1 second' AS sync_point",
+        (SYNC_SAFETY_MARGIN_SECONDS,)
+    )
+    sync_point = cursor.fetchone()['sync_point']
+    
+    cursor.execute(f"""
+        {select_sql}
+        WHERE (t.{column}, t.id) > (%s, %s)
+        ORDER BY t.{column}, t.id
+        LIMIT %s
+    """, (since, after_id, SYNC_MAX_ROWS + 1))
+    rows = cursor.fetchall()
+    
+    has_more = len(rows) > SYNC_MAX_ROWS
+    rows = rows[:SYNC_MAX_ROWS]
+    if has_more:
+        next_since, next_after_id = rows[-1][column], rows[-1]['id']
+    else:
+        next_since, next_after_id = max(sync_point, since), 0
+    
+    cursor.execute(
+        "SELECT record_id FROM deleted_records WHERE table_name = %s AND deleted_at > %s ORDER BY deleted_at",
+        (table, since)
+    )
+    
+    return {
+        'rows': rows,
+        'deleted': [row['record_id'] for row in cursor.fetchall()],
+        'next_since': next_since.isoformat(),
+        'next_after_id': next_after_id,
+        'has_more': has_more
+    }
+
+# Карточка автомобиля: GET по id и ответ на PUT/PATCH
+VEHICLE_DETAIL_COLUMNS = '''id, branch_id, model, license_plate, vin, year, color, seats, category,
+                           status, current_location, insurance_expires, tech_inspection_expires,
+                           osago_number, kasko_number, last_service_date, next_service_date,
+                           last_service_km, next_service_km, current_km, purchase_price,
+                           rental_price_per_day, rental_price_per_km, sublease_cost, notes, is_active,
+                           created_at, updated_at'''
+
+# Горячие запросы автопарка, подготовленные на соединении (см. PreparedStatement)
+VEHICLE_BY_ID = PreparedStatement('vehicle_by_id', f'SELECT {VEHICLE_DETAIL_COLUMNS} FROM fleet WHERE id = %(id)s')
+FLEET_CACHE_LOAD = PreparedStatement(
+    'fleet_cache_load', f"SELECT {FLEET_CACHE_COLUMNS} FROM fleet ORDER BY model, license_plate"
+)
+
+# Поля, которые можно менять через PUT/PATCH
+FLEET_UPDATABLE_FIELDS = (
+    'model', 'license_plate', 'vin', 'year', 'color', 'seats', 'category',
+    'status', 'current_location', 'insurance_expires', 'tech_inspection_expires',
+    'osago_number', 'kasko_number', 'last_service_date', 'next_service_date',
+    'last_service_km', 'next_service_km', 'current_km', 'purchase_price',
+    'rental_price_per_day', 'rental_price_per_km', 'sublease_cost', 'notes'
+)
+
+# Колонки истории передач автомобиля
+HANDOVER_HISTORY_COLUMNS = '''id, handover_id, vehicle_id, type, handover_date, handover_time,
+                              odometer, fuel_level, odometer_km, fuel_percent, deposit_amount, rental_amount,
+                              rental_payment_method, transponder_number, notes, created_at'''
+
+# Прогноз ТО: темп пробега (км/день) по показаниям передач за окно, дата ТО - ближайшая из
+# next_service_date и дня, когда при этом темпе пробег дойдёт до next_service_km
+MAINTENANCE_RATE_WINDOW_DAYS = 90
+MAINTENANCE_FORECAST_QUERY = '''
+    WITH rates AS (
+        SELECT vehicle_id,
+               (MAX(odometer_km) - MIN(odometer_km))::float8
+                   / NULLIF(MAX(handover_date) - MIN(handover_date), 0) AS km_per_day
+        FROM vehicle_handovers
+        WHERE handover_date >= CURRENT_DATE - %(window_days)s
+          AND odometer_km IS NOT NULL
+        GROUP BY vehicle_id
+    ), forecast AS (
+        SELECT f.id, f.model, f.license_plate, f.current_km, f.next_service_km, f.next_service_date,
+               round(r.km_per_day::numeric, 1)::float8 AS km_per_day,
+               f.next_service_km - f.current_km AS km_left,
+               CASE WHEN r.km_per_day > 0 AND f.next_service_km IS NOT NULL
+                    THEN CURRENT_DATE + ceil(GREATEST(f.next_service_km - COALESCE(f.current_km, 0), 0) / r.km_per_day)::int
+               END AS km_due_date
+        FROM fleet f
+        LEFT JOIN rates r ON r.vehicle_id = f.id
+        WHERE f.is_active = true
+    )
+    SELECT *,
+           LEAST(next_service_date, km_due_date) AS due_date,
+           CASE WHEN km_due_date IS NULL AND next_service_date IS NULL THEN NULL
+                WHEN next_service_date IS NULL OR km_due_date < next_service_date THEN 'km'
+                ELSE 'date' END AS due_reason,
+           LEAST(next_service_date, km_due_date) - CURRENT_DATE AS days_left
+    FROM forecast
+    ORDER BY due_date NULLS LAST, id
+'''
+
+# Отчёт по загрузке: брони с этими статусами не считаются арендой
+NOT_RENTED_STATUSES = ('Отменено', 'Черновик', 'Вишлист')
+
+# Выручка брони делится пропорционально её пересечению с периодом; занятым считается день,
+# который бронь задевает хотя бы частично. Всё считается одним проходом по броням без разворота по дням
+UTILIZATION_QUERY = '''
+    WITH period AS (
+        SELECT %(date_from)s::date AS first_day, %(date_to)s::date AS last_day
+    ), overlapping AS (
+        SELECT b.id, b.vehicle_id, b.start_date, b.end_date, COALESCE(b.total_price, 0) AS total_price,
+               GREATEST(b.start_date, p.first_day::timestamp) AS part_start,
+               LEAST(b.end_date, (p.last_day + 1)::timestamp) AS part_end
+        FROM period p
+        JOIN bookings b ON tsrange(b.start_date, b.end_date, '[)') && tsrange(p.first_day, p.last_day + 1, '[)')
+        WHERE b.vehicle_id IS NOT NULL
+          AND b.status NOT IN %(not_rented)s
+    ), spans AS (
+        -- Занятые дни брони [first_busy, last_busy] и максимум last_busy у предыдущих броней машины
+        SELECT id, vehicle_id, first_busy, last_busy,
+               MAX(last_busy) OVER (
+                   PARTITION BY vehicle_id ORDER BY first_busy, last_busy, id
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ) AS prev_last_busy
+        FROM (
+            SELECT id, vehicle_id, part_start::date AS first_busy,
+                   (part_end - INTERVAL '1 microsecond')::date AS last_busy
+            FROM overlapping
+        ) days
+    ), islands AS (
+        -- Пересекающиеся брони склеиваются в непрерывные отрезки, чтобы день не считался дважды
+        SELECT vehicle_id, first_busy, last_busy,
+               COUNT(*) FILTER (WHERE prev_last_busy IS NULL OR first_busy > prev_last_busy) OVER (
+                   PARTITION BY vehicle_id ORDER BY first_busy, last_busy, id
+                   ROWS UNBOUNDED PRECEDING
+               ) AS island
+        FROM spans
+    ), busy AS (
+        SELECT vehicle_id, SUM(days) AS busy_days
+        FROM (
+            SELECT vehicle_id, MAX(last_busy) - MIN(first_busy) + 1 AS days
+            FROM islands
+            GROUP BY vehicle_id, island
+        ) merged
+        GROUP BY vehicle_id
+    ), revenue AS (
+        SELECT vehicle_id, COUNT(*) AS bookings_count,
+               SUM(total_price * EXTRACT(EPOCH FROM part_end - part_start)
+                   / NULLIF(EXTRACT(EPOCH FROM end_date - start_date), 0)) AS revenue
+        FROM overlapping
+        GROUP BY vehicle_id
+    )
+    SELECT f.id, f.model, f.license_plate,
+           p.last_day - p.first_day + 1 AS period_days,
+           COALESCE(bu.busy_days, 0)::int AS busy_days,
+           (p.last_day - p.first_day + 1 - COALESCE(bu.busy_days, 0))::int AS idle_days,
+           round(100.0 * COALESCE(bu.busy_days, 0) / (p.last_day - p.first_day + 1), 1)::float8 AS occupancy_pct,
+           COALESCE(r.bookings_count, 0)::int AS bookings_count,
+           round(COALESCE(r.revenue, 0), 2)::float8 AS revenue,
+           (COALESCE(f.rental_price_per_day, 0) * (p.last_day - p.first_day + 1))::float8 AS potential_revenue,
+           (COALESCE(f.sublease_cost, 0) * (p.last_day - p.first_day + 1))::float8 AS sublease_cost_total,
+           round(COALESCE(r.revenue, 0) - COALESCE(f.sublease_cost, 0) * (p.last_day - p.first_day + 1), 2)::float8 AS margin,
+           round(100 * (COALESCE(r.revenue, 0) - COALESCE(f.sublease_cost, 0) * (p.last_day - p.first_day + 1))
+                 / NULLIF(f.purchase_price, 0), 2)::float8 AS roi_pct
+    FROM fleet f
+    CROSS JOIN period p
+    LEFT JOIN busy bu ON bu.vehicle_id = f.id
+    LEFT JOIN revenue r ON r.vehicle_id = f.id
+    WHERE f.is_active = true
+    ORDER BY f.model, f.license_plate
+'''
+
+def handler(event: dict, context) -> dict:
+    """API для управления автопарком: маршрутизация запроса под замером времени"""
+    trace = start_trace(event)
+    response = compress_response(event, handle_request(event, context))
+    return finish_trace(trace, response)
 
-def handler(event, context):
-    print(f"Vehicles API called: {event.get('httpMethod', 'GET')}")
+def handle_request(event: dict, context) -> dict:
     method = event.get('httpMethod', 'GET') 
     
     if method == 'OPTIONS':
@@ -25,139 +597,125 @@ def handler(event, context):
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    if method == 'GET' and (event.get('queryStringParameters') or {}).get('action') == 'pool_stats':
+        return success_response({
+            'pool': get_pool_stats(),
+            'fleet_cache': get_fleet_cache_stats(),
+            'prepared': get_statement_stats()
+        })
+    
     conn = None
     try:
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur = conn.cursor()
+        
+        if method == 'GET' and (event.get('queryStringParameters') or {}).get('since'):
+            try:
+                since, after_id = parse_since(event['queryStringParameters'])
+            except (ValueError, TypeError) as e:
+                return error_response(400, f'Invalid since: {e}')
+            
+            changes = fetch_changes(cur, 'fleet', 'SELECT t.* FROM fleet t', since, after_id)
+            return success_response({'vehicles': changes.pop('rows'), **changes})
+        
+        elif method == 'GET' and (event.get('queryStringParameters') or {}).get('action') == 'maintenance_forecast':
+            query_params = event['queryStringParameters']
+            try:
+                window_days = int(query_params.get('window_days') or MAINTENANCE_RATE_WINDOW_DAYS)
+                within_days = int(query_params['within_days']) if query_params.get('within_days') else None
+            except ValueError:
+                return error_response(400, 'window_days and within_days must be integers')
+            
+            cur.execute(MAINTENANCE_FORECAST_QUERY, {'window_days': window_days})
+            rows = cur.fetchall()
+            if within_days is not None:
+                rows = [row for row in rows if row['days_left'] is not None and row['days_left'] <= within_days]
+            
+            return success_response({'vehicles': rows, 'total': len(rows), 'window_days': window_days})
+        
+        elif method == 'GET' and (event.get('queryStringParameters') or {}).get('action') == 'utilization':
+            query_params = event['queryStringParameters']
+            if not query_params.get('date_from') or not query_params.get('date_to'):
+                return error_response(400, 'date_from and date_to are required')
+            try:
+                date_from = date.fromisoformat(query_params['date_from'])
+                date_to = date.fromisoformat(query_params['date_to'])
+            except ValueError as e:
+                return error_response(400, f'Invalid date range: {e}')
+            if date_to < date_from:
+                return error_response(400, 'date_to must not be earlier than date_from')
+            
+            cur.execute(UTILIZATION_QUERY, {
+                'date_from': date_from,
+                'date_to': date_to,
+                'not_rented': NOT_RENTED_STATUSES
+            })
+            rows = cur.fetchall()
+            
+            revenue = sum(row['revenue'] for row in rows)
+            busy_days = sum(row['busy_days'] for row in rows)
+            fleet_days = sum(row['period_days'] for row in rows)
+            return success_response({
+                'vehicles': rows,
+                'totals': {
+                    'revenue': round(revenue, 2),
+                    'margin': round(sum(row['margin'] for row in rows), 2),
+                    'busy_days': busy_days,
+                    'idle_days': fleet_days - busy_days,
+                    'occupancy_pct': round(100.0 * busy_days / fleet_days, 1) if fleet_days else 0
+                }
+            })
         
-        if method == 'GET':
+        elif method == 'GET':
             vehicle_id = event.get('queryStringParameters', {}).get('id')
             
+            # ETag строится из текущей версии автопарка (один запрос по индексам), снимок кэша сверяется с ней:
+            # после записи на другом инстансе клиент не получит 304 со старыми данными
+            fleet = get_fleet(cur, get_version_token(cur, ['fleet']))
+            etag = make_etag(fleet['token'], vehicle_id)
+            if is_not_modified(event, etag):
+                return not_modified_response(etag)
+            
             if vehicle_id:
-                cur.execute('''
-                    SELECT id, branch_id, model, license_plate, vin, year, color, seats, category,
-                           status, current_location, insurance_expires, tech_inspection_expires,
-                           osago_number, kasko_number, last_service_date, next_service_date,
-                           last_service_km, next_service_km, current_km, purchase_price,
-                           rental_price_per_day, rental_price_per_km, sublease_cost, notes, is_active,
-                           created_at, updated_at
-                    FROM fleet
-                    WHERE id = %s
-                ''', (vehicle_id,))
+                VEHICLE_BY_ID.execute(cur, {'id': vehicle_id})
                 row = cur.fetchone()
                 
                 if not row:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                        'body': json.dumps({'error': 'Vehicle not found'}),
-                        'isBase64Encoded': False
-                    }
+                    return error_response(404, 'Vehicle not found')
                 
-                vehicle = dict(row)
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps(vehicle, default=str),
-                    'isBase64Encoded': False
-                }
+                return success_response(row, etag=etag)
             
             else:
-                cur.execute('''
-                    SELECT id, model, license_plate, status, current_location, next_service_date
-                    FROM fleet
-                    WHERE is_active = true
-                    ORDER BY model, license_plate
-                ''')
-                rows = cur.fetchall()
-                
-                vehicles = [dict(row) for row in rows]
+                vehicles = [
+                    {key: row[key] for key in ('id', 'model', 'license_plate', 'status', 'current_location', 'next_service_date')}
+                    for row in fleet['rows'] if row['is_active']
+                ]
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'vehicles': vehicles, 'total': len(vehicles)}, default=str),
-                    'isBase64Encoded': False
-                }
+                return success_response({'vehicles': vehicles, 'total': len(vehicles)}, etag=etag)
         
-        elif method == 'PUT':
+        # PUT и PATCH - частичное обновление: пишутся только переданные поля.
+        # Проверка версии по updated_at только у PATCH: PUT автосохранения шлёт всю карточку и остаётся last-write-wins
+        # PUT отвечает в прежнем формате (id и message) и дополнительно отдаёт обновлённую карточку в vehicle
+        elif method in ('PUT', 'PATCH'):
             data = json.loads(event.get('body', '{}'))
             vehicle_id = data.get('id')
             
             if not vehicle_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'error': 'Vehicle ID is required'}),
-                    'isBase64Encoded': False
-                }
-            
-            update_fields = []
-            params = []
+                return error_response(400, 'Vehicle ID is required')
             
-            field_mappings = {
-                'model': 'model', 'license_plate': 'license_plate', 'vin': 'vin',
-                'year': 'year', 'color': 'color', 'seats': 'seats', 'category': 'category',
-                'status': 'status', 'current_location': 'current_location',
-                'insurance_expires': 'insurance_expires', 'tech_inspection_expires': 'tech_inspection_expires',
-                'osago_number': 'osago_number', 'kasko_number': 'kasko_number',
-                'last_service_date': 'last_service_date', 'next_service_date': 'next_service_date',
-                'last_service_km': 'last_service_km', 'next_service_km': 'next_service_km',
-                'current_km': 'current_km', 'purchase_price': 'purchase_price',
-                'rental_price_per_day': 'rental_price_per_day', 'rental_price_per_km': 'rental_price_per_km',
-                'sublease_cost': 'sublease_cost', 'notes': 'notes'
-            }
-            
-            for json_key, db_field in field_mappings.items():
-                if json_key in data:
-                    update_fields.append(f'{db_field} = %s')
-                    params.append(data[json_key])
-            
-            if not update_fields:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'error': 'No fields to update'}),
-                    'isBase64Encoded': False
-                }
-            
-            update_fields.append('updated_at = CURRENT_TIMESTAMP')
-            params.append(vehicle_id)
-            
-            query = f'''
-                UPDATE fleet
-                SET {', '.join(update_fields)}
-                WHERE id = %s
-                RETURNING id
-            '''
-            
-            cur.execute(query, params)
-            updated_id = cur.fetchone()
-            
-            if not updated_id:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'error': 'Vehicle not found'}),
-                    'isBase64Encoded': False
-                }
-            
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'id': updated_id[0], 'message': 'Vehicle updated successfully'}),
-                'isBase64Encoded': False
-            }
+            response = update_record(conn, 'fleet', 'vehicle', vehicle_id, data, FLEET_UPDATABLE_FIELDS,
+                                     VEHICLE_DETAIL_COLUMNS, check_version=method == 'PATCH',
+                                     extra={'id': vehicle_id, 'message': 'Vehicle updated successfully'} if method == 'PUT' else None)
+            if response['statusCode'] == 200:
+                invalidate_fleet_cache()
+            return response
         
         elif method == 'POST':
             data = json.loads(event.get('body', '{}'))
@@ -165,14 +723,27 @@ def handler(event, context):
             action = event.get('queryStringParameters', {}).get('action')
             
             if action == 'handover':
+                # Передача и пробег автомобиля пишутся одним запросом в одной транзакции;
+                # current_km только растёт, опечатка в меньшую сторону его не откатывает
                 cur.execute('''
-                    INSERT INTO vehicle_handovers (
-                        handover_id, vehicle_id, booking_id, type, handover_date, handover_time,
-                        odometer, fuel_level, transponder_needed, transponder_number,
-                        deposit_amount, rental_amount, rental_payment_method, rental_receipt_url,
-                        damages, notes, custom_fields, created_by
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
+                    WITH h AS (
+                        INSERT INTO vehicle_handovers (
+                            handover_id, vehicle_id, booking_id, type, handover_date, handover_time,
+                            odometer, fuel_level, transponder_needed, transponder_number,
+                            deposit_amount, rental_amount, rental_payment_method, rental_receipt_url,
+                            damages, notes, custom_fields, created_by
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id, vehicle_id, odometer_km, fuel_percent
+                    ), f AS (
+                        UPDATE fleet
+                        SET current_km = h.odometer_km, updated_at = CURRENT_TIMESTAMP
+                        FROM h
+                        WHERE fleet.id = h.vehicle_id
+                          AND h.odometer_km > COALESCE(fleet.current_km, 0)
+                        RETURNING fleet.current_km
+                    )
+                    SELECT h.id, h.odometer_km, h.fuel_percent, (SELECT current_km FROM f) AS current_km
+                    FROM h
                 ''', (
                     data.get('handover_id'),
                     data.get('vehicle_id'),
@@ -194,44 +765,60 @@ def handler(event, context):
                     data.get('created_by')
                 ))
                 
-                handover_id = cur.fetchone()[0]
+                handover = cur.fetchone()
                 conn.commit()
+                if handover['current_km'] is not None:
+                    invalidate_fleet_cache()
                 
-                return {
-                    'statusCode': 201,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'id': handover_id, 'message': 'Handover recorded successfully'}),
-                    'isBase64Encoded': False
-                }
+                return success_response({
+                    'id': handover['id'],
+                    'odometer_km': handover['odometer_km'],
+                    'fuel_percent': handover['fuel_percent'],
+                    'message': 'Handover recorded successfully'
+                }, status_code=201)
             
             if action == 'handover_history':
-                vehicle_id = data.get('vehicle_id')
-                if not vehicle_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                        'body': json.dumps({'error': 'vehicle_id is required'}),
-                        'isBase64Encoded': False
-                    }
+                # vehicle_id - одна машина; vehicle_ids - несколько за один запрос;
+                # latest=N - только N последних передач каждой машины (без списка - по всему активному автопарку)
+                vehicle_ids = data.get('vehicle_ids')
+                if vehicle_ids is None and data.get('vehicle_id'):
+                    vehicle_ids = [data['vehicle_id']]
+                latest = data.get('latest')
+                if not vehicle_ids and not latest:
+                    return error_response(400, 'vehicle_id, vehicle_ids or latest is required')
+                try:
+                    vehicle_ids = [int(v) for v in vehicle_ids] if vehicle_ids else None
+                    latest = max(1, int(latest)) if latest else None
+                except (TypeError, ValueError):
+                    return error_response(400, 'vehicle_ids and latest must be integers')
                 
-                cur.execute('''
-                    SELECT id, handover_id, type, handover_date, handover_time,
-                           odometer, fuel_level, deposit_amount, rental_amount,
-                           rental_payment_method, transponder_number, notes, created_at
-                    FROM vehicle_handovers
-                    WHERE vehicle_id = %s
-                    ORDER BY handover_date DESC, handover_time DESC
-                ''', (vehicle_id,))
+                if latest:
+                    vehicles_sql = 'unnest(%(ids)s::int[]) AS v(id)' if vehicle_ids else 'fleet v'
+                    vehicles_where = '' if vehicle_ids else 'WHERE v.is_active = true'
+                    cur.execute(f'''
+                        SELECT h.*
+                        FROM {vehicles_sql}
+                        CROSS JOIN LATERAL (
+                            SELECT {HANDOVER_HISTORY_COLUMNS}
+                            FROM vehicle_handovers
+                            WHERE vehicle_id = v.id
+                            ORDER BY handover_date DESC, handover_time DESC
+                            LIMIT %(latest)s
+                        ) h
+                        {vehicles_where}
+                        ORDER BY h.vehicle_id, h.handover_date DESC, h.handover_time DESC
+                    ''', {'ids': vehicle_ids, 'latest': latest})
+                else:
+                    cur.execute(f'''
+                        SELECT {HANDOVER_HISTORY_COLUMNS}
+                        FROM vehicle_handovers
+                        WHERE vehicle_id = ANY(%s)
+                        ORDER BY vehicle_id, handover_date DESC, handover_time DESC
+                    ''', (vehicle_ids,))
                 
-                rows = cur.fetchall()
-                history = [dict(row) for row in rows]
+                history = cur.fetchall()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'handovers': history, 'total': len(history)}, default=str),
-                    'isBase64Encoded': False
-                }
+                return success_response({'handovers': history, 'total': len(history)})
             
             cur.execute('''
                 INSERT INTO fleet (
@@ -253,69 +840,133 @@ def handler(event, context):
                 data.get('rental_price_per_km'), data.get('sublease_cost', 0), data.get('notes'), True, datetime.now()
             ))
             
-            vehicle_id = cur.fetchone()[0]
-            conn.commit()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'id': vehicle_id, 'message': 'Vehicle created successfully'}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'PUT':
-            data = json.loads(event.get('body', '{}'))
-            vehicle_id = data.get('id')
-            
-            if not vehicle_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'error': 'Vehicle ID is required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute('''
-                UPDATE fleet
-                SET model = %s, license_plate = %s, status = %s, current_location = %s,
-                    current_km = %s, rental_price_per_day = %s, rental_price_per_km = %s,
-                    sublease_cost = %s, notes = %s, updated_at = %s
-                WHERE id = %s
-            ''', (
-                data.get('model'), data.get('license_plate'), data.get('status'),
-                data.get('current_location'), data.get('current_km'), 
-                data.get('rental_price_per_day'), data.get('rental_price_per_km'),
-                data.get('sublease_cost', 0), data.get('notes'),
-                datetime.now(), vehicle_id
-            ))
-            
+            vehicle_id = cur.fetchone()['id']
             conn.commit()
+            invalidate_fleet_cache()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'message': 'Vehicle updated successfully'}),
-                'isBase64Encoded': False
-            }
+            return success_response({'id': vehicle_id, 'message': 'Vehicle created successfully'}, status_code=201)
         
         else:
-            return {
-                'statusCode': 405,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
+            return error_response(405, 'Method not allowed')
     
     except Exception as e:
         import traceback
         print(f"ERROR: {str(e)}")
         print(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return error_response(500, str(e))
     finally:
         if conn:
-            conn.close()
\ No newline at end of file
+            release_db_connection(conn)
+
+def update_record(conn, table: str, key: str, record_id, data: dict, fields, returning: str,
+                  check_version: bool = True, extra: Optional[dict] = None) -> dict:
+    """Частичное обновление: пишутся только переданные поля.
+    При check_version и updated_at в теле запись меняется только при совпадении версии, иначе 409 с текущей записью.
+    extra - дополнительные поля успешного ответа (совместимость со старыми ответами)"""
+    assignments = [f'{field} = %s' for field in fields if field in data]
+    values = [data[field] for field in fields if field in data]
+    if not assignments:
+        return error_response(400, 'No fields to update')
+    
+    where = 'id = %s'
+    values.append(record_id)
+    if check_version and data.get('updated_at'):
+        where += ' AND updated_at = %s'
+        values.append(data['updated_at'])
+    
+    cur = conn.cursor()
+    cur.execute(f'''
+        UPDATE {table}
+        SET {', '.join(assignments)}, updated_at = CURRENT_TIMESTAMP
+        WHERE {where}
+        RETURNING {returning}
+    ''', values)
+    row = cur.fetchone()
+    if row:
+        conn.commit()
+        return success_response({**(extra or {}), key: row})
+    
+    conn.rollback()
+    cur.execute(f'SELECT {returning} FROM {table} WHERE id = %s', (record_id,))
+    current = cur.fetchone()
+    if not current:
+        return error_response(404, 'Record not found')
+    return error_response(409, 'Record was modified by someone else', {key: current})
+
+def get_version_token(cursor, tables: List[str]) -> str:
+    """Дешёвый токен версии таблиц: последнее изменение и последнее удаление (оба по индексам).
+    updated_at - время начала транзакции, и транзакция, закоммиченная позже более новой, MAX не сдвигает.
+    Поэтому, пока последнее изменение моложе SYNC_SAFETY_MARGIN_SECONDS (тот же запас, что у ?since=),
+    в токен добавляется текущее время: ETag меняется на каждом запросе и 304 не отдаётся"""
+    parts = [
+        expr
+        for table in tables
+        for expr in (f"(SELECT MAX({VERSION_COLUMNS.get(table, 'updated_at')}) FROM {table})",
+                     f"(SELECT MAX(deleted_at) FROM deleted_records WHERE table_name = '{table}')")
+    ]
+    columns = ', '.join(f'v{i}' for i in range(len(parts)))
+    name = 'version_token_' + '_'.join(tables)
+    statement = _statements.get(name) or PreparedStatement(name, f"""
+        SELECT concat_ws('|', {columns},
+                         CASE WHEN GREATEST({columns}) > LOCALTIMESTAMP - {SYNC_SAFETY_MARGIN_SECONDS} * INTERVAL '1 second'
+                              THEN clock_timestamp()::text END) AS token
+        FROM (SELECT {', '.join(f'{expr} AS v{i}' for i, expr in enumerate(parts))}) v
+    """)
+    statement.execute(cursor)
+    return cursor.fetchone()['token']
+
+def make_etag(*parts) -> str:
+    """Слабый ETag из версии данных и параметров запроса"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+def is_not_modified(event: dict, etag: str) -> bool:
+    """Совпадает ли If-None-Match клиента с текущим ETag"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    header = headers.get('if-none-match')
+    if not header:
+        return False
+    tags = [tag.strip().replace('W/', '', 1) for tag in header.split(',')]
+    return '*' in tags or etag.replace('W/', '', 1) in tags
+
+def not_modified_response(etag: str) -> dict:
+    """304 без тела: данные у клиента актуальны"""
+    return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+def success_response(data: dict, status_code: int = 200, etag: Optional[str] = None) -> dict:
+    """Успешный ответ"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*'
+    }
+    if etag:
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+        headers['Access-Control-Expose-Headers'] = 'ETag'
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': dumps(data),
+        'isBase64Encoded': False
+    }
+
+def error_response(status_code: int, message: str, details: Optional[dict] = None) -> dict:
+    """Ответ с ошибкой"""
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': dumps({'error': message, **(details or {})}),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,383 @@
+"""Нагрузочный бенчмарк функций bookings, clients и vehicles на одноразовой PostgreSQL
+
+Поднимает локальный кластер через initdb/pg_ctl (или берёт BENCH_DATABASE_URL),
+применяет db_migrations/V*.sql, заполняет базу реалистичными объёмами и вызывает
+handler(event, context) каждой функции, печатая p50/p95/p99 и пропускную способность.
+Дополнительно проверяет планы ключевых запросов через EXPLAIN: если список броней
+или клиентов перестал использовать индексы, бенчмарк завершается с кодом 1.
+Для крупных списков сравнивает ответы без сжатия, с gzip и brotli (байты и время)
+и уровни сжатия на теле самого большого из них.
+
+Запуск:
+    python benchmarks/handlers_bench.py                      # 200 авто, 50k клиентов, 500k броней
+    python benchmarks/handlers_bench.py --scale 0.1 -n 50    # быстрый прогон
+    BENCH_DATABASE_URL=postgresql://... python benchmarks/handlers_bench.py --reset
+"""
+
+import argparse
+import atexit
+import base64
+import contextlib
+import gzip
+import importlib.util
+import io
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from string import Template
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+MIGRATIONS = ROOT / 'db_migrations'
+SCHEMA = 't_p81623955_crm_system_creation'
+
+# Колонки, которые есть в рабочей базе, но были добавлены в обход db_migrations
+LEGACY_COLUMNS_SQL = """
+ALTER TABLE clients
+    ADD COLUMN IF NOT EXISTS telegram VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS whatsapp VARCHAR(50),
+    ADD COLUMN IF NOT EXISTS city VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS total_spent DECIMAL(12, 2) DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS orders_count INTEGER DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS rating DECIMAL(3, 1) DEFAULT 5.0,
+    ADD COLUMN IF NOT EXISTS source VARCHAR(50),
+    ADD COLUMN IF NOT EXISTS is_blacklist BOOLEAN DEFAULT false,
+    ADD COLUMN IF NOT EXISTS passport_series VARCHAR(10),
+    ADD COLUMN IF NOT EXISTS passport_number VARCHAR(20),
+    ADD COLUMN IF NOT EXISTS passport_issued_by TEXT,
+    ADD COLUMN IF NOT EXISTS passport_issued_date DATE;
+
+ALTER TABLE fleet
+    ADD COLUMN IF NOT EXISTS branch_id INTEGER,
+    ADD COLUMN IF NOT EXISTS seats INTEGER,
+    ADD COLUMN IF NOT EXISTS category VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS current_location VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS insurance_expires DATE,
+    ADD COLUMN IF NOT EXISTS tech_inspection_expires DATE,
+    ADD COLUMN IF NOT EXISTS osago_number VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS kasko_number VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS last_service_date DATE,
+    ADD COLUMN IF NOT EXISTS last_service_km INTEGER,
+    ADD COLUMN IF NOT EXISTS next_service_km INTEGER,
+    ADD COLUMN IF NOT EXISTS current_km INTEGER DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS purchase_price DECIMAL(12, 2),
+    ADD COLUMN IF NOT EXISTS rental_price_per_day DECIMAL(10, 2),
+    ADD COLUMN IF NOT EXISTS rental_price_per_km DECIMAL(10, 2),
+    ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT true;
+"""
+
+SEED_SQL = """
+INSERT INTO fleet (model, license_plate, year, status, is_active, category, seats,
+                   rental_price_per_day, rental_price_per_km, sublease_cost, purchase_price,
+                   current_km, last_service_km, next_service_km, next_service_date)
+SELECT (ARRAY['Hyundai Grand Starex', 'Kia Carnival', 'Toyota Camry', 'Mercedes V-Class', 'Skoda Octavia'])[1 + i % 5],
+       'А' || lpad(i::text, 4, '0') || 'ВС' || (10 + i % 90),
+       2015 + i % 10,
+       (ARRAY['Свободен', 'В аренде', 'На ТО'])[1 + i % 3],
+       true,
+       (ARRAY['Микроавтобус', 'Минивэн', 'Седан'])[1 + i % 3],
+       4 + i % 5,
+       3000 + (i % 20) * 250, 15 + i % 10, CASE WHEN i % 7 = 0 THEN 2500 ELSE 0 END, 2000000 + i * 10000,
+       50000 + i * 731 % 150000, 40000 + i * 731 % 150000, 55000 + i * 731 % 150000,
+       CURRENT_DATE + (i % 120)
+FROM generate_series(1, ${cars}) AS i;
+
+INSERT INTO clients (name, phone, email, city, created_at, updated_at, birth_date,
+                     passport_series, passport_number, driver_license_number, source)
+SELECT 'Клиент ' || (ARRAY['Иванов', 'Петрова', 'Сидоров', 'Кузнецова', 'Смирнов'])[1 + i % 5] || ' ' || i,
+       '+7 (9' || lpad((i % 100)::text, 2, '0') || ') ' || lpad((i % 1000)::text, 3, '0') || ' '
+           || lpad((i / 1000 % 100)::text, 2, '0') || ' ' || lpad((i % 97)::text, 2, '0'),
+       'client' || i || '@example.com',
+       (ARRAY['Москва', 'Краснодар', 'Санкт-Петербург'])[1 + i % 3],
+       now() - (i % 1000) * INTERVAL '1 day', now() - (i % 500) * INTERVAL '1 day',
+       DATE '1960-01-01' + (i % 15000),
+       lpad((i % 10000)::text, 4, '0'), lpad(i::text, 6, '0'), lpad((i * 7)::text, 10, '0'),
+       (ARRAY['manual', 'avito', 'telegram'])[1 + i % 3]
+FROM generate_series(1, ${clients}) AS i;
+
+INSERT INTO bookings (client_name, client_phone, vehicle_id, start_date, end_date, days, status,
+                      total_price, paid_amount, deposit_amount, services, payments,
+                      assigned_manager, created_at, updated_at)
+SELECT 'Клиент ' || (i % ${clients} + 1),
+       '+7 (9' || lpad((i % 100)::text, 2, '0') || ') ' || lpad((i % 1000)::text, 3, '0') || ' 00 00',
+       1 + i % ${cars},
+       s.start_date,
+       s.start_date + (1 + i % 14) * INTERVAL '1 day',
+       1 + i % 14,
+       (ARRAY['Бронь', 'В аренде', 'Завершено', 'Завершено', 'Отменено', 'Черновик'])[1 + i % 6],
+       5000 + (i % 50) * 1500, (i % 50) * 1000, 10000,
+       '[{"id": "rent", "name": "Аренда авто", "price": 40800, "adjustedPrice": 40800},
+         {"id": "roaming", "name": "роуминг", "price": 3000, "adjustedPrice": 3000}]'::jsonb,
+       '[{"date": "2026-01-07", "amount": 10000, "method": "QR-код", "type": "+"}]'::jsonb,
+       (ARRAY['marina', 'oleg', 'anna'])[1 + i % 3],
+       s.start_date - INTERVAL '3 days', s.start_date - INTERVAL '1 day'
+FROM generate_series(1, ${bookings}) AS i,
+     LATERAL (SELECT TIMESTAMP '2023-01-01' + (i::bigint * 7919 % (365 * 4 * 24)) * INTERVAL '1 hour' AS start_date) s;
+
+INSERT INTO vehicle_handovers (handover_id, vehicle_id, booking_id, type, handover_date, handover_time,
+                               odometer, fuel_level, deposit_amount, rental_amount)
+SELECT 'HO-' || v || '-' || n, v, NULL, (ARRAY['pickup', 'return'])[1 + n % 2],
+       DATE '2024-01-01' + n * 7, TIME '10:00' + (n % 8) * INTERVAL '1 hour',
+       (50000 + n * 850)::text, (ARRAY['Полный', '3/4', '1/2', '1/4'])[1 + n % 4], 10000, 6000
+FROM generate_series(1, ${cars}) AS v, generate_series(1, 20) AS n;
+"""
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_local_postgres() -> str:
+    """Одноразовый кластер во временном каталоге (нужны initdb и pg_ctl в PATH)"""
+    if not shutil.which('initdb') or not shutil.which('pg_ctl'):
+        sys.exit('initdb/pg_ctl не найдены: установите PostgreSQL или задайте BENCH_DATABASE_URL')
+    data_dir = tempfile.mkdtemp(prefix='crm-bench-pg-')
+    port = free_port()
+    subprocess.run(['initdb', '-D', data_dir, '-U', 'bench', '-A', 'trust', '-E', 'UTF8'],
+                   check=True, stdout=subprocess.DEVNULL)
+    subprocess.run(['pg_ctl', '-D', data_dir, '-l', os.path.join(data_dir, 'server.log'), '-w', 'start',
+                    '-o', f'-p {port} -k {data_dir} -c fsync=off -c synchronous_commit=off'],
+                   check=True, stdout=subprocess.DEVNULL)
+    atexit.register(lambda: (
+        subprocess.run(['pg_ctl', '-D', data_dir, '-m', 'immediate', 'stop'], stdout=subprocess.DEVNULL),
+        shutil.rmtree(data_dir, ignore_errors=True)
+    ))
+    return f'postgresql://bench@127.0.0.1:{port}/postgres'
+
+def prepare_database(dsn: str, reset: bool, volumes: dict) -> None:
+    """Схема из db_migrations и тестовые данные"""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM information_schema.schemata WHERE schema_name = %s", (SCHEMA,))
+    if cur.fetchone():
+        if not reset:
+            sys.exit(f'Схема {SCHEMA} уже существует; запустите с --reset, чтобы пересоздать её')
+        cur.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+    cur.execute(f'CREATE SCHEMA {SCHEMA}')
+    cur.execute(f'SET search_path TO {SCHEMA}, public')
+
+    for migration in sorted(MIGRATIONS.glob('V*.sql')):
+        cur.execute(migration.read_text(encoding='utf-8'))
+        if migration.name.startswith('V0001__'):
+            cur.execute(LEGACY_COLUMNS_SQL)
+
+    started = time.perf_counter()
+    cur.execute(Template(SEED_SQL).substitute(volumes))
+    cur.execute('ANALYZE')
+    print(f"Данные: {volumes['cars']} авто, {volumes['clients']} клиентов, {volumes['bookings']} броней "
+          f"за {time.perf_counter() - started:.1f} с")
+    conn.close()
+
+def load_handler(name: str):
+    """Загружает index.py функции как отдельный модуль"""
+    spec = importlib.util.spec_from_file_location(f'{name}_index', ROOT / 'backend' / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def scenarios(volumes: dict) -> list:
+    """(функция, название, event) для каждого замеряемого эндпоинта"""
+    month = {'date_from': '2025-03-01T00:00:00', 'date_to': '2025-04-01T00:00:00'}
+    return [
+        ('bookings', 'GET list page (limit=50)', {'httpMethod': 'GET', 'queryStringParameters': {'limit': '50'}}),
+        ('bookings', 'GET list month filter', {'httpMethod': 'GET', 'queryStringParameters': {**month, 'limit': '500'}}),
+        ('bookings', 'GET calendar projection', {'httpMethod': 'GET', 'queryStringParameters': {
+            **month, 'fields': 'start_date,end_date,vehicle_id,status'}}),
+        ('bookings', 'GET by id', {'httpMethod': 'GET', 'queryStringParameters': {'id': str(volumes['bookings'] // 2)}}),
+        ('bookings', 'GET availability month', {'httpMethod': 'GET', 'queryStringParameters': {
+            **month, 'action': 'availability'}}),
+        ('bookings', 'GET finance by month', {'httpMethod': 'GET', 'queryStringParameters': {
+            'action': 'finance_summary', 'group': 'month'}}),
+        ('bookings', 'GET finance by vehicle', {'httpMethod': 'GET', 'queryStringParameters': {
+            'action': 'finance_summary', 'group': 'vehicle', 'date_from': '2025-01-01', 'date_to': '2025-12-31'}}),
+        ('bookings', 'GET dashboard summary', {'httpMethod': 'GET', 'queryStringParameters': {'action': 'dashboard'}}),
+        ('bookings', 'POST create', {'httpMethod': 'POST', 'queryStringParameters': {}, 'body': json.dumps({
+            'client_name': 'Бенчмарк', 'client_phone': '+79990000000', 'status': 'Завершено',
+            'start_date': '2022-06-01T10:00:00', 'end_date': '2022-06-03T10:00:00', 'vehicle_id': 1,
+            'total_price': 12000, 'services': [{'id': 'rent', 'price': 12000}]})}),
+        ('clients', 'GET list (all)', {'httpMethod': 'GET', 'queryStringParameters': {}}),
+        ('clients', 'GET search by phone', {'httpMethod': 'GET', 'queryStringParameters': {
+            'action': 'search', 'q': '918'}}),
+        ('vehicles', 'GET list', {'httpMethod': 'GET', 'queryStringParameters': {}}),
+        ('vehicles', 'GET utilization year', {'httpMethod': 'GET', 'queryStringParameters': {
+            'action': 'utilization', 'date_from': '2025-01-01', 'date_to': '2025-12-31'}}),
+        ('vehicles', 'GET maintenance forecast', {'httpMethod': 'GET', 'queryStringParameters': {
+            'action': 'maintenance_forecast'}}),
+        ('vehicles', 'POST handover_history', {'httpMethod': 'POST', 'queryStringParameters': {
+            'action': 'handover_history'}, 'body': json.dumps({'vehicle_id': 1})}),
+        ('vehicles', 'POST latest handover, whole fleet', {'httpMethod': 'POST', 'queryStringParameters': {
+            'action': 'handover_history'}, 'body': json.dumps({'latest': 1})}),
+    ]
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def run_scenario(module, event: dict, iterations: int, warmup: int) -> dict:
+    """Последовательные вызовы handler; время в миллисекундах"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return measure_calls(module, event, iterations, warmup)
+
+def measure_calls(module, event: dict, iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        module.handler(dict(event), None)
+    samples = []
+    sizes = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        response = module.handler(dict(event), None)
+        samples.append((time.perf_counter() - call_started) * 1000)
+        if response['statusCode'] >= 400:
+            raise RuntimeError(f"HTTP {response['statusCode']}: {response['body'][:300]}")
+        sizes.append(wire_bytes(response))
+    elapsed = time.perf_counter() - started
+    return {
+        'p50': statistics.median(samples),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+        'rps': iterations / elapsed,
+        'bytes': int(statistics.mean(sizes))
+    }
+
+def wire_bytes(response: dict) -> int:
+    """Размер тела ответа после снятия base64 шлюзом"""
+    if response.get('isBase64Encoded'):
+        return len(base64.b64decode(response['body']))
+    return len(response['body'].encode('utf-8'))
+
+# Списки, на которых сравнивается сжатие ответов
+COMPRESSION_SCENARIOS = ('GET list page (limit=50)', 'GET list month filter', 'GET calendar projection',
+                         'GET list (all)', 'GET list')
+ACCEPT_ENCODINGS = ('identity', 'gzip', 'br')
+
+def compression_report(modules: dict, volumes: dict, iterations: int, warmup: int, only: str) -> None:
+    """Время и размер ответа списков при разных Accept-Encoding, затем уровни сжатия"""
+    print(f"\n{'сжатие':<40} {'encoding':>8} {'p50 ms':>8} {'bytes':>10} {'ratio':>7}")
+    largest = ''
+    for function, name, event in scenarios(volumes):
+        label = f'{function}: {name}'
+        if name not in COMPRESSION_SCENARIOS or (only and only not in label):
+            continue
+        module = modules[function]
+        baseline = None
+        for encoding in ACCEPT_ENCODINGS:
+            if encoding == 'br' and module.brotli is None:
+                continue
+            r = run_scenario(module, {**event, 'headers': {'Accept-Encoding': encoding}}, iterations, warmup)
+            baseline = baseline or r['bytes']
+            print(f"{label:<40} {encoding:>8} {r['p50']:8.2f} {r['bytes']:10d} {baseline / r['bytes']:7.1f}")
+        with contextlib.redirect_stdout(io.StringIO()):
+            body = module.handler(dict(event), None)['body']
+        if len(body) > len(largest):
+            largest = body
+    if largest:
+        compression_levels(largest.encode('utf-8'), modules['bookings'].brotli)
+
+def compression_levels(raw: bytes, brotli) -> None:
+    """Байты против CPU для уровней gzip и качества brotli на одном теле"""
+    print(f"\nУровни сжатия на теле {len(raw)} байт:")
+    codecs = [(f'gzip -{level}', lambda data, level=level: gzip.compress(data, compresslevel=level))
+              for level in (1, 4, 6, 9)]
+    if brotli is not None:
+        codecs += [(f'br q{quality}', lambda data, quality=quality: brotli.compress(data, quality=quality))
+                   for quality in (1, 4, 5, 9)]
+    for name, compress in codecs:
+        samples = []
+        for _ in range(5):
+            started = time.perf_counter()
+            size = len(compress(raw))
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"  {name:<10} {statistics.median(samples):8.2f} ms {size:10d} байт  x{len(raw) / size:.1f}")
+
+def plan_nodes(plan: dict) -> list:
+    """Плоский список узлов плана EXPLAIN (FORMAT JSON)"""
+    nodes = [plan]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+def check_plans(dsn: str) -> list:
+    """Запросы списков должны идти по индексам, а не полным сканированием.
+
+    Фильтры и проекции берутся из самих функций: после V0018 списки броней и клиентов
+    обходятся без EXTRACT(YEAR ...), и регрессия в этих запросах ловится здесь
+    """
+    bookings = load_handler('bookings')
+    clients = load_handler('clients')
+    range_where, range_params = bookings.build_bookings_filter({'date_from': '2025-03-01', 'date_to': '2025-03-08'})
+    page_where, page_params = bookings.build_bookings_filter({})
+    checks = [
+        ('bookings date range', f"SELECT b.id FROM bookings b {range_where}", range_params, 'bookings'),
+        ('bookings latest page', f"SELECT b.id FROM bookings b {page_where} "
+                                 "ORDER BY b.created_at DESC, b.id DESC LIMIT 50", page_params, 'bookings'),
+        ('clients latest page', clients.CLIENT_LIST.sql + " LIMIT 50", [], 'clients'),
+    ]
+    failures = []
+    conn = psycopg2.connect(dsn, options=f'-c search_path={SCHEMA}')
+    cur = conn.cursor()
+    for name, query, query_params, table in checks:
+        cur.execute('EXPLAIN (FORMAT JSON) ' + query, query_params)
+        nodes = plan_nodes(cur.fetchone()[0][0]['Plan'])
+        seq_scans = [n for n in nodes if n['Node Type'] == 'Seq Scan' and n.get('Relation Name') == table]
+        status = 'FAIL (Seq Scan)' if seq_scans else 'ok'
+        print(f"  EXPLAIN {name:<24} {status}: {', '.join(sorted({n['Node Type'] for n in nodes}))}")
+        if seq_scans:
+            failures.append(name)
+    conn.close()
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='множитель объёмов (1.0 = 200/50k/500k)')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--reset', action='store_true', help='пересоздать схему в BENCH_DATABASE_URL')
+    parser.add_argument('--only', help='подстрока названия сценария')
+    args = parser.parse_args()
+
+    volumes = {
+        'cars': max(1, int(200 * args.scale)),
+        'clients': max(1, int(50_000 * args.scale)),
+        'bookings': max(1, int(500_000 * args.scale)),
+    }
+    dsn = os.environ.get('BENCH_DATABASE_URL') or start_local_postgres()
+    prepare_database(dsn, args.reset, volumes)
+    os.environ['DATABASE_URL'] = dsn
+
+    modules = {name: load_handler(name) for name in ('bookings', 'clients', 'vehicles')}
+    errors = []
+    print(f"\n{'сценарий':<40} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'bytes':>10}")
+    for function, name, event in scenarios(volumes):
+        label = f'{function}: {name}'
+        if args.only and args.only not in label:
+            continue
+        try:
+            r = run_scenario(modules[function], event, args.iterations, args.warmup)
+        except RuntimeError as e:
+            errors.append(label)
+            print(f"{label:<40} ОШИБКА {e}")
+            continue
+        print(f"{label:<40} {r['p50']:8.2f} {r['p95']:8.2f} {r['p99']:8.2f} {r['rps']:8.1f} {r['bytes']:10d}")
+
+    compression_report(modules, volumes, args.iterations, args.warmup, args.only)
+
+    print('\nПланы запросов:')
+    failures = check_plans(dsn)
+    if failures:
+        print(f"\nРегрессия: полное сканирование в {', '.join(failures)}")
+    if failures or errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Бенчмарк сериализации списка броней: прежний json.dumps(default=str) против dumps() из backend/bookings
+
+Запуск: python benchmarks/serialization_bench.py [--rows 10000] [--repeat 5]
+"""
+
+import argparse
+import importlib.util
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from psycopg2.extras import RealDictRow
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def load_handler(name: str):
+    """Загружает index.py функции как модуль"""
+    spec = importlib.util.spec_from_file_location(f'{name}_index', ROOT / 'backend' / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_rows(count: int) -> list:
+    """Строки, похожие на результат SELECT b.* из bookings (RealDictRow, Decimal, datetime, JSONB)"""
+    rng = random.Random(42)
+    base = datetime(2024, 1, 1, 10, 0)
+    rows = []
+    for i in range(count):
+        start = base + timedelta(hours=rng.randint(0, 24 * 700))
+        row = RealDictRow()
+        row.update({
+            'id': i + 1,
+            'client_name': f'Клиент {i}',
+            'client_phone': f'+7 (918) {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}',
+            'vehicle_id': rng.randint(1, 200),
+            'vehicle_model': 'Hyundai Grand Starex',
+            'start_date': start,
+            'end_date': start + timedelta(days=rng.randint(1, 14)),
+            'days': rng.randint(1, 14),
+            'status': rng.choice(['Бронь', 'В аренде', 'Завершено', 'Отменено']),
+            'total_price': Decimal(rng.randint(5000, 90000)).quantize(Decimal('0.01')),
+            'paid_amount': Decimal(rng.randint(0, 5000)).quantize(Decimal('0.01')),
+            'deposit_amount': Decimal('10000.00'),
+            'rental_price_per_km': Decimal('19.43'),
+            'services': [
+                {'id': 'rent', 'name': 'Аренда авто', 'price': 40800, 'adjustedPrice': 40800},
+                {'id': 'roaming', 'name': 'роуминг', 'price': 3000, 'adjustedPrice': 3000}
+            ],
+            'payments': [{'date': '2026-01-07', 'amount': 10000, 'method': 'QR-код', 'type': '+'}],
+            'custom_fields': [],
+            'notes': 'Краснодар - Степанцминда - Краснодар',
+            'created_at': start - timedelta(days=3),
+            'updated_at': start - timedelta(days=1),
+        })
+        rows.append(row)
+    return rows
+
+def measure(fn, repeat: int) -> float:
+    """Лучшее время из repeat запусков, мс"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    bookings = load_handler('bookings')
+    rows = make_rows(args.rows)
+
+    baseline = measure(lambda: json.dumps({'bookings': [dict(r) for r in rows]}, default=str), args.repeat)
+    stdlib = measure(lambda: json.dumps({'bookings': rows}, default=bookings.json_default, ensure_ascii=False), args.repeat)
+    current = measure(lambda: bookings.dumps({'bookings': rows}), args.repeat)
+
+    backend = 'orjson' if bookings.orjson is not None else 'json (orjson не установлен)'
+    print(f'{args.rows} строк, лучшее из {args.repeat}')
+    print(f'  json.dumps(default=str) + dict(row): {baseline:8.1f} ms')
+    print(f'  json.dumps(json_default), без dict:  {stdlib:8.1f} ms')
+    print(f'  dumps() [{backend}]: {current:8.1f} ms  (x{baseline / current:.1f})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Общие помощники функций bookings, clients и vehicles должны совпадать во всех копиях
+
+Каждая функция деплоится отдельно, поэтому пул соединений, PreparedStatement, трассировка,
+сжатие, сериализация, update_record, экспорт и синхронизация скопированы в каждый index.py.
+Проверка сравнивает исходный код каждого верхнеуровневого определения, которое встречается
+больше чем в одной функции; различаться могут только имена из PER_FUNCTION.
+
+Запуск:
+    python -m unittest discover benchmarks
+"""
+
+import ast
+import unittest
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+FUNCTIONS = ('bookings', 'clients', 'vehicles')
+
+# Определения, которые у каждой функции свои
+PER_FUNCTION = {'FUNCTION_NAME', 'VERSION_COLUMNS', 'handler', 'handle_request'}
+
+def top_level_definitions(source: str) -> dict:
+    """Имя -> исходный код верхнеуровневых функций, классов и присваиваний модуля"""
+    definitions = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            name = node.name
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            name = node.target.id
+        else:
+            continue
+        definitions[name] = ast.get_source_segment(source, node)
+    return definitions
+
+class SharedHelpersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.definitions = {
+            function: top_level_definitions((BACKEND / function / 'index.py').read_text(encoding='utf-8'))
+            for function in FUNCTIONS
+        }
+
+    def test_copies_are_identical(self):
+        names = set().union(*self.definitions.values()) - PER_FUNCTION
+        for name in sorted(names):
+            copies = {function: defs[name] for function, defs in self.definitions.items() if name in defs}
+            if len(copies) < 2:
+                continue
+            with self.subTest(name=name):
+                reference_function, reference = next(iter(copies.items()))
+                for function, source in copies.items():
+                    self.assertEqual(source, reference, f'{name}: копия в {function} отличается от {reference_function}')
+
+    def test_core_helpers_present_everywhere(self):
+        core = {'PreparedStatement', 'get_db_connection', 'release_db_connection', 'start_trace', 'finish_trace',
+                'compress_response', 'dumps', 'json_default', 'success_response', 'error_response',
+                'get_version_token', 'make_etag', 'is_not_modified', 'parse_since', 'fetch_changes'}
+        for function, defs in self.definitions.items():
+            with self.subTest(function=function):
+                self.assertFalse(core - set(defs), f'{function}: нет {sorted(core - set(defs))}')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,2 @@
+-- Индекс для постраничной выдачи броней по курсору (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_bookings_created_at_id ON bookings(created_at DESC, id DESC);
@@ -0,0 +1,2 @@
+-- GiST-индекс по периоду брони для поиска пересечений (доступность автопарка, проверка двойных броней)
+CREATE INDEX IF NOT EXISTS idx_bookings_period ON bookings USING gist (tsrange(start_date, end_date, '[)'));
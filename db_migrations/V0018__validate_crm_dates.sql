@@ -0,0 +1,21 @@
+-- Очистка мусорных дат (год 2100+) и ограничения, чтобы они больше не попадали в базу.
+-- После этого списки клиентов и броней обходятся без EXTRACT(YEAR ...) и используют индексы.
+
+UPDATE clients SET birth_date = NULL WHERE birth_date >= '2100-01-01';
+UPDATE clients SET passport_issued_date = NULL WHERE passport_issued_date >= '2100-01-01';
+UPDATE clients SET driver_license_issued_date = NULL WHERE driver_license_issued_date >= '2100-01-01';
+UPDATE clients
+SET created_at = CASE WHEN updated_at < '2100-01-01' THEN updated_at ELSE CURRENT_TIMESTAMP END
+WHERE created_at >= '2100-01-01';
+
+ALTER TABLE clients ADD CONSTRAINT clients_created_at_sane CHECK (created_at < '2100-01-01');
+ALTER TABLE clients ADD CONSTRAINT clients_birth_date_sane CHECK (birth_date < '2100-01-01');
+ALTER TABLE clients ADD CONSTRAINT clients_passport_issued_date_sane CHECK (passport_issued_date < '2100-01-01');
+ALTER TABLE clients ADD CONSTRAINT clients_driver_license_issued_date_sane CHECK (driver_license_issued_date < '2100-01-01');
+
+-- У броней даты обязательные, поэтому старые строки не трогаем: ограничение действует
+-- только для новых и изменённых записей, а списки отсекают старый мусор условием по end_date
+-- (end_date >= start_date гарантирует valid_dates)
+ALTER TABLE bookings ADD CONSTRAINT bookings_end_date_sane CHECK (end_date < '2100-01-01') NOT VALID;
+
+CREATE INDEX IF NOT EXISTS idx_clients_created_at ON clients(created_at DESC);
@@ -0,0 +1,11 @@
+-- Серверный поиск клиентов: триграммы по имени и нормализованному телефону, точный поиск по документам
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Телефон только цифрами, ведущая 8 у российских номеров приводится к 7
+ALTER TABLE clients ADD COLUMN IF NOT EXISTS phone_digits VARCHAR(50)
+    GENERATED ALWAYS AS (regexp_replace(regexp_replace(phone, '\D', '', 'g'), '^8(\d{10})$', '7\1')) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_clients_name_trgm ON clients USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clients_phone_digits_trgm ON clients USING gin (phone_digits gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clients_passport_number ON clients(passport_number);
+CREATE INDEX IF NOT EXISTS idx_clients_driver_license_number ON clients(driver_license_number);
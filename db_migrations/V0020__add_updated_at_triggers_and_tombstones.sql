@@ -0,0 +1,46 @@
+-- Инкрементальная синхронизация (?since=): надёжный updated_at и журнал удалений
+
+UPDATE bookings SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+UPDATE clients SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+UPDATE fleet SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_bookings_updated_at BEFORE UPDATE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE TRIGGER trg_clients_updated_at BEFORE UPDATE ON clients
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE TRIGGER trg_fleet_updated_at BEFORE UPDATE ON fleet
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- Журнал удалённых записей, чтобы клиенты синхронизации узнавали об удалениях
+CREATE TABLE IF NOT EXISTS deleted_records (
+    id SERIAL PRIMARY KEY,
+    table_name VARCHAR(50) NOT NULL,
+    record_id INTEGER NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION record_deletion() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO deleted_records (table_name, record_id) VALUES (TG_TABLE_NAME, OLD.id);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_bookings_deleted AFTER DELETE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION record_deletion();
+CREATE TRIGGER trg_clients_deleted AFTER DELETE ON clients
+    FOR EACH ROW EXECUTE FUNCTION record_deletion();
+CREATE TRIGGER trg_fleet_deleted AFTER DELETE ON fleet
+    FOR EACH ROW EXECUTE FUNCTION record_deletion();
+
+CREATE INDEX IF NOT EXISTS idx_bookings_updated_at_id ON bookings(updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_clients_updated_at_id ON clients(updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_fleet_updated_at_id ON fleet(updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_deleted_records_table_time ON deleted_records(table_name, deleted_at);
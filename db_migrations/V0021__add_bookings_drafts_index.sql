@@ -0,0 +1,2 @@
+-- Частичный индекс для периодической очистки брошенных черновиков (DELETE ... WHERE status = 'Черновик' AND created_at < ...)
+CREATE INDEX IF NOT EXISTS idx_bookings_drafts_created_at ON bookings (created_at) WHERE status = 'Черновик';
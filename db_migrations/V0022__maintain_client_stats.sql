@@ -0,0 +1,124 @@
+-- Статистика клиента (заказы, оплачено, баланс, рейтинг) ведётся триггерами по броням, а не считается во фронтенде
+
+ALTER TABLE clients
+    ADD COLUMN IF NOT EXISTS total_spent DECIMAL(12, 2) DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS orders_count INTEGER DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS rating DECIMAL(3, 1) DEFAULT 5.0,
+    ADD COLUMN IF NOT EXISTS ratings_count INTEGER DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS ratings_sum INTEGER DEFAULT 0;
+
+-- Та же нормализация, что у clients.phone_digits (V0019)
+CREATE OR REPLACE FUNCTION normalize_phone(phone TEXT) RETURNS TEXT AS $$
+    SELECT regexp_replace(regexp_replace(phone, '\D', '', 'g'), '^8(\d{10})$', '7\1')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE INDEX IF NOT EXISTS idx_bookings_client_phone_digits ON bookings (normalize_phone(client_phone));
+CREATE INDEX IF NOT EXISTS idx_clients_phone_digits ON clients (phone_digits);
+
+-- Вклад одной брони в статистику клиента: sign = 1 добавляет, -1 вычитает.
+-- Отменённые брони, черновики и вишлист заказами не считаются
+CREATE OR REPLACE FUNCTION apply_booking_client_stats(b bookings, sign INTEGER) RETURNS void AS $$
+DECLARE
+    rated INTEGER := CASE WHEN b.client_rating IS NULL THEN 0 ELSE sign END;
+BEGIN
+    IF b.client_phone IS NULL OR b.status IN ('Отменено', 'Черновик', 'Вишлист') THEN
+        RETURN;
+    END IF;
+    UPDATE clients SET
+        orders_count = COALESCE(orders_count, 0) + sign,
+        total_spent = COALESCE(total_spent, 0) + sign * COALESCE(b.paid_amount, 0),
+        balance = COALESCE(balance, 0) + sign * (COALESCE(b.paid_amount, 0) - COALESCE(b.total_price, 0)),
+        ratings_count = COALESCE(ratings_count, 0) + rated,
+        ratings_sum = COALESCE(ratings_sum, 0) + rated * COALESCE(b.client_rating, 0),
+        rating = CASE WHEN COALESCE(ratings_count, 0) + rated > 0
+                      THEN round((COALESCE(ratings_sum, 0) + rated * COALESCE(b.client_rating, 0))::numeric
+                                 / (COALESCE(ratings_count, 0) + rated), 1)
+                      ELSE 5.0 END
+    WHERE phone_digits = normalize_phone(b.client_phone);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_booking_client_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND (OLD.client_phone, OLD.status, OLD.paid_amount, OLD.total_price, OLD.client_rating)
+            IS NOT DISTINCT FROM (NEW.client_phone, NEW.status, NEW.paid_amount, NEW.total_price, NEW.client_rating) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_booking_client_stats(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_booking_client_stats(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_bookings_client_stats AFTER INSERT OR UPDATE OR DELETE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION track_booking_client_stats();
+
+-- Новый клиент или смена телефона: статистика пересчитывается по уже существующим броням
+CREATE OR REPLACE FUNCTION refresh_client_stats() RETURNS trigger AS $$
+BEGIN
+    SELECT COUNT(*),
+           COALESCE(SUM(paid_amount), 0),
+           COALESCE(SUM(COALESCE(paid_amount, 0) - COALESCE(total_price, 0)), 0),
+           COUNT(client_rating),
+           COALESCE(SUM(client_rating), 0)
+    INTO NEW.orders_count, NEW.total_spent, NEW.balance, NEW.ratings_count, NEW.ratings_sum
+    FROM bookings
+    WHERE normalize_phone(client_phone) = normalize_phone(NEW.phone)
+      AND status NOT IN ('Отменено', 'Черновик', 'Вишлист');
+    NEW.rating := CASE WHEN NEW.ratings_count > 0
+                       THEN round(NEW.ratings_sum::numeric / NEW.ratings_count, 1)
+                       ELSE 5.0 END;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_clients_stats_insert BEFORE INSERT ON clients
+    FOR EACH ROW EXECUTE FUNCTION refresh_client_stats();
+CREATE TRIGGER trg_clients_stats_phone BEFORE UPDATE OF phone ON clients
+    FOR EACH ROW WHEN (OLD.phone IS DISTINCT FROM NEW.phone) EXECUTE FUNCTION refresh_client_stats();
+
+-- Полный пересчёт (разовая сверка): SELECT rebuild_client_stats(); возвращает число изменённых клиентов
+CREATE OR REPLACE FUNCTION rebuild_client_stats() RETURNS INTEGER AS $$
+    WITH stats AS (
+        SELECT normalize_phone(client_phone) AS phone_digits,
+               COUNT(*) AS orders_count,
+               COALESCE(SUM(paid_amount), 0) AS total_spent,
+               COALESCE(SUM(COALESCE(paid_amount, 0) - COALESCE(total_price, 0)), 0) AS balance,
+               COUNT(client_rating) AS ratings_count,
+               COALESCE(SUM(client_rating), 0) AS ratings_sum
+        FROM bookings
+        WHERE client_phone IS NOT NULL
+          AND status NOT IN ('Отменено', 'Черновик', 'Вишлист')
+        GROUP BY 1
+    ), fresh AS (
+        SELECT c.id,
+               COALESCE(s.orders_count, 0) AS orders_count,
+               COALESCE(s.total_spent, 0) AS total_spent,
+               COALESCE(s.balance, 0) AS balance,
+               COALESCE(s.ratings_count, 0) AS ratings_count,
+               COALESCE(s.ratings_sum, 0) AS ratings_sum,
+               CASE WHEN s.ratings_count > 0 THEN round(s.ratings_sum::numeric / s.ratings_count, 1) ELSE 5.0 END AS rating
+        FROM clients c
+        LEFT JOIN stats s ON s.phone_digits = c.phone_digits
+    ), updated AS (
+        UPDATE clients c SET
+            orders_count = f.orders_count,
+            total_spent = f.total_spent,
+            balance = f.balance,
+            ratings_count = f.ratings_count,
+            ratings_sum = f.ratings_sum,
+            rating = f.rating
+        FROM fresh f
+        WHERE c.id = f.id
+          AND (c.orders_count, c.total_spent, c.balance, c.ratings_count, c.ratings_sum, c.rating)
+              IS DISTINCT FROM (f.orders_count, f.total_spent, f.balance, f.ratings_count, f.ratings_sum, f.rating)
+        RETURNING c.id
+    )
+    SELECT COUNT(*)::INTEGER FROM updated;
+$$ LANGUAGE sql;
+
+SELECT rebuild_client_stats();
@@ -0,0 +1,130 @@
+-- Финансовая сводка: дневной агрегат по автомобилю и менеджеру, ведётся триггерами по броням и расходам.
+-- Отчёты по месяцам и годам читают этот агрегат вместо всех броней
+
+CREATE TABLE IF NOT EXISTS finance_daily (
+    day DATE NOT NULL,
+    vehicle_id INTEGER NOT NULL DEFAULT 0,
+    manager VARCHAR(100) NOT NULL DEFAULT '',
+    bookings_count INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    paid DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    expense DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, vehicle_id, manager)
+);
+
+-- Итоги дня без разрезов: помесячные и подневные отчёты читают по строке на день
+CREATE TABLE IF NOT EXISTS finance_daily_totals (
+    day DATE PRIMARY KEY,
+    bookings_count INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    paid DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    expense DECIMAL(14, 2) NOT NULL DEFAULT 0
+);
+
+-- Бронь относится к дню начала аренды; без автомобиля - vehicle_id 0, без менеджера - пустая строка.
+-- Отменённые брони, черновики, вишлист и брони с мусорными датами (см. V0018) в выручку не входят
+CREATE OR REPLACE FUNCTION apply_booking_finance(b bookings, sign INTEGER) RETURNS void AS $$
+BEGIN
+    IF b.start_date IS NULL OR b.start_date >= '2100-01-01' OR b.status IN ('Отменено', 'Черновик', 'Вишлист') THEN
+        RETURN;
+    END IF;
+    INSERT INTO finance_daily AS fd (day, vehicle_id, manager, bookings_count, revenue, paid)
+    VALUES (b.start_date::date, COALESCE(b.vehicle_id, 0), COALESCE(b.assigned_manager, ''),
+            sign, sign * COALESCE(b.total_price, 0), sign * COALESCE(b.paid_amount, 0))
+    ON CONFLICT (day, vehicle_id, manager) DO UPDATE SET
+        bookings_count = fd.bookings_count + EXCLUDED.bookings_count,
+        revenue = fd.revenue + EXCLUDED.revenue,
+        paid = fd.paid + EXCLUDED.paid;
+    INSERT INTO finance_daily_totals AS ft (day, bookings_count, revenue, paid)
+    VALUES (b.start_date::date, sign, sign * COALESCE(b.total_price, 0), sign * COALESCE(b.paid_amount, 0))
+    ON CONFLICT (day) DO UPDATE SET
+        bookings_count = ft.bookings_count + EXCLUDED.bookings_count,
+        revenue = ft.revenue + EXCLUDED.revenue,
+        paid = ft.paid + EXCLUDED.paid;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_booking_finance() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND (OLD.start_date, OLD.vehicle_id, OLD.assigned_manager, OLD.status, OLD.total_price, OLD.paid_amount)
+            IS NOT DISTINCT FROM (NEW.start_date, NEW.vehicle_id, NEW.assigned_manager, NEW.status, NEW.total_price, NEW.paid_amount) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_booking_finance(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_booking_finance(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_bookings_finance AFTER INSERT OR UPDATE OR DELETE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION track_booking_finance();
+
+-- Расходы из finance_operations (category = 'expense') не привязаны к автомобилю и менеджеру
+CREATE OR REPLACE FUNCTION apply_expense_finance(op finance_operations, sign INTEGER) RETURNS void AS $$
+BEGIN
+    IF op.category <> 'expense' THEN
+        RETURN;
+    END IF;
+    INSERT INTO finance_daily AS fd (day, expense)
+    VALUES (op.date::date, sign * op.amount)
+    ON CONFLICT (day, vehicle_id, manager) DO UPDATE SET expense = fd.expense + EXCLUDED.expense;
+    INSERT INTO finance_daily_totals AS ft (day, expense)
+    VALUES (op.date::date, sign * op.amount)
+    ON CONFLICT (day) DO UPDATE SET expense = ft.expense + EXCLUDED.expense;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_expense_finance() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_expense_finance(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_expense_finance(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_finance_operations_finance AFTER INSERT OR UPDATE OR DELETE ON finance_operations
+    FOR EACH ROW EXECUTE FUNCTION track_expense_finance();
+
+-- Полный пересчёт агрегатов: SELECT rebuild_finance_daily(); возвращает число строк finance_daily
+CREATE OR REPLACE FUNCTION rebuild_finance_daily() RETURNS INTEGER AS $$
+DECLARE
+    total INTEGER;
+BEGIN
+    LOCK TABLE finance_daily, finance_daily_totals IN EXCLUSIVE MODE;
+    DELETE FROM finance_daily;
+    DELETE FROM finance_daily_totals;
+    INSERT INTO finance_daily (day, vehicle_id, manager, bookings_count, revenue, paid, expense)
+    SELECT day, vehicle_id, manager, SUM(bookings_count), SUM(revenue), SUM(paid), SUM(expense)
+    FROM (
+        SELECT start_date::date AS day, COALESCE(vehicle_id, 0) AS vehicle_id, COALESCE(assigned_manager, '') AS manager,
+               COUNT(*) AS bookings_count, COALESCE(SUM(total_price), 0) AS revenue,
+               COALESCE(SUM(paid_amount), 0) AS paid, 0 AS expense
+        FROM bookings
+        WHERE start_date < '2100-01-01'
+          AND status NOT IN ('Отменено', 'Черновик', 'Вишлист')
+        GROUP BY 1, 2, 3
+        UNION ALL
+        SELECT date::date, 0, '', 0, 0, 0, SUM(amount)
+        FROM finance_operations
+        WHERE category = 'expense'
+        GROUP BY 1
+    ) parts
+    GROUP BY day, vehicle_id, manager;
+    GET DIAGNOSTICS total = ROW_COUNT;
+    INSERT INTO finance_daily_totals (day, bookings_count, revenue, paid, expense)
+    SELECT day, SUM(bookings_count), SUM(revenue), SUM(paid), SUM(expense)
+    FROM finance_daily
+    GROUP BY day;
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_finance_daily();
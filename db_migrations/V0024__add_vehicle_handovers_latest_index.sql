@@ -0,0 +1,3 @@
+-- Последние передачи каждой машины (LATERAL ... ORDER BY handover_date DESC, handover_time DESC LIMIT N) читаются по индексу
+CREATE INDEX IF NOT EXISTS idx_vehicle_handovers_vehicle_latest
+    ON vehicle_handovers (vehicle_id, handover_date DESC, handover_time DESC);
@@ -0,0 +1,35 @@
+-- Числовые показания передач: пробег в км и топливо в процентах разбираются из текстовых полей.
+-- Колонки вычисляемые, поэтому заполнены для старых строк и любых путей вставки
+
+-- Пробег: первое число после удаления пробелов ("45 000 км" -> 45000, "45000.5" -> 45000)
+ALTER TABLE vehicle_handovers ADD COLUMN IF NOT EXISTS odometer_km INTEGER
+    GENERATED ALWAYS AS (substring(replace(odometer, ' ', '') FROM '\d{1,9}')::integer) STORED;
+
+-- Топливо: "Полный" -> 100, "Пустой" -> 0, дробь "3/4" -> 75, число "60" или "60%" -> 60
+ALTER TABLE vehicle_handovers ADD COLUMN IF NOT EXISTS fuel_percent SMALLINT
+    GENERATED ALWAYS AS (
+        CASE
+            WHEN fuel_level ~ '^\s*([Пп]олн|[Ff]ull)' THEN 100
+            WHEN fuel_level ~ '^\s*([Пп]уст|[Ee]mpty)' THEN 0
+            WHEN fuel_level ~ '^\s*\d{1,3}\s*/\s*[1-9]\d{0,2}' THEN
+                LEAST(100, round(100.0 * substring(fuel_level FROM '^\s*(\d{1,3})')::integer
+                                 / substring(fuel_level FROM '/\s*([1-9]\d{0,2})')::integer))
+            WHEN fuel_level ~ '\d' THEN LEAST(100, substring(fuel_level FROM '\d{1,3}')::integer)
+        END
+    ) STORED;
+
+-- Темп пробега для прогноза ТО считается по недавним показаниям
+CREATE INDEX IF NOT EXISTS idx_vehicle_handovers_date_odometer
+    ON vehicle_handovers (handover_date, vehicle_id) INCLUDE (odometer_km);
+
+-- Текущий пробег автомобиля догоняет последние показания передач
+UPDATE fleet f
+SET current_km = h.max_km
+FROM (
+    SELECT vehicle_id, MAX(odometer_km) AS max_km
+    FROM vehicle_handovers
+    WHERE odometer_km IS NOT NULL
+    GROUP BY vehicle_id
+) h
+WHERE f.id = h.vehicle_id
+  AND h.max_km > COALESCE(f.current_km, 0);
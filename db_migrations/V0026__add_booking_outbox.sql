@@ -0,0 +1,23 @@
+-- Outbox событий броней: API пишет событие в той же транзакции, что и саму бронь,
+-- а внешние интеграции (календарь, мессенджеры) получают его из фонового обработчика workers/booking_outbox_worker.py
+
+CREATE TABLE IF NOT EXISTS booking_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    booking_id INTEGER NOT NULL,
+    event VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    processed_at TIMESTAMP
+);
+
+-- Очередь к доставке: только необработанные события, по времени следующей попытки
+CREATE INDEX IF NOT EXISTS idx_booking_outbox_pending
+    ON booking_outbox (next_attempt_at, id)
+    WHERE processed_at IS NULL;
+
+-- Очистка доставленных событий по давности
+CREATE INDEX IF NOT EXISTS idx_booking_outbox_processed_at
+    ON booking_outbox (processed_at)
+    WHERE processed_at IS NOT NULL;
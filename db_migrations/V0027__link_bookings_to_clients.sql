@@ -0,0 +1,65 @@
+-- Бронь ссылается на клиента по client_id. Колонки client_* в броне остаются снимком данных
+-- на момент оформления (для договора), список броней отдаёт их только по запросу (include=client)
+
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS client_id INTEGER REFERENCES clients(id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS idx_bookings_client_id ON bookings (client_id);
+
+-- Клиенты для телефонов, которые встречаются только в бронях: данные из последней брони
+INSERT INTO clients (name, phone, email, created_at)
+SELECT DISTINCT ON (normalize_phone(b.client_phone)) b.client_name, b.client_phone, b.client_email, b.created_at
+FROM bookings b
+WHERE normalize_phone(b.client_phone) <> ''
+  AND NOT EXISTS (SELECT 1 FROM clients c WHERE c.phone_digits = normalize_phone(b.client_phone))
+ORDER BY normalize_phone(b.client_phone), b.created_at DESC;
+
+-- При нескольких клиентах с одним телефоном бронь достаётся самому раннему
+UPDATE bookings b
+SET client_id = c.id
+FROM (
+    SELECT DISTINCT ON (phone_digits) id, phone_digits
+    FROM clients
+    WHERE phone_digits <> ''
+    ORDER BY phone_digits, id
+) c
+WHERE c.phone_digits = normalize_phone(b.client_phone)
+  AND b.client_id IS NULL;
+
+-- Брони из импорта и правки телефона связываются с клиентом автоматически;
+-- явно переданный client_id не перезаписывается
+CREATE OR REPLACE FUNCTION link_booking_client() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' AND NEW.client_id IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP = 'UPDATE' AND (NEW.client_phone IS NOT DISTINCT FROM OLD.client_phone
+                             OR NEW.client_id IS DISTINCT FROM OLD.client_id) THEN
+        RETURN NEW;
+    END IF;
+    NEW.client_id := (
+        SELECT id FROM clients
+        WHERE phone_digits = normalize_phone(NEW.client_phone)
+        ORDER BY id
+        LIMIT 1
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_bookings_link_client BEFORE INSERT OR UPDATE OF client_phone, client_id ON bookings
+    FOR EACH ROW EXECUTE FUNCTION link_booking_client();
+
+-- Клиент, заведённый после броней с его телефоном, подхватывает их
+CREATE OR REPLACE FUNCTION link_client_bookings() RETURNS trigger AS $$
+BEGIN
+    IF NEW.phone_digits IS NULL OR NEW.phone_digits = '' THEN
+        RETURN NULL;
+    END IF;
+    UPDATE bookings SET client_id = NEW.id
+    WHERE normalize_phone(client_phone) = NEW.phone_digits
+      AND client_id IS NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_clients_link_bookings AFTER INSERT ON clients
+    FOR EACH ROW EXECUTE FUNCTION link_client_bookings();
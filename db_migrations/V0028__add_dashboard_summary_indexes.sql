@@ -0,0 +1,8 @@
+-- Сводка дашборда считает текущие и будущие брони по статусам одним index-only проходом,
+-- не читая строки таблицы
+CREATE INDEX IF NOT EXISTS idx_bookings_end_date_status
+    ON bookings (end_date) INCLUDE (start_date, status, vehicle_id);
+
+-- Должников единицы на всю базу клиентов
+CREATE INDEX IF NOT EXISTS idx_clients_debtors
+    ON clients (id) WHERE balance < 0;
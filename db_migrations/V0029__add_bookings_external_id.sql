@@ -0,0 +1,7 @@
+-- Ключ брони во внешней системе: повторный импорт обновляет бронь по нему,
+-- а не по id, который может совпасть с чужой бронью
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS external_id VARCHAR(100);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_external_id
+    ON bookings (external_id)
+    WHERE external_id IS NOT NULL;
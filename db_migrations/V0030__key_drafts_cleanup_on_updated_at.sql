@@ -0,0 +1,4 @@
+-- Брошенным считается черновик, который давно не сохраняли, а не давно созданный:
+-- автосохранение мастера обновляет только updated_at
+DROP INDEX IF EXISTS idx_bookings_drafts_created_at;
+CREATE INDEX IF NOT EXISTS idx_bookings_drafts_updated_at ON bookings (updated_at) WHERE status = 'Черновик';
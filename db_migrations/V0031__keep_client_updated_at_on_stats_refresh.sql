@@ -0,0 +1,28 @@
+-- Пересчёт статистики клиента триггерами броней (V0022) больше не сдвигает clients.updated_at:
+-- по нему PATCH проверяет версию, и сохранение брони не должно давать 409 на правку клиента.
+-- Изменение статистики отмечается в stats_updated_at, синхронизация и ETag списка идут по changed_at
+
+ALTER TABLE clients ADD COLUMN IF NOT EXISTS stats_updated_at TIMESTAMP;
+ALTER TABLE clients ADD COLUMN IF NOT EXISTS changed_at TIMESTAMP
+    GENERATED ALWAYS AS (GREATEST(updated_at, stats_updated_at)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_clients_changed_at_id ON clients (changed_at, id);
+
+CREATE OR REPLACE FUNCTION set_client_updated_at() RETURNS trigger AS $$
+DECLARE
+    stats_columns TEXT[] := ARRAY['orders_count', 'total_spent', 'balance', 'ratings_count', 'ratings_sum', 'rating',
+                                  'stats_updated_at', 'updated_at', 'phone_digits', 'changed_at'];
+BEGIN
+    IF (to_jsonb(NEW) - stats_columns) = (to_jsonb(OLD) - stats_columns) THEN
+        NEW.updated_at := OLD.updated_at;
+        NEW.stats_updated_at := CURRENT_TIMESTAMP;
+    ELSE
+        NEW.updated_at := CURRENT_TIMESTAMP;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_clients_updated_at ON clients;
+CREATE TRIGGER trg_clients_updated_at BEFORE UPDATE ON clients
+    FOR EACH ROW EXECUTE FUNCTION set_client_updated_at();
@@ -0,0 +1,5 @@
+-- Обработчик outbox забирает события брони по порядку: проверка «нет ли более старого
+-- недоставленного события этой брони» и выборка всех её событий идут по этому индексу
+CREATE INDEX IF NOT EXISTS idx_booking_outbox_pending_booking
+    ON booking_outbox (booking_id, id)
+    WHERE processed_at IS NULL;
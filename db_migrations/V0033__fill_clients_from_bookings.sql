@@ -0,0 +1,31 @@
+-- Клиенты, заведённые бэкфиллом V0027 (и прежним BOOKING_CREATE), получили только имя, телефон и email.
+-- Недостающие паспортные данные, права, дата рождения и адрес берутся из последней брони клиента
+-- (черновики и вишлист - только если других броней нет); заполненные поля клиента не перезаписываются
+UPDATE clients c
+SET email = COALESCE(NULLIF(c.email, ''), NULLIF(b.client_email, '')),
+    birth_date = COALESCE(c.birth_date, b.client_birth_date),
+    passport_series = COALESCE(NULLIF(c.passport_series, ''), NULLIF(b.client_passport_series, '')),
+    passport_number = COALESCE(NULLIF(c.passport_number, ''), NULLIF(b.client_passport_number, '')),
+    passport_issued_by = COALESCE(NULLIF(c.passport_issued_by, ''), NULLIF(b.client_passport_issued_by, '')),
+    passport_issued_date = COALESCE(c.passport_issued_date, b.client_passport_issued_date),
+    address = COALESCE(NULLIF(c.address, ''), NULLIF(b.client_passport_registration, '')),
+    driver_license_series = COALESCE(NULLIF(c.driver_license_series, ''), NULLIF(b.client_driver_license_series, '')),
+    driver_license_number = COALESCE(NULLIF(c.driver_license_number, ''), NULLIF(b.client_driver_license_number, '')),
+    driver_license_issued_date = COALESCE(c.driver_license_issued_date, b.client_driver_license_issued_date)
+FROM (
+    SELECT DISTINCT ON (client_id) *
+    FROM bookings
+    WHERE client_id IS NOT NULL
+    ORDER BY client_id, status IN ('Черновик', 'Вишлист', 'Отменено'), created_at DESC
+) b
+WHERE b.client_id = c.id
+  AND ((NULLIF(c.email, '') IS NULL AND NULLIF(b.client_email, '') IS NOT NULL)
+       OR (c.birth_date IS NULL AND b.client_birth_date IS NOT NULL)
+       OR (NULLIF(c.passport_series, '') IS NULL AND NULLIF(b.client_passport_series, '') IS NOT NULL)
+       OR (NULLIF(c.passport_number, '') IS NULL AND NULLIF(b.client_passport_number, '') IS NOT NULL)
+       OR (NULLIF(c.passport_issued_by, '') IS NULL AND NULLIF(b.client_passport_issued_by, '') IS NOT NULL)
+       OR (c.passport_issued_date IS NULL AND b.client_passport_issued_date IS NOT NULL)
+       OR (NULLIF(c.address, '') IS NULL AND NULLIF(b.client_passport_registration, '') IS NOT NULL)
+       OR (NULLIF(c.driver_license_series, '') IS NULL AND NULLIF(b.client_driver_license_series, '') IS NOT NULL)
+       OR (NULLIF(c.driver_license_number, '') IS NULL AND NULLIF(b.client_driver_license_number, '') IS NOT NULL)
+       OR (c.driver_license_issued_date IS NULL AND b.client_driver_license_issued_date IS NOT NULL));
@@ -0,0 +1,49 @@
+-- Пробег из V0025 убирал только обычные пробелы: "45,000", "45.000 км" и "45 000" с неразрывным
+-- пробелом разбирались как 45 и портили темп пробега в прогнозе ТО.
+-- Разделитель (пробел, неразрывный пробел, запятая или точка) считается разделителем тысяч, только если
+-- за ним ровно три цифры; иначе это дробная часть и она отбрасывается ("45000.5" -> 45000, "45,000" -> 45000)
+CREATE OR REPLACE FUNCTION parse_odometer_km(odometer TEXT) RETURNS INTEGER AS $$
+    SELECT substring(
+        regexp_replace(substring(odometer FROM '\d{1,3}(?:[\s\u00a0.,]\d{3}(?!\d))+|\d+'), '\D', '', 'g')
+        FROM '^\d{1,9}'
+    )::integer
+$$ LANGUAGE sql IMMUTABLE;
+
+DO $$
+DECLARE
+    sample RECORD;
+BEGIN
+    FOR sample IN
+        SELECT * FROM (VALUES
+            ('45000', 45000), ('45 000 км', 45000), (E'45\u00a0000', 45000), (E'1\u00a0234\u00a0567 км', 1234567),
+            ('45,000', 45000), ('45.000 км', 45000), ('45000.5', 45000), ('45000,5', 45000),
+            ('123,4567', 123), ('Пробег: 98 765', 98765), ('нет данных', NULL)
+        ) AS s(odometer, km)
+    LOOP
+        IF parse_odometer_km(sample.odometer) IS DISTINCT FROM sample.km THEN
+            RAISE EXCEPTION 'parse_odometer_km(%) = %, expected %',
+                sample.odometer, parse_odometer_km(sample.odometer), sample.km;
+        END IF;
+    END LOOP;
+END $$;
+
+-- Выражение вычисляемой колонки не меняется на месте (до PostgreSQL 17), поэтому колонка пересоздаётся
+DROP INDEX IF EXISTS idx_vehicle_handovers_date_odometer;
+ALTER TABLE vehicle_handovers DROP COLUMN IF EXISTS odometer_km;
+ALTER TABLE vehicle_handovers ADD COLUMN odometer_km INTEGER
+    GENERATED ALWAYS AS (parse_odometer_km(odometer)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_vehicle_handovers_date_odometer
+    ON vehicle_handovers (handover_date, vehicle_id) INCLUDE (odometer_km);
+
+-- Текущий пробег догоняет исправленные показания (только в большую сторону, как в V0025)
+UPDATE fleet f
+SET current_km = h.max_km
+FROM (
+    SELECT vehicle_id, MAX(odometer_km) AS max_km
+    FROM vehicle_handovers
+    WHERE odometer_km IS NOT NULL
+    GROUP BY vehicle_id
+) h
+WHERE f.id = h.vehicle_id
+  AND h.max_km > COALESCE(f.current_km, 0);
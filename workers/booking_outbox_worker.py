@@ -0,0 +1,340 @@
+"""Фоновая доставка событий броней из booking_outbox во внешние интеграции
+
+API броней пишет событие (created / updated / cancelled / deleted) в booking_outbox в той же транзакции,
+что и саму бронь (см. V0026), и не ждёт внешних сервисов. Этот обработчик забирает события
+пачками, склеивает несколько событий одной брони в одно, отправляет в приёмник с текущим
+состоянием брони и при ошибке откладывает повтор с экспоненциальной задержкой.
+Несколько экземпляров можно запускать параллельно: события забираются через SKIP LOCKED.
+События одной брони доставляются по порядку: пока старое событие ждёт повтора,
+более новые события этой брони не забираются.
+
+Запуск:
+    DATABASE_URL=postgresql://... python workers/booking_outbox_worker.py --sink log
+    DATABASE_URL=postgresql://... python workers/booking_outbox_worker.py --sink webhook --url https://...
+    DATABASE_URL=postgresql://... python workers/booking_outbox_worker.py --sink fake --once
+"""
+
+import abc
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import urllib.request
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+SCHEMA = 't_p81623955_crm_system_creation'
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '2'))
+OUTBOX_CONCURRENCY = int(os.environ.get('OUTBOX_CONCURRENCY', '8'))
+
+# Повторы: задержка BACKOFF_BASE * 2^attempts (не больше BACKOFF_MAX) с разбросом,
+# после MAX_ATTEMPTS событие остаётся в таблице с last_error и больше не забирается
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', '5'))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', '3600'))
+
+# Забранные события скрыты от других обработчиков на время аренды; если процесс упал, они вернутся в очередь
+OUTBOX_LEASE_SECONDS = 300
+
+# Доставленные события хранятся неделю, очистка не чаще раза в час
+OUTBOX_RETENTION = '7 days'
+OUTBOX_CLEANUP_INTERVAL = 3600
+
+# Забирается старейшее ожидающее событие брони (если его время пришло) вместе со всеми более новыми
+# событиями той же брони: более новое событие не может обогнать старое, ждущее повтора или занятое
+# другим обработчиком. Исчерпавшие попытки события очередь брони не держат
+CLAIM_QUERY = """
+    WITH heads AS (
+        SELECT o.booking_id FROM booking_outbox o
+        WHERE o.processed_at IS NULL
+          AND o.next_attempt_at <= LOCALTIMESTAMP
+          AND o.attempts < %(max_attempts)s
+          AND NOT EXISTS (
+              SELECT 1 FROM booking_outbox older
+              WHERE older.booking_id = o.booking_id
+                AND older.id < o.id
+                AND older.processed_at IS NULL
+                AND older.attempts < %(max_attempts)s
+          )
+        ORDER BY o.next_attempt_at, o.id
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ), picked AS (
+        SELECT o.id FROM booking_outbox o
+        JOIN heads h ON h.booking_id = o.booking_id
+        WHERE o.processed_at IS NULL
+          AND o.attempts < %(max_attempts)s
+        FOR UPDATE OF o SKIP LOCKED
+    )
+    UPDATE booking_outbox o
+    SET next_attempt_at = LOCALTIMESTAMP + %(lease)s * INTERVAL '1 second'
+    FROM picked
+    WHERE o.id = picked.id
+    RETURNING o.id, o.booking_id, o.event, o.attempts
+"""
+
+BOOKINGS_QUERY = """
+    SELECT b.*, f.model AS vehicle_model_full, f.license_plate AS vehicle_plate_full
+    FROM bookings b
+    LEFT JOIN fleet f ON b.vehicle_id = f.id
+    WHERE b.id = ANY(%s)
+"""
+
+def json_default(value):
+    """Типы из psycopg2, которых нет в JSON: Decimal, date/datetime/time и прочее"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def coalesce_events(rows: List[dict]) -> List[dict]:
+    """Склеивает события одной брони: приёмник получает одно событие с текущим состоянием.
+
+    Итоговый тип - последнее событие, но правки после created остаются created:
+    приёмник эту бронь ещё не видел.
+    """
+    groups: Dict[int, dict] = {}
+    for row in sorted(rows, key=lambda r: r['id']):
+        group = groups.setdefault(row['booking_id'], {
+            'booking_id': row['booking_id'],
+            'event': row['event'],
+            'outbox_ids': [],
+            'attempts': 0
+        })
+        if not (group['event'] == 'created' and row['event'] == 'updated'):
+            group['event'] = row['event']
+        group['outbox_ids'].append(row['id'])
+        group['attempts'] = max(group['attempts'], row['attempts'])
+    return list(groups.values())
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(OUTBOX_BACKOFF_BASE * 2 ** attempts, OUTBOX_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+class Sink(abc.ABC):
+    """Приёмник событий: send получает событие с ключами booking_id, event и booking (None, если бронь удалена)"""
+
+    name = 'base'
+
+    @abc.abstractmethod
+    async def send(self, event: dict) -> None:
+        """Доставляет событие; исключение означает ошибку и повтор позже"""
+
+    async def close(self) -> None:
+        pass
+
+class LogSink(Sink):
+    """Печатает события в stdout - для отладки и локального запуска"""
+
+    name = 'log'
+
+    async def send(self, event: dict) -> None:
+        print(json.dumps(event, default=json_default, ensure_ascii=False))
+
+class FakeSink(Sink):
+    """Приёмник для проверок: копит события в памяти и умеет имитировать сбои"""
+
+    name = 'fake'
+
+    def __init__(self, fail_times: int = 0, delay: float = 0.0):
+        self.delivered: List[dict] = []
+        self.failures = 0
+        self.fail_times = fail_times
+        self.delay = delay
+
+    async def send(self, event: dict) -> None:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures < self.fail_times:
+            self.failures += 1
+            raise RuntimeError(f'fake failure {self.failures}/{self.fail_times}')
+        self.delivered.append(event)
+
+class WebhookSink(Sink):
+    """POST события JSON-ом на URL интеграции; любой ответ кроме 2xx - ошибка и повтор"""
+
+    name = 'webhook'
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    async def send(self, event: dict) -> None:
+        body = json.dumps(event, default=json_default, ensure_ascii=False).encode('utf-8')
+        await asyncio.to_thread(self._post, body)
+
+    def _post(self, body: bytes) -> None:
+        request = urllib.request.Request(
+            self.url, data=body, method='POST', headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if not 200 <= response.status < 300:
+                raise RuntimeError(f'HTTP {response.status}')
+
+SINKS = {'log': LogSink, 'fake': FakeSink, 'webhook': WebhookSink}
+
+class OutboxWorker:
+    """Цикл доставки: забрать пачку, склеить, отправить параллельно, отметить результат.
+
+    Запросы к базе идут через одно соединение psycopg2 в отдельном потоке (asyncio.to_thread),
+    поэтому ожидание приёмников и базы не блокирует цикл событий.
+    """
+
+    def __init__(self, dsn: str, sink: Sink, batch_size: int = OUTBOX_BATCH_SIZE,
+                 concurrency: int = OUTBOX_CONCURRENCY, schema: str = SCHEMA):
+        self.dsn = dsn
+        self.schema = schema
+        self.sink = sink
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.conn = None
+        self.last_cleanup = 0.0
+        self.stats = {'claimed': 0, 'delivered': 0, 'coalesced': 0, 'failed': 0}
+
+    def _connect(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor, options=f'-c search_path={self.schema}')
+        return self.conn
+
+    def _claim(self) -> List[dict]:
+        conn = self._connect()
+        with conn.cursor() as cursor:
+            cursor.execute(CLAIM_QUERY, {
+                'max_attempts': OUTBOX_MAX_ATTEMPTS,
+                'batch_size': self.batch_size,
+                'lease': OUTBOX_LEASE_SECONDS
+            })
+            rows = cursor.fetchall()
+            events = coalesce_events(rows)
+            bookings = {}
+            if events:
+                cursor.execute(BOOKINGS_QUERY, ([e['booking_id'] for e in events],))
+                bookings = {row['id']: row for row in cursor.fetchall()}
+        conn.commit()
+        for event in events:
+            event['booking'] = bookings.get(event['booking_id'])
+        self.stats['claimed'] += len(rows)
+        self.stats['coalesced'] += len(rows) - len(events)
+        return events
+
+    def _finish(self, delivered: List[int], failed: List[tuple]) -> None:
+        conn = self._connect()
+        with conn.cursor() as cursor:
+            if delivered:
+                cursor.execute(
+                    "UPDATE booking_outbox SET processed_at = LOCALTIMESTAMP, last_error = NULL WHERE id = ANY(%s)",
+                    (delivered,)
+                )
+            for ids, attempts, error in failed:
+                cursor.execute("""
+                    UPDATE booking_outbox
+                    SET attempts = attempts + 1,
+                        last_error = %s,
+                        next_attempt_at = LOCALTIMESTAMP + %s * INTERVAL '1 second'
+                    WHERE id = ANY(%s)
+                """, (error, backoff_seconds(attempts), ids))
+            if time.monotonic() - self.last_cleanup > OUTBOX_CLEANUP_INTERVAL:
+                cursor.execute(
+                    f"DELETE FROM booking_outbox WHERE processed_at < LOCALTIMESTAMP - INTERVAL '{OUTBOX_RETENTION}'"
+                )
+                self.last_cleanup = time.monotonic()
+        conn.commit()
+
+    async def _deliver(self, event: dict) -> Optional[str]:
+        """Отправка одного склеенного события; возвращает текст ошибки или None"""
+        payload = {
+            'booking_id': event['booking_id'],
+            'event': event['event'],
+            'booking': event['booking']
+        }
+        async with self.semaphore:
+            try:
+                await self.sink.send(payload)
+                return None
+            except Exception as e:
+                return f'{type(e).__name__}: {e}'
+
+    async def run_once(self) -> int:
+        """Одна пачка; возвращает число забранных событий (0 - очередь пуста)"""
+        events = await asyncio.to_thread(self._claim)
+        if not events:
+            return 0
+        errors = await asyncio.gather(*(self._deliver(event) for event in events))
+        delivered = []
+        failed = []
+        for event, error in zip(events, errors):
+            if error is None:
+                delivered.extend(event['outbox_ids'])
+            else:
+                failed.append((event['outbox_ids'], event['attempts'], error))
+        await asyncio.to_thread(self._finish, delivered, failed)
+        self.stats['delivered'] += len(events) - len(failed)
+        self.stats['failed'] += len(failed)
+        return sum(len(event['outbox_ids']) for event in events)
+
+    async def run(self, poll_interval: float = OUTBOX_POLL_INTERVAL, once: bool = False) -> None:
+        """Разбирает очередь; пока события есть, пачки идут без пауз, иначе ожидание poll_interval"""
+        try:
+            while True:
+                try:
+                    claimed = await self.run_once()
+                except psycopg2.Error as e:
+                    print(json.dumps({'event': 'outbox_error', 'error': str(e)}, ensure_ascii=False))
+                    if self.conn is not None and not self.conn.closed:
+                        self.conn.close()
+                    self.conn = None
+                    claimed = 0
+                if once and claimed == 0:
+                    return
+                if claimed == 0:
+                    await asyncio.sleep(poll_interval)
+        finally:
+            await self.sink.close()
+            if self.conn is not None and not self.conn.closed:
+                self.conn.close()
+
+def build_sink(args) -> Sink:
+    if args.sink == 'webhook':
+        if not args.url:
+            raise SystemExit('--url is required for the webhook sink')
+        return WebhookSink(args.url)
+    if args.sink == 'fake':
+        return FakeSink(fail_times=args.fake_failures)
+    return SINKS[args.sink]()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sink', choices=sorted(SINKS), default='log')
+    parser.add_argument('--url', help='адрес для приёмника webhook')
+    parser.add_argument('--once', action='store_true', help='разобрать очередь и выйти')
+    parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE)
+    parser.add_argument('--fake-failures', type=int, default=0, help='сколько первых отправок fake должен провалить')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not set')
+
+    sink = build_sink(args)
+    worker = OutboxWorker(dsn, sink, batch_size=args.batch_size)
+    started = datetime.now()
+    try:
+        asyncio.run(worker.run(once=args.once))
+    except KeyboardInterrupt:
+        pass
+    summary = {'event': 'outbox_worker_stopped', 'sink': sink.name, 'started_at': started, **worker.stats}
+    if isinstance(sink, FakeSink):
+        summary['fake_delivered'] = len(sink.delivered)
+    print(json.dumps(summary, default=json_default, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Проверки обработчика outbox: склейка событий, повторы с задержкой, предел попыток и порядок по броне
+
+Склейка и задержки проверяются без базы. Доставка идёт через FakeSink в одноразовой схеме
+PostgreSQL из OUTBOX_TEST_DATABASE_URL; без неё эти проверки пропускаются.
+
+Запуск:
+    OUTBOX_TEST_DATABASE_URL=postgresql://... python -m unittest discover workers
+"""
+
+import os
+import unittest
+from pathlib import Path
+
+import psycopg2
+
+import booking_outbox_worker as outbox
+from booking_outbox_worker import FakeSink, OutboxWorker, Sink, backoff_seconds, coalesce_events
+
+MIGRATIONS = Path(__file__).resolve().parent.parent / 'db_migrations'
+TEST_DSN = os.environ.get('OUTBOX_TEST_DATABASE_URL')
+TEST_SCHEMA = f'outbox_test_{os.getpid()}'
+
+SCHEMA_SQL = """
+CREATE TABLE fleet (id SERIAL PRIMARY KEY, model VARCHAR(255), license_plate VARCHAR(50));
+CREATE TABLE bookings (id SERIAL PRIMARY KEY, vehicle_id INTEGER REFERENCES fleet(id), status VARCHAR(50));
+"""
+
+def outbox_row(row_id: int, booking_id: int, event: str, attempts: int = 0) -> dict:
+    return {'id': row_id, 'booking_id': booking_id, 'event': event, 'attempts': attempts}
+
+class CoalesceEventsTest(unittest.TestCase):
+
+    def test_updates_after_created_stay_created(self):
+        events = coalesce_events([outbox_row(2, 7, 'updated'), outbox_row(1, 7, 'created'), outbox_row(3, 7, 'updated')])
+        self.assertEqual(events, [{'booking_id': 7, 'event': 'created', 'outbox_ids': [1, 2, 3], 'attempts': 0}])
+
+    def test_last_event_wins_otherwise(self):
+        events = coalesce_events([outbox_row(1, 7, 'updated'), outbox_row(2, 7, 'cancelled', attempts=2)])
+        self.assertEqual(events[0]['event'], 'cancelled')
+        self.assertEqual(events[0]['attempts'], 2)
+
+    def test_bookings_are_kept_apart(self):
+        events = coalesce_events([outbox_row(1, 7, 'created'), outbox_row(2, 8, 'updated')])
+        self.assertEqual(sorted(e['booking_id'] for e in events), [7, 8])
+
+class BackoffTest(unittest.TestCase):
+
+    def test_delay_doubles_with_jitter(self):
+        for attempts in range(4):
+            delay = backoff_seconds(attempts)
+            expected = outbox.OUTBOX_BACKOFF_BASE * 2 ** attempts
+            self.assertGreaterEqual(delay, expected * 0.8)
+            self.assertLessEqual(delay, expected * 1.2)
+
+    def test_delay_is_capped(self):
+        self.assertLessEqual(backoff_seconds(40), outbox.OUTBOX_BACKOFF_MAX * 1.2)
+
+class SinkTest(unittest.TestCase):
+
+    def test_sink_without_send_cannot_be_created(self):
+        class Silent(Sink):
+            name = 'silent'
+
+        with self.assertRaises(TypeError):
+            Silent()
+
+@unittest.skipUnless(TEST_DSN, 'OUTBOX_TEST_DATABASE_URL is not set')
+class OutboxDeliveryTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = psycopg2.connect(TEST_DSN)
+        cls.db.autocommit = True
+        with cls.db.cursor() as cursor:
+            cursor.execute(f'CREATE SCHEMA {TEST_SCHEMA}')
+            cursor.execute(f'SET search_path TO {TEST_SCHEMA}')
+            cursor.execute(SCHEMA_SQL)
+            cursor.execute((MIGRATIONS / 'V0026__add_booking_outbox.sql').read_text())
+            cursor.execute((MIGRATIONS / 'V0032__add_booking_outbox_booking_index.sql').read_text())
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.db.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA {TEST_SCHEMA} CASCADE')
+        cls.db.close()
+
+    def setUp(self):
+        self.sql('TRUNCATE booking_outbox, bookings, fleet RESTART IDENTITY CASCADE')
+        self.sql("INSERT INTO fleet (model, license_plate) VALUES ('Kia Carnival', 'А001ВС77')")
+        self.sql("INSERT INTO bookings (vehicle_id, status) VALUES (1, 'Бронь')")
+
+    def sql(self, query: str, params=None) -> list:
+        with self.db.cursor() as cursor:
+            cursor.execute(f'SET search_path TO {TEST_SCHEMA}')
+            cursor.execute(query, params)
+            return cursor.fetchall() if cursor.description else []
+
+    def add_event(self, event: str, booking_id: int = 1, attempts: int = 0) -> None:
+        self.sql('INSERT INTO booking_outbox (booking_id, event, attempts) VALUES (%s, %s, %s)',
+                 (booking_id, event, attempts))
+
+    def make_due(self) -> None:
+        """Имитирует истечение задержки повтора"""
+        self.sql('UPDATE booking_outbox SET next_attempt_at = LOCALTIMESTAMP WHERE processed_at IS NULL')
+
+    def pending(self) -> list:
+        return self.sql('SELECT id, attempts, last_error, next_attempt_at > LOCALTIMESTAMP AS delayed '
+                        'FROM booking_outbox WHERE processed_at IS NULL ORDER BY id')
+
+    def worker(self, sink: FakeSink) -> OutboxWorker:
+        worker = OutboxWorker(TEST_DSN, sink, schema=TEST_SCHEMA)
+        self.addCleanup(lambda: worker.conn is not None and worker.conn.close())
+        return worker
+
+    async def test_events_of_one_booking_are_delivered_once(self):
+        for event in ('created', 'updated', 'updated'):
+            self.add_event(event)
+        sink = FakeSink()
+        worker = self.worker(sink)
+
+        self.assertEqual(await worker.run_once(), 3)
+
+        self.assertEqual(len(sink.delivered), 1)
+        self.assertEqual(sink.delivered[0]['event'], 'created')
+        self.assertEqual(sink.delivered[0]['booking']['vehicle_model_full'], 'Kia Carnival')
+        self.assertEqual(worker.stats['coalesced'], 2)
+        self.assertEqual(self.pending(), [])
+
+    async def test_failed_delivery_is_retried_after_backoff(self):
+        self.add_event('created')
+        sink = FakeSink(fail_times=1)
+        worker = self.worker(sink)
+
+        await worker.run_once()
+        [(_, attempts, last_error, delayed)] = self.pending()
+        self.assertEqual(attempts, 1)
+        self.assertIn('fake failure', last_error)
+        self.assertTrue(delayed)
+        self.assertEqual(await worker.run_once(), 0)
+
+        self.make_due()
+        self.assertEqual(await worker.run_once(), 1)
+        self.assertEqual([e['event'] for e in sink.delivered], ['created'])
+        self.assertEqual(self.pending(), [])
+
+    async def test_event_is_given_up_after_max_attempts(self):
+        self.add_event('created', attempts=outbox.OUTBOX_MAX_ATTEMPTS - 1)
+        worker = self.worker(FakeSink(fail_times=1))
+
+        await worker.run_once()
+        self.make_due()
+
+        self.assertEqual(await worker.run_once(), 0)
+        [(_, attempts, last_error, _)] = self.pending()
+        self.assertEqual(attempts, outbox.OUTBOX_MAX_ATTEMPTS)
+        self.assertIsNotNone(last_error)
+
+    async def test_newer_event_waits_for_older_event_in_backoff(self):
+        self.add_event('created')
+        sink = FakeSink(fail_times=1)
+        worker = self.worker(sink)
+        await worker.run_once()
+
+        self.add_event('updated')
+        self.assertEqual(await worker.run_once(), 0)
+        self.assertEqual(sink.delivered, [])
+
+        self.make_due()
+        self.assertEqual(await worker.run_once(), 2)
+        self.assertEqual([e['event'] for e in sink.delivered], ['created'])
+
+    async def test_deleted_booking_is_sent_without_state(self):
+        self.sql('DELETE FROM bookings WHERE id = 1')
+        self.add_event('deleted')
+        sink = FakeSink()
+
+        await self.worker(sink).run_once()
+
+        self.assertEqual(sink.delivered, [{'booking_id': 1, 'event': 'deleted', 'booking': None}])
+
+if __name__ == '__main__':
+    unittest.main()